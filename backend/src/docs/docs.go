@@ -56,6 +56,47 @@ const docTemplate = `{
                 }
             }
         },
+        "/ai/binary/full/async/": {
+            "post": {
+                "description": "Publishes the task and returns its id; poll /binary/tasks/{id} for progress",
+                "consumes": [
+                    "multipart/form-data"
+                ],
+                "produces": [
+                    "application/json"
+                ],
+                "summary": "Upload a file without waiting for the result",
+                "parameters": [
+                    {
+                        "type": "file",
+                        "description": "File to upload",
+                        "name": "file",
+                        "in": "formData",
+                        "required": true
+                    }
+                ],
+                "responses": {
+                    "202": {
+                        "description": "Accepted",
+                        "schema": {
+                            "$ref": "#/definitions/structs.TaskCreatedResponse"
+                        }
+                    },
+                    "400": {
+                        "description": "Error retrieving the file",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "500": {
+                        "description": "Error opening or reading the file",
+                        "schema": {
+                            "type": "string"
+                        }
+                    }
+                }
+            }
+        },
         "/ai/binary/short": {
             "post": {
                 "description": "Uploads a text and processes it for a task",
@@ -98,6 +139,150 @@ const docTemplate = `{
                     }
                 }
             }
+        },
+        "/ai/binary/tasks/{id}": {
+            "get": {
+                "description": "Status (pending, running or done) and the share of finished chunks",
+                "produces": [
+                    "application/json"
+                ],
+                "summary": "Progress of a task",
+                "parameters": [
+                    {
+                        "type": "string",
+                        "description": "Task id",
+                        "name": "id",
+                        "in": "path",
+                        "required": true
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "schema": {
+                            "$ref": "#/definitions/structs.TaskStatusResponse"
+                        }
+                    },
+                    "400": {
+                        "description": "Invalid task id",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "404": {
+                        "description": "Unknown task",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "500": {
+                        "description": "Error retrieving the task",
+                        "schema": {
+                            "type": "string"
+                        }
+                    }
+                }
+            }
+        },
+        "/ai/binary/tasks/{id}/aggregates": {
+            "get": {
+                "produces": [
+                    "application/json"
+                ],
+                "summary": "Number of messages per class",
+                "parameters": [
+                    {
+                        "type": "string",
+                        "description": "Task id",
+                        "name": "id",
+                        "in": "path",
+                        "required": true
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "schema": {
+                            "$ref": "#/definitions/structs.TaskAggregatesResponse"
+                        }
+                    },
+                    "400": {
+                        "description": "Invalid task id",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "404": {
+                        "description": "Task result is not ready",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "500": {
+                        "description": "Error retrieving the task",
+                        "schema": {
+                            "type": "string"
+                        }
+                    }
+                }
+            }
+        },
+        "/ai/binary/tasks/{id}/results": {
+            "get": {
+                "produces": [
+                    "application/json"
+                ],
+                "summary": "One page of the classified messages",
+                "parameters": [
+                    {
+                        "type": "string",
+                        "description": "Task id",
+                        "name": "id",
+                        "in": "path",
+                        "required": true
+                    },
+                    {
+                        "type": "integer",
+                        "default": 0,
+                        "description": "First message",
+                        "name": "offset",
+                        "in": "query"
+                    },
+                    {
+                        "type": "integer",
+                        "default": 100,
+                        "description": "Messages per page, at most 5000",
+                        "name": "limit",
+                        "in": "query"
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "schema": {
+                            "$ref": "#/definitions/structs.TaskPageResponse"
+                        }
+                    },
+                    "400": {
+                        "description": "Invalid task id",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "404": {
+                        "description": "Task result is not ready",
+                        "schema": {
+                            "type": "string"
+                        }
+                    },
+                    "500": {
+                        "description": "Error retrieving the task",
+                        "schema": {
+                            "type": "string"
+                        }
+                    }
+                }
+            }
         }
     },
     "definitions": {
@@ -130,11 +315,85 @@ const docTemplate = `{
                         "$ref": "#/definitions/messages.MessageResult"
                     }
                 },
+                "modelVersion": {
+                    "type": "string"
+                },
                 "type": {
                     "type": "string"
                 }
             }
         },
+        "structs.TaskAggregatesResponse": {
+            "type": "object",
+            "properties": {
+                "counts": {
+                    "type": "object",
+                    "additionalProperties": {
+                        "type": "integer"
+                    }
+                },
+                "id": {
+                    "type": "string"
+                },
+                "total": {
+                    "type": "integer"
+                }
+            }
+        },
+        "structs.TaskCreatedResponse": {
+            "type": "object",
+            "properties": {
+                "id": {
+                    "type": "string"
+                },
+                "messages": {
+                    "type": "integer"
+                }
+            }
+        },
+        "structs.TaskPageResponse": {
+            "type": "object",
+            "properties": {
+                "id": {
+                    "type": "string"
+                },
+                "limit": {
+                    "type": "integer"
+                },
+                "messages": {
+                    "type": "array",
+                    "items": {
+                        "$ref": "#/definitions/messages.MessageResult"
+                    }
+                },
+                "offset": {
+                    "type": "integer"
+                },
+                "total": {
+                    "type": "integer"
+                }
+            }
+        },
+        "structs.TaskStatusResponse": {
+            "type": "object",
+            "properties": {
+                "chunks": {
+                    "type": "integer"
+                },
+                "chunksDone": {
+                    "type": "integer"
+                },
+                "id": {
+                    "type": "string"
+                },
+                "progress": {
+                    "type": "number"
+                },
+                "status": {
+                    "type": "string"
+                }
+            }
+        },
         "structs.TextTaskRequest": {
             "type": "object",
             "properties": {
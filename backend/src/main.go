@@ -13,6 +13,7 @@ func main() {
 	conn := mq.CreateConnection()
 	ch := mq.CreateChannel(conn)
 	taskQ := mq.CreateTaskQueue(ch)
+	interactiveQ := mq.CreateInteractiveQueue(ch)
 
 	rdb := mq.RedisClient()
 	ctx := context.Background()
@@ -20,7 +21,7 @@ func main() {
 	defer ch.Close()
 	defer conn.Close()
 
-	taskService := services.NewRabbitRedisTaskService(ch, taskQ, rdb, ctx)
+	taskService := services.NewRabbitRedisTaskService(ch, taskQ, interactiveQ, rdb, ctx)
 
 	app := router.InitRouter(taskService)
 
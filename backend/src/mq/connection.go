@@ -51,3 +51,24 @@ func CreateTaskQueue(ch *amqp.Channel) *amqp.Queue {
 	}
 	return &q
 }
+
+// CreateInteractiveQueue declares the queue for short requests, or returns nil
+// when RABBITMQ_INTERACTIVE_QUEUE is not set and everything goes to the task queue.
+func CreateInteractiveQueue(ch *amqp.Channel) *amqp.Queue {
+	interactiveQueue := config.Config("RABBITMQ_INTERACTIVE_QUEUE")
+	if interactiveQueue == "" {
+		return nil
+	}
+	q, err := ch.QueueDeclare(
+		interactiveQueue,
+		true,
+		false,
+		false,
+		false,
+		nil,
+	)
+	if err != nil {
+		log.Fatal(err)
+	}
+	return &q
+}
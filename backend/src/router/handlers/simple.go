@@ -6,6 +6,7 @@ import (
 	"backend/src/service/messages"
 	_ "backend/src/service/messages"
 	"backend/src/service/services"
+	"errors"
 	"github.com/gofiber/fiber/v2"
 	"github.com/google/uuid"
 	"log"
@@ -38,26 +39,12 @@ func (h *BaseHandler) FullTask(c *fiber.Ctx) error {
 	curr := time.Now()
 	log.Println("Приняли запрос:", curr)
 
-	file, err := c.FormFile("file")
-	if err != nil {
-		return c.Status(fiber.StatusBadRequest).SendString(err.Error())
-	}
-
-	src, err := file.Open()
+	task, err := newFullTask(c)
 	if err != nil {
-		return c.Status(fiber.StatusInternalServerError).SendString("Error opening the file")
-	}
-	defer src.Close()
-
-	data, err := converter.ConvertFromXLSX(src)
-
-	task := messages.CreatedFullTask{
-		ID:       uuid.New(),
-		Type:     "FullTask",
-		Messages: data,
+		return sendError(c, err)
 	}
 
-	err = h.taskService.PublishTask(&task)
+	err = h.taskService.PublishTask(task)
 	if err != nil {
 		return c.Status(fiber.StatusInternalServerError).SendString("Error publishing the task")
 	}
@@ -75,6 +62,39 @@ func (h *BaseHandler) FullTask(c *fiber.Ctx) error {
 	return c.Status(fiber.StatusCreated).JSON(res)
 }
 
+// newFullTask builds a FullTask from the uploaded Excel file; errors are *fiber.Error.
+func newFullTask(c *fiber.Ctx) (*messages.CreatedFullTask, error) {
+	file, err := c.FormFile("file")
+	if err != nil {
+		return nil, fiber.NewError(fiber.StatusBadRequest, err.Error())
+	}
+
+	src, err := file.Open()
+	if err != nil {
+		return nil, fiber.NewError(fiber.StatusInternalServerError, "Error opening the file")
+	}
+	defer src.Close()
+
+	data, err := converter.ConvertFromXLSX(src)
+	if err != nil {
+		return nil, fiber.NewError(fiber.StatusInternalServerError, "Error reading the file")
+	}
+
+	return &messages.CreatedFullTask{
+		ID:       uuid.New(),
+		Type:     "FullTask",
+		Messages: data,
+	}, nil
+}
+
+func sendError(c *fiber.Ctx, err error) error {
+	var fiberErr *fiber.Error
+	if errors.As(err, &fiberErr) {
+		return c.Status(fiberErr.Code).SendString(fiberErr.Message)
+	}
+	return c.Status(fiber.StatusInternalServerError).SendString(err.Error())
+}
+
 // ShortTask godoc
 // @Summary Upload a text for a short task
 // @Description Uploads a text and processes it for a task
@@ -0,0 +1,142 @@
+package handlers
+
+import (
+	"backend/src/router/structs"
+	"backend/src/service/services"
+	"errors"
+	"github.com/gofiber/fiber/v2"
+	"github.com/google/uuid"
+	"log"
+	"time"
+)
+
+const (
+	defaultPageLimit = 100
+	maxPageLimit     = 5000
+)
+
+// SubmitFullTask godoc
+// @Summary Upload a file without waiting for the result
+// @Description Publishes the task and returns its id; poll /binary/tasks/{id} for progress
+// @Accept multipart/form-data
+// @Produce json
+// @Param file formData file true "File to upload"
+// @Success 202 {object} structs.TaskCreatedResponse
+// @Failure 400 {string} string "Error retrieving the file"
+// @Failure 500 {string} string "Error opening or reading the file"
+// @Router /ai/binary/full/async/ [post]
+func (h *BaseHandler) SubmitFullTask(c *fiber.Ctx) error {
+	task, err := newFullTask(c)
+	if err != nil {
+		return sendError(c, err)
+	}
+
+	err = h.taskService.SubmitTask(task)
+	if err != nil {
+		return c.Status(fiber.StatusInternalServerError).SendString("Error publishing the task")
+	}
+	log.Println("Отправили таску:", task.ID, time.Now())
+
+	return c.Status(fiber.StatusAccepted).JSON(structs.TaskCreatedResponse{
+		ID:       task.ID,
+		Messages: len(task.Messages),
+	})
+}
+
+// TaskStatus godoc
+// @Summary Progress of a task
+// @Description Status (pending, running or done) and the share of finished chunks
+// @Produce json
+// @Param id path string true "Task id"
+// @Success 200 {object} structs.TaskStatusResponse
+// @Failure 400 {string} string "Invalid task id"
+// @Failure 404 {string} string "Unknown task"
+// @Failure 500 {string} string "Error retrieving the task"
+// @Router /ai/binary/tasks/{id} [get]
+func (h *BaseHandler) TaskStatus(c *fiber.Ctx) error {
+	taskID, err := uuid.Parse(c.Params("id"))
+	if err != nil {
+		return c.Status(fiber.StatusBadRequest).SendString("Invalid task id")
+	}
+
+	status, err := h.taskService.GetTaskStatus(taskID)
+	if errors.Is(err, services.ErrTaskNotFound) {
+		return c.Status(fiber.StatusNotFound).SendString("Unknown task")
+	} else if err != nil {
+		return c.Status(fiber.StatusInternalServerError).SendString("Error retrieving the task")
+	}
+	return c.JSON(status)
+}
+
+// TaskResults godoc
+// @Summary One page of the classified messages
+// @Produce json
+// @Param id path string true "Task id"
+// @Param offset query int false "First message" default(0)
+// @Param limit query int false "Messages per page, at most 5000" default(100)
+// @Success 200 {object} structs.TaskPageResponse
+// @Failure 400 {string} string "Invalid task id"
+// @Failure 404 {string} string "Task result is not ready"
+// @Failure 500 {string} string "Error retrieving the task"
+// @Router /ai/binary/tasks/{id}/results [get]
+func (h *BaseHandler) TaskResults(c *fiber.Ctx) error {
+	res, err := h.findResult(c)
+	if err != nil {
+		return sendError(c, err)
+	}
+
+	offset := max(c.QueryInt("offset", 0), 0)
+	limit := min(max(c.QueryInt("limit", defaultPageLimit), 1), maxPageLimit)
+	start := min(offset, len(res.Messages))
+	end := min(start+limit, len(res.Messages))
+
+	return c.JSON(structs.TaskPageResponse{
+		ID:       res.ID,
+		Total:    len(res.Messages),
+		Offset:   offset,
+		Limit:    limit,
+		Messages: res.Messages[start:end],
+	})
+}
+
+// TaskAggregates godoc
+// @Summary Number of messages per class
+// @Produce json
+// @Param id path string true "Task id"
+// @Success 200 {object} structs.TaskAggregatesResponse
+// @Failure 400 {string} string "Invalid task id"
+// @Failure 404 {string} string "Task result is not ready"
+// @Failure 500 {string} string "Error retrieving the task"
+// @Router /ai/binary/tasks/{id}/aggregates [get]
+func (h *BaseHandler) TaskAggregates(c *fiber.Ctx) error {
+	taskID, err := uuid.Parse(c.Params("id"))
+	if err != nil {
+		return c.Status(fiber.StatusBadRequest).SendString("Invalid task id")
+	}
+
+	aggregates, err := h.taskService.GetTaskAggregates(taskID)
+	if err != nil {
+		return sendError(c, resultError(err))
+	}
+	return c.JSON(aggregates)
+}
+
+func (h *BaseHandler) findResult(c *fiber.Ctx) (*structs.FileTaskResponse, error) {
+	taskID, err := uuid.Parse(c.Params("id"))
+	if err != nil {
+		return nil, fiber.NewError(fiber.StatusBadRequest, "Invalid task id")
+	}
+
+	res, err := h.taskService.FindTaskResult(taskID)
+	if err != nil {
+		return nil, resultError(err)
+	}
+	return res, nil
+}
+
+func resultError(err error) error {
+	if errors.Is(err, services.ErrTaskNotReady) {
+		return fiber.NewError(fiber.StatusNotFound, "Task result is not ready")
+	}
+	return fiber.NewError(fiber.StatusInternalServerError, "Error retrieving the task")
+}
@@ -35,6 +35,10 @@ func InitRouter(taskService services.TaskService) *fiber.App {
 	{
 		api.Post("/binary/full/", baseHandler.FullTask)
 		api.Post("/binary/short/", baseHandler.ShortTask)
+		api.Post("/binary/full/async/", baseHandler.SubmitFullTask)
+		api.Get("/binary/tasks/:id", baseHandler.TaskStatus)
+		api.Get("/binary/tasks/:id/results", baseHandler.TaskResults)
+		api.Get("/binary/tasks/:id/aggregates", baseHandler.TaskAggregates)
 	}
 
 	return router
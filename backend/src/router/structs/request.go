@@ -6,9 +6,10 @@ import (
 )
 
 type FileTaskResponse struct {
-	ID       uuid.UUID                `json:"id"`
-	Type     string                   `json:"type"`
-	Messages []messages.MessageResult `json:"messages"`
+	ID           uuid.UUID                `json:"id"`
+	Type         string                   `json:"type"`
+	ModelVersion string                   `json:"modelVersion,omitempty"`
+	Messages     []messages.MessageResult `json:"messages"`
 }
 
 type TextTaskRequest struct {
@@ -19,3 +20,30 @@ type TextTaskResponse struct {
 	Text   string `json:"text"`
 	Result int    `json:"result"`
 }
+
+type TaskCreatedResponse struct {
+	ID       uuid.UUID `json:"id"`
+	Messages int       `json:"messages"`
+}
+
+type TaskStatusResponse struct {
+	ID         uuid.UUID `json:"id"`
+	Status     string    `json:"status"`
+	Chunks     int       `json:"chunks"`
+	ChunksDone int       `json:"chunksDone"`
+	Progress   float64   `json:"progress"`
+}
+
+type TaskPageResponse struct {
+	ID       uuid.UUID                `json:"id"`
+	Total    int                      `json:"total"`
+	Offset   int                      `json:"offset"`
+	Limit    int                      `json:"limit"`
+	Messages []messages.MessageResult `json:"messages"`
+}
+
+type TaskAggregatesResponse struct {
+	ID     uuid.UUID   `json:"id"`
+	Total  int         `json:"total"`
+	Counts map[int]int `json:"counts"`
+}
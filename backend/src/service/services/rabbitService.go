@@ -13,20 +13,51 @@ import (
 	"time"
 )
 
+const (
+	resultWaitTimeout = 5 * time.Second
+	// submittedTaskTTL bounds how long a submitted task is known without a result,
+	// like TASK_CHUNK_TTL bounds the chunk bookkeeping of the ML worker.
+	submittedTaskTTL = time.Hour
+)
+
+var (
+	// ErrTaskNotReady is returned by FindTaskResult while the task is still being classified.
+	ErrTaskNotReady = errors.New("task result is not ready")
+	// ErrTaskNotFound is returned by GetTaskStatus for ids with neither a result nor
+	// task metadata: never submitted, expired, or dropped by the ML worker.
+	ErrTaskNotFound = errors.New("task not found")
+)
+
 type TaskService interface {
 	PublishTask(task *messages.CreatedFullTask) error
+	SubmitTask(task *messages.CreatedFullTask) error
 	GetTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error)
+	FindTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error)
+	GetTaskAggregates(taskID uuid.UUID) (*structs.TaskAggregatesResponse, error)
+	GetTaskStatus(taskID uuid.UUID) (*structs.TaskStatusResponse, error)
 }
 
 type RabbitRedisTaskService struct {
-	ch        *amqp.Channel
-	taskQueue *amqp.Queue
-	rdb       *redis.Client
-	ctx       context.Context
+	ch               *amqp.Channel
+	taskQueue        *amqp.Queue
+	interactiveQueue *amqp.Queue
+	rdb              *redis.Client
+	ctx              context.Context
+	results          *resultCache
 }
 
-func NewRabbitRedisTaskService(ch *amqp.Channel, taskQueue *amqp.Queue, rdb *redis.Client, ctx context.Context) *RabbitRedisTaskService {
-	return &RabbitRedisTaskService{ch, taskQueue, rdb, ctx}
+// NewRabbitRedisTaskService builds the service; interactiveQueue may be nil.
+func NewRabbitRedisTaskService(ch *amqp.Channel, taskQueue *amqp.Queue, interactiveQueue *amqp.Queue, rdb *redis.Client, ctx context.Context) *RabbitRedisTaskService {
+	return &RabbitRedisTaskService{ch, taskQueue, interactiveQueue, rdb, ctx, newResultCache()}
+}
+
+// queueFor sends short requests to the interactive queue, when there is one,
+// so they are not stuck behind the chunks of big files.
+func (r *RabbitRedisTaskService) queueFor(task *messages.CreatedFullTask) string {
+	if task.Type == "ShortTask" && r.interactiveQueue != nil {
+		return r.interactiveQueue.Name
+	}
+	return r.taskQueue.Name
 }
 
 func (r *RabbitRedisTaskService) PublishTask(task *messages.CreatedFullTask) error {
@@ -42,7 +73,7 @@ func (r *RabbitRedisTaskService) PublishTask(task *messages.CreatedFullTask) err
 
 	err = r.ch.Publish(
 		"",
-		r.taskQueue.Name,
+		r.queueFor(task),
 		false,
 		false,
 		message,
@@ -56,19 +87,119 @@ func (r *RabbitRedisTaskService) PublishTask(task *messages.CreatedFullTask) err
 	return nil
 }
 
+// SubmitTask publishes a task whose result is polled later. It records <id>:meta
+// first, so GetTaskStatus can tell a queued task from an unknown one.
+func (r *RabbitRedisTaskService) SubmitTask(task *messages.CreatedFullTask) error {
+	metaKey := task.ID.String() + ":meta"
+
+	pipe := r.rdb.TxPipeline()
+	pipe.HSet(r.ctx, metaKey, "messages", len(task.Messages))
+	pipe.Expire(r.ctx, metaKey, submittedTaskTTL)
+	if _, err := pipe.Exec(r.ctx); err != nil {
+		return err
+	}
+	return r.PublishTask(task)
+}
+
+// GetTaskResult waits for the result of a task. Instead of polling the result key
+// it blocks on BLPOP <id>:notify, which the ML worker pushes together with the result.
 func (r *RabbitRedisTaskService) GetTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error) {
-	key := taskID.String()
+	notifyKey := taskID.String() + ":notify"
 
 	for {
-		val, err := r.rdb.Get(r.ctx, key).Result()
-		if errors.Is(redis.Nil, err) {
-			continue
-		} else if err != nil {
-			log.Fatal(err)
-		} else {
-			var res structs.FileTaskResponse
-			err = json.Unmarshal([]byte(val), &res)
-			return &res, nil
+		res, err := r.loadTaskResult(taskID)
+		if !errors.Is(err, ErrTaskNotReady) {
+			return res, err
+		}
+
+		// The timeout only bounds the wait for a lost notice; the result is checked again.
+		err = r.rdb.BLPop(r.ctx, resultWaitTimeout, notifyKey).Err()
+		if err != nil && !errors.Is(err, redis.Nil) {
+			return nil, err
 		}
 	}
 }
+
+// FindTaskResult returns the result without waiting, or ErrTaskNotReady. The result is
+// cached, since the pages of a task are requested one after another.
+func (r *RabbitRedisTaskService) FindTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error) {
+	entry, err := r.findCached(taskID)
+	if err != nil {
+		return nil, err
+	}
+	return entry.res, nil
+}
+
+// GetTaskAggregates returns the number of messages per class, counted once per cached result.
+func (r *RabbitRedisTaskService) GetTaskAggregates(taskID uuid.UUID) (*structs.TaskAggregatesResponse, error) {
+	entry, err := r.findCached(taskID)
+	if err != nil {
+		return nil, err
+	}
+	return &structs.TaskAggregatesResponse{
+		ID:     entry.res.ID,
+		Total:  len(entry.res.Messages),
+		Counts: entry.counts,
+	}, nil
+}
+
+func (r *RabbitRedisTaskService) findCached(taskID uuid.UUID) (*cachedResult, error) {
+	if entry := r.results.get(taskID); entry != nil {
+		return entry, nil
+	}
+	res, err := r.loadTaskResult(taskID)
+	if err != nil {
+		return nil, err
+	}
+	return r.results.put(taskID, res), nil
+}
+
+func (r *RabbitRedisTaskService) loadTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error) {
+	val, err := r.rdb.Get(r.ctx, taskID.String()).Bytes()
+	if errors.Is(err, redis.Nil) {
+		return nil, ErrTaskNotReady
+	} else if err != nil {
+		return nil, err
+	}
+
+	var res structs.FileTaskResponse
+	if err = json.Unmarshal(val, &res); err != nil {
+		return nil, err
+	}
+	return &res, nil
+}
+
+// GetTaskStatus reports the progress of a task from the chunk bookkeeping of the
+// ML worker: <id>:meta holds the number of chunks, <id>:done the finished ones.
+// A task that is not split into chunks stays "pending" until its result appears.
+// Ids with neither a result nor <id>:meta give ErrTaskNotFound.
+func (r *RabbitRedisTaskService) GetTaskStatus(taskID uuid.UUID) (*structs.TaskStatusResponse, error) {
+	key := taskID.String()
+
+	pipe := r.rdb.Pipeline()
+	exists := pipe.Exists(r.ctx, key)
+	known := pipe.Exists(r.ctx, key+":meta")
+	chunks := pipe.HGet(r.ctx, key+":meta", "chunks")
+	done := pipe.SCard(r.ctx, key+":done")
+	if _, err := pipe.Exec(r.ctx); err != nil && !errors.Is(err, redis.Nil) {
+		return nil, err
+	}
+
+	if exists.Val() == 0 && known.Val() == 0 {
+		return nil, ErrTaskNotFound
+	}
+
+	status := structs.TaskStatusResponse{ID: taskID, Status: "pending"}
+	if count, err := chunks.Int(); err == nil && count > 0 {
+		status.Status = "running"
+		status.Chunks = count
+		status.ChunksDone = int(done.Val())
+		status.Progress = float64(status.ChunksDone) / float64(count)
+	}
+	if exists.Val() > 0 {
+		status.Status = "done"
+		status.ChunksDone = status.Chunks
+		status.Progress = 1
+	}
+	return &status, nil
+}
@@ -0,0 +1,65 @@
+package services
+
+import (
+	"backend/src/router/structs"
+	"github.com/google/uuid"
+	"sync"
+	"time"
+)
+
+const (
+	resultCacheSize = 8
+	resultCacheTTL  = 10 * time.Minute
+)
+
+// resultCache keeps the parsed results of the last few tasks read page by page,
+// so paging through a result GETs and unmarshals it from Redis once, not per page.
+// Results never change once written, so entries only need to expire.
+type resultCache struct {
+	mu      sync.Mutex
+	entries map[uuid.UUID]*cachedResult
+	// Insertion order, oldest first; the oldest entry is evicted when full.
+	order []uuid.UUID
+}
+
+type cachedResult struct {
+	res     *structs.FileTaskResponse
+	counts  map[int]int
+	expires time.Time
+}
+
+func newResultCache() *resultCache {
+	return &resultCache{entries: make(map[uuid.UUID]*cachedResult)}
+}
+
+func (c *resultCache) get(taskID uuid.UUID) *cachedResult {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	entry := c.entries[taskID]
+	if entry == nil || time.Now().After(entry.expires) {
+		return nil
+	}
+	return entry
+}
+
+// put stores a result together with its number of messages per class.
+func (c *resultCache) put(taskID uuid.UUID, res *structs.FileTaskResponse) *cachedResult {
+	counts := make(map[int]int)
+	for _, message := range res.Messages {
+		counts[message.Result]++
+	}
+	entry := &cachedResult{res: res, counts: counts, expires: time.Now().Add(resultCacheTTL)}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if _, ok := c.entries[taskID]; !ok {
+		c.order = append(c.order, taskID)
+	}
+	c.entries[taskID] = entry
+	for len(c.order) > resultCacheSize {
+		delete(c.entries, c.order[0])
+		c.order = c.order[1:]
+	}
+	return entry
+}
@@ -4,8 +4,10 @@ import (
 	"backend/src/router"
 	"backend/src/router/structs"
 	"backend/src/service/messages"
+	"backend/src/service/services"
 	"backend/tests/mocks"
 	"bytes"
+	"encoding/json"
 	"github.com/gofiber/fiber/v2"
 	"github.com/google/uuid"
 	"github.com/stretchr/testify/assert"
@@ -53,3 +55,100 @@ func TestBaseHandler_FullTask(t *testing.T) {
 		assert.Equal(t, fiber.StatusBadRequest, resp.StatusCode)
 	})
 }
+
+func TestBaseHandler_TaskStatus(t *testing.T) {
+	mockService := new(mocks.MockRabbitRedisTaskService)
+	app := router.InitRouter(mockService)
+
+	t.Run("Running", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("GetTaskStatus", taskID).Return(&structs.TaskStatusResponse{
+			ID:         taskID,
+			Status:     "running",
+			Chunks:     4,
+			ChunksDone: 1,
+			Progress:   0.25,
+		}, nil)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String(), nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusOK, resp.StatusCode)
+	})
+
+	t.Run("Unknown", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("GetTaskStatus", taskID).Return(nil, services.ErrTaskNotFound)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String(), nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusNotFound, resp.StatusCode)
+	})
+
+	t.Run("Invalid id", func(t *testing.T) {
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/not-a-uuid", nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusBadRequest, resp.StatusCode)
+	})
+}
+
+func TestBaseHandler_TaskResults(t *testing.T) {
+	mockService := new(mocks.MockRabbitRedisTaskService)
+	app := router.InitRouter(mockService)
+
+	t.Run("Not ready", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("FindTaskResult", taskID).Return(nil, services.ErrTaskNotReady)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String()+"/results", nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusNotFound, resp.StatusCode)
+	})
+
+	t.Run("Page", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("FindTaskResult", taskID).Return(&structs.FileTaskResponse{
+			ID:       taskID,
+			Messages: make([]messages.MessageResult, 250),
+		}, nil)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String()+"/results?offset=200&limit=100", nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusOK, resp.StatusCode)
+
+		var page structs.TaskPageResponse
+		json.NewDecoder(resp.Body).Decode(&page)
+		assert.Equal(t, 250, page.Total)
+		assert.Len(t, page.Messages, 50)
+	})
+}
+
+func TestBaseHandler_TaskAggregates(t *testing.T) {
+	mockService := new(mocks.MockRabbitRedisTaskService)
+	app := router.InitRouter(mockService)
+
+	t.Run("Not ready", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("GetTaskAggregates", taskID).Return(nil, services.ErrTaskNotReady)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String()+"/aggregates", nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusNotFound, resp.StatusCode)
+	})
+
+	t.Run("Counts", func(t *testing.T) {
+		taskID := uuid.New()
+		mockService.On("GetTaskAggregates", taskID).Return(&structs.TaskAggregatesResponse{
+			ID:     taskID,
+			Total:  3,
+			Counts: map[int]int{0: 2, 2: 1},
+		}, nil)
+
+		req := httptest.NewRequest("GET", "/ai/binary/tasks/"+taskID.String()+"/aggregates", nil)
+		resp, _ := app.Test(req)
+		assert.Equal(t, fiber.StatusOK, resp.StatusCode)
+
+		var aggregates structs.TaskAggregatesResponse
+		json.NewDecoder(resp.Body).Decode(&aggregates)
+		assert.Equal(t, 2, aggregates.Counts[0])
+	})
+}
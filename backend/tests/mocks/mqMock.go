@@ -16,7 +16,30 @@ func (m *MockRabbitRedisTaskService) PublishTask(task *messages.CreatedFullTask)
 	return args.Error(0)
 }
 
+func (m *MockRabbitRedisTaskService) SubmitTask(task *messages.CreatedFullTask) error {
+	args := m.Called(task)
+	return args.Error(0)
+}
+
 func (m *MockRabbitRedisTaskService) GetTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error) {
 	args := m.Called(taskID)
 	return args.Get(0).(*structs.FileTaskResponse), args.Error(1)
 }
+
+func (m *MockRabbitRedisTaskService) FindTaskResult(taskID uuid.UUID) (*structs.FileTaskResponse, error) {
+	args := m.Called(taskID)
+	res, _ := args.Get(0).(*structs.FileTaskResponse)
+	return res, args.Error(1)
+}
+
+func (m *MockRabbitRedisTaskService) GetTaskAggregates(taskID uuid.UUID) (*structs.TaskAggregatesResponse, error) {
+	args := m.Called(taskID)
+	res, _ := args.Get(0).(*structs.TaskAggregatesResponse)
+	return res, args.Error(1)
+}
+
+func (m *MockRabbitRedisTaskService) GetTaskStatus(taskID uuid.UUID) (*structs.TaskStatusResponse, error) {
+	args := m.Called(taskID)
+	res, _ := args.Get(0).(*structs.TaskStatusResponse)
+	return res, args.Error(1)
+}
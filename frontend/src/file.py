@@ -1,54 +1,156 @@
+import io
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 import nltk
 from nltk.corpus import stopwords
-import re
 
 RESULT = {0: "NEUTRAL", 1: "POSITIVE", 2: "NEGATIVE"}
+CATEGORIES = ["POSITIVE", "NEUTRAL", "NEGATIVE"]
+WORD_PATTERN = r"\w[\w']+"
+MAX_WORDS = 100
+PAGE_SIZE = 100
+# Messages per request when reading the whole result for the word clouds.
+SCAN_PAGE_SIZE = 5000
+POLL_INTERVAL = 0.5
+# Seconds from submission after which a task that is still not done is given up.
+TASK_TIMEOUT = 30 * 60
+
+
+@st.cache_resource
+def get_session():
+	"""One pooled HTTP session per process, shared by all pages and reruns."""
+	return requests.Session()
+
+
+def get_json(url, **params):
+	res = get_session().get(url, params=params)
+	res.raise_for_status()
+	return res.json()
 
 
-def generate_wordcloud(texts, category):
-	if len(texts) == 0:
-		st.write(f"Нет данных для категории {category}")
-		return
-
+@st.cache_resource
+def load_stopwords():
 	nltk.download('stopwords', quiet=True)
-	processed_text = " ".join(texts).lower()
-	words = re.findall(r"\w[\w']+", processed_text)
-	russian_stopwords = set(stopwords.words('russian'))
-	filtered_words = [word for word in words if word not in russian_stopwords]
-	processed_text = ' '.join(filtered_words)
+	return frozenset(stopwords.words('russian')) | {"это", "очень"}
 
-	import matplotlib.font_manager as fm
-	font_path = fm.findfont(fm.FontProperties(family="DejaVu Sans"))
 
+@st.cache_resource
+def load_font_path():
+	import matplotlib.font_manager as fm
+	return fm.findfont(fm.FontProperties(family="DejaVu Sans"))
+
+
+def page_word_counts(df):
+	words = pd.DataFrame({
+		"result": df["result"],
+		"word": df["messageText"].str.lower().str.findall(WORD_PATTERN),
+	}).explode("word")
+	words = words[words["word"].notna() & ~words["word"].isin(load_stopwords())]
+	counts = words.groupby("result")["word"].value_counts()
+	return {category: counts[category].to_dict() for category in CATEGORIES if category in counts.index}
+
+
+@st.cache_data(max_entries=16)
+def word_frequencies(url, task_id):
+	"""Top words of every category, read page by page so only the counters stay in memory."""
+	counters = {category: Counter() for category in CATEGORIES}
+	offset = 0
+	while True:
+		page = get_json(f"{url}tasks/{task_id}/results", offset=offset, limit=SCAN_PAGE_SIZE)
+		if not page["messages"]:
+			break
+		df = pd.DataFrame(page["messages"])
+		df["result"] = df["result"].map(RESULT)
+		for category, counts in page_word_counts(df).items():
+			counters[category].update(counts)
+		offset += len(page["messages"])
+		if offset >= page["total"]:
+			break
+	return {category: dict(counter.most_common(MAX_WORDS)) for category, counter in counters.items()}
+
+
+def render_wordcloud(frequencies):
 	wordcloud = WordCloud(
-		width=800,
-		height=1200,
+		width=400,
+		height=600,
 		background_color="white",
-		font_path=font_path,
-		max_words=100,
+		font_path=load_font_path(),
+		max_words=MAX_WORDS,
 		colormap="viridis",
-		stopwords={"это", "очень"},
-	).generate(processed_text)
+	).generate_from_frequencies(frequencies)
+	buffer = io.BytesIO()
+	wordcloud.to_image().save(buffer, format="PNG")
+	return buffer.getvalue()
+
 
-	fig, ax = plt.subplots(figsize=(10, 20))
-	ax.imshow(wordcloud, interpolation="bilinear")
-	ax.axis("off")
-	ax.set_title(category, fontsize=64)
-	st.pyplot(fig, clear_figure=True)
+@st.cache_data(max_entries=16)
+def render_wordclouds(task_id, _frequencies):
+	"""PNG word clouds of the categories with words, rendered in parallel."""
+	categories = [category for category in CATEGORIES if _frequencies[category]]
+	with ThreadPoolExecutor(len(CATEGORIES)) as pool:
+		images = pool.map(render_wordcloud, [_frequencies[category] for category in categories])
+	return dict(zip(categories, images))
 
 
-def send_file_to_backend(file, url):
-	files = {"file": file}
-	res = requests.post(url, files=files)
+def submit_file(file, url):
+	res = get_session().post(url + "full/async/", files={"file": file})
+	res.raise_for_status()
 	return res.json()
 
 
+def wait_for_task(url, task_id, deadline):
+	"""
+	Poll the task status until it is done, showing the share of finished chunks.
+	Returns False, after showing the reason, if the task is unknown to the backend
+	(expired or dropped) or still not done at `deadline`.
+	"""
+	bar = st.progress(0.0, text="Классификация...")
+	while True:
+		try:
+			status = get_json(f"{url}tasks/{task_id}")
+		except requests.HTTPError as e:
+			bar.empty()
+			if e.response.status_code == 404:
+				st.error("Задача не найдена: результат устарел или не был получен. Отправьте файл ещё раз")
+			else:
+				st.error(f"Не удалось получить статус задачи: {e}")
+			return False
+		if status["status"] == "done":
+			bar.empty()
+			return True
+		if time.time() > deadline:
+			bar.empty()
+			st.error("Задача не завершилась вовремя. Отправьте файл ещё раз")
+			return False
+		text = "Классификация..."
+		if status["chunks"]:
+			text = f"Классификация: {status['chunksDone']} из {status['chunks']} частей"
+		bar.progress(status["progress"], text=text)
+		time.sleep(POLL_INTERVAL)
+
+
+@st.cache_data(max_entries=16)
+def fetch_aggregates(url, task_id):
+	return get_json(f"{url}tasks/{task_id}/aggregates")
+
+
+@st.cache_data(max_entries=64)
+def fetch_page(url, task_id, page):
+	res = get_json(f"{url}tasks/{task_id}/results", offset=(page - 1) * PAGE_SIZE, limit=PAGE_SIZE)
+	df = pd.DataFrame(res["messages"])
+	if not df.empty:
+		df["result"] = df["result"].map(RESULT)
+	return df
+
+
 def download_file(url):
 	st.text("Загрузка Excel-файла")
 
@@ -56,64 +158,83 @@ def download_file(url):
 
 	if st.button("Отправить файл"):
 		if uploaded_file is not None:
-			res = send_file_to_backend(uploaded_file, url)
-
-			df = pd.DataFrame(res["messages"])
-			df["result"] = df["result"].map(RESULT)
-
-			st.write(df)
-
-			st.subheader("Распределение результатов")
-
-			result_counts = df["result"].value_counts().reset_index()
-			result_counts.columns = ["Category", "Count"]
-
-			colors = {
-				"POSITIVE": "#4CAF50",
-				"NEUTRAL": "#FFC107",
-				"NEGATIVE": "#F44336",
-			}
-
-			fig = px.bar(
-				result_counts,
-				x="Category",
-				y="Count",
-				color="Category",
-				color_discrete_map=colors,
-				text="Count",
-				height=400,
-			)
-
-			fig.update_layout(
-				title_text="Распределение эмоциональной окраски",
-				title_x=0.5,
-				xaxis_title="Категория",
-				yaxis_title="Количество",
-				showlegend=False,
-				margin=dict(l=20, r=20, t=60, b=20),
-			)
-
-			fig.update_traces(
-				texttemplate="%{text}",
-				textposition="outside",
-				marker_line_color="rgb(8,48,107)",
-				marker_line_width=1.5,
-			)
-
-			st.plotly_chart(fig, use_container_width=True)
-
-			st.subheader("Облака слов по категориям")
-
-			if "messageText" not in df.columns:
-				st.error("Отсутствует колонка с текстом сообщений")
-				return
+			st.session_state["task_id"] = submit_file(uploaded_file, url)["id"]
+			st.session_state["task_deadline"] = time.time() + TASK_TIMEOUT
+		else:
+			st.warning("Пожалуйста, загрузите файл")
 
-			cols = st.columns(3)
+	# The task id survives reruns, so paging through the table does not resend the file.
+	task_id = st.session_state.get("task_id")
+	if task_id is None:
+		return
 
-			for i, category in enumerate(["POSITIVE", "NEUTRAL", "NEGATIVE"]):
-				with cols[i]:
-					texts = df[df["result"] == category]["messageText"].tolist()
-					generate_wordcloud(texts, category)
+	if not wait_for_task(url, task_id, st.session_state["task_deadline"]):
+		# Forget the task, so the next rerun does not wait for it again.
+		del st.session_state["task_id"]
+		return
+	try:
+		aggregates = fetch_aggregates(url, task_id)
+	except requests.HTTPError:
+		st.error("Результат задачи устарел. Отправьте файл ещё раз")
+		del st.session_state["task_id"]
+		return
 
-		else:
-			st.warning("Пожалуйста, загрузите файл")
+	pages = max(1, math.ceil(aggregates["total"] / PAGE_SIZE))
+	page = st.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, value=1)
+	st.dataframe(fetch_page(url, task_id, page), use_container_width=True)
+
+	st.subheader("Распределение результатов")
+
+	result_counts = pd.DataFrame(
+		[(RESULT[int(result)], count) for result, count in aggregates["counts"].items()],
+		columns=["Category", "Count"],
+	)
+
+	colors = {
+		"POSITIVE": "#4CAF50",
+		"NEUTRAL": "#FFC107",
+		"NEGATIVE": "#F44336",
+	}
+
+	fig = px.bar(
+		result_counts,
+		x="Category",
+		y="Count",
+		color="Category",
+		color_discrete_map=colors,
+		text="Count",
+		height=400,
+	)
+
+	fig.update_layout(
+		title_text="Распределение эмоциональной окраски",
+		title_x=0.5,
+		xaxis_title="Категория",
+		yaxis_title="Количество",
+		showlegend=False,
+		margin=dict(l=20, r=20, t=60, b=20),
+	)
+
+	fig.update_traces(
+		texttemplate="%{text}",
+		textposition="outside",
+		marker_line_color="rgb(8,48,107)",
+		marker_line_width=1.5,
+	)
+
+	st.plotly_chart(fig, use_container_width=True)
+
+	st.subheader("Облака слов по категориям")
+
+	frequencies = word_frequencies(url, task_id)
+	images = render_wordclouds(task_id, frequencies)
+
+	cols = st.columns(3)
+
+	for i, category in enumerate(CATEGORIES):
+		with cols[i]:
+			st.markdown(f"**{category}**")
+			if category in images:
+				st.image(images[category], use_container_width=True)
+			else:
+				st.write(f"Нет данных для категории {category}")
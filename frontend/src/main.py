@@ -15,7 +15,7 @@ def main():
     page = st.sidebar.selectbox("Выберите страницу", ("Файл", "Строка"), index=0)
 
     if page == "Файл":
-        download_file(back + "full/")
+        download_file(back)
 
     else:
         download_text(back + "short/")
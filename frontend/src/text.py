@@ -1,13 +1,11 @@
-import pandas as pd
-import requests
 import streamlit as st
 
-from file import RESULT
+from file import RESULT, get_session
 
 
 def send_text_to_backend(text, url):
     data = {"text": text}
-    res = requests.post(url, json=data)
+    res = get_session().post(url, json=data)
     return res.json()
 
 
@@ -0,0 +1,410 @@
+"""
+Throughput and latency benchmark for the ML worker.
+
+Replays task payloads (one RabbitMQ task message per line, as published by the
+backend) or synthetic tasks through ONNXClassifier.predict ("predict" mode) or
+through the whole TaskService pipeline with an in-memory channel and Redis
+("pipeline" mode). Every point of the variant x threads x max-batch-tokens grid
+runs in a fresh process, so peak RSS is per configuration. With
+--cascade-variant each point also sweeps the cascade thresholds and reports
+the fraction of texts routed to the full model.
+
+    python benchmark.py --stub --tasks 500 --task-size 1 --lengths chat
+    python benchmark.py --model-dir ../src --variants fp32,int8 --threads 1,4 \\
+        --payloads tasks.jsonl --mode pipeline --output bench.json
+    python benchmark.py --stub --cascade-variant int8 --cascade-thresholds 0.6,0.8,0.95
+"""
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import numpy as np
+
+from stub_model import WORDS, build_stub
+
+# The worker modules are imported only inside the benchmark processes:
+# onnxruntime.quantization (used by build_stub) imports its own `onnx_model`.
+WORKER_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+LENGTHS = {
+    # (mean, sigma) of a lognormal number of words per message
+    "short": (1.0, 0.5),
+    "chat": (2.5, 0.7),
+    "long": (4.5, 0.5),
+}
+
+
+def synthetic_tasks(count: int, task_size: int, lengths: str, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    tasks = []
+    for _ in range(count):
+        messages = []
+        for idx in range(task_size):
+            if lengths == "mixed":
+                mean, sigma = LENGTHS["long" if rng.random() < 0.2 else "chat"]
+            else:
+                mean, sigma = LENGTHS[lengths]
+            words = rng.choice(WORDS, size=max(1, int(rng.lognormal(mean, sigma))))
+            messages.append({"userID": str(idx), "submitDate": "", "messageText": " ".join(words)})
+        tasks.append({"id": str(uuid.uuid4()), "type": "ShortTask" if task_size == 1 else "FullTask",
+                      "messages": messages})
+    return tasks
+
+
+def load_payloads(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class MemoryRedis:
+    """The subset of redis.Redis the worker uses, kept in a dict."""
+
+    def __init__(self):
+        self._data: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._lock:
+            if nx and key in self._data:
+                return None
+            self._data[key] = value
+            return True
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def exists(self, *keys):
+        return sum(key in self._data for key in keys)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def expire(self, key, seconds):
+        return True
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._data.setdefault(key, {}).update(mapping)
+
+    def hmget(self, key, fields):
+        values = self._data.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def hlen(self, key):
+        return len(self._data.get(key, {}))
+
+    def rpush(self, key, *values):
+        with self._lock:
+            self._data.setdefault(key, []).extend(values)
+            return len(self._data[key])
+
+    def lrange(self, key, start, end):
+        items = self._data.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def sadd(self, key, *values):
+        with self._lock:
+            members = self._data.setdefault(key, set())
+            added = len(set(values) - members)
+            members.update(values)
+            return added
+
+    def scard(self, key):
+        return len(self._data.get(key, set()))
+
+    def pipeline(self, transaction=True):
+        return _MemoryPipeline(self)
+
+
+class _MemoryPipeline:
+    def __init__(self, redis: MemoryRedis):
+        self._redis = redis
+        self._calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return record
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+
+class _Method:
+    def __init__(self, delivery_tag: int):
+        self.delivery_tag = delivery_tag
+        self.redelivered = False
+
+
+class _BenchConnection:
+    def __init__(self):
+        self._callbacks = collections.deque()
+        self.wakeup = threading.Event()
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.append(callback)
+        self.wakeup.set()
+
+    def process_data_events(self, time_limit=0):
+        while self._callbacks:
+            self._callbacks.popleft()()
+
+
+class BenchChannel:
+    """Delivers payloads to TaskService respecting basic_qos and records ack latency."""
+
+    def __init__(self, payloads: List[bytes]):
+        self.connection = _BenchConnection()
+        self._pending = collections.deque(payloads)
+        self._delivered_at: Dict[int, float] = {}
+        self._prefetch = 1
+        self._callback = None
+        self._next_tag = 0
+        self.latencies: List[float] = []
+        self.rejected = 0
+
+    def queue_declare(self, queue, **kwargs):
+        return None
+
+    def basic_qos(self, prefetch_count):
+        self._prefetch = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self._callback = on_message_callback
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self._pending.append(body)
+
+    def basic_ack(self, delivery_tag):
+        self.latencies.append(time.perf_counter() - self._delivered_at.pop(delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=False):
+        self._delivered_at.pop(delivery_tag)
+        self.rejected += 1
+
+    def stop_consuming(self):
+        self._pending.clear()
+
+    def start_consuming(self):
+        while self._pending or self._delivered_at:
+            while self._pending and len(self._delivered_at) < self._prefetch:
+                self._next_tag += 1
+                self._delivered_at[self._next_tag] = time.perf_counter()
+                self._callback(self, _Method(self._next_tag), None, self._pending.popleft())
+            self.connection.wakeup.wait(0.01)
+            self.connection.wakeup.clear()
+            self.connection.process_data_events()
+
+
+def _run_config(point: Dict[str, Any]) -> Dict[str, Any]:
+    sys.path.insert(0, WORKER_SRC)
+    os.environ.setdefault("WORKER_ID", "bench")
+    from config import WorkerConfig
+
+    tasks = point.pop("tasks")
+    config = WorkerConfig(
+        model_dir=point["model_dir"],
+        model_variant=point["variant"],
+        tokenizer_name=point["tokenizer"],
+        max_batch_tokens=point["max_batch_tokens"],
+        intra_op_threads=point["threads"],
+        prefetch_count=point["prefetch"],
+        cache_local_size=0,
+        cache_shared_ttl=0,
+        cascade_variant=point["cascade_variant"],
+        cascade_threshold=point["cascade_threshold"],
+    )
+    texts = sum(len(task["messages"]) for task in tasks)
+
+    if point["mode"] == "predict":
+        from cascade import create_predictor
+
+        predictor = create_predictor(config)
+        for task in tasks[: point["warmup"]]:
+            predictor.predict([m["messageText"] for m in task["messages"]])
+
+        latencies = []
+        started = time.perf_counter()
+        for task in tasks:
+            task_started = time.perf_counter()
+            predictor.predict([m["messageText"] for m in task["messages"]])
+            latencies.append(time.perf_counter() - task_started)
+        elapsed = time.perf_counter() - started
+        failed = 0
+    else:
+        from task_service import TaskService
+
+        bodies = [json.dumps(task).encode("utf-8") for task in tasks]
+        warmup = BenchChannel(bodies[: point["warmup"]])
+        service = TaskService(warmup, "bench", MemoryRedis(), config)
+        service.start()
+
+        channel = BenchChannel(bodies)
+        redis = MemoryRedis()
+        service = TaskService(channel, "bench", redis, config)
+        started = time.perf_counter()
+        service.start()
+        elapsed = time.perf_counter() - started
+        latencies = channel.latencies
+        # A nacked message is dropped, so a rejected task also has no result.
+        missing = sum(redis.get(task["id"]) is None for task in tasks)
+        failed = max(channel.rejected, missing)
+        predictor = service._predictor
+
+    routed_fraction = None
+    if config.cascade_variant:
+        # Warmup texts are counted too; they come from the same distribution.
+        routed_fraction = predictor.stats()["routed_fraction"]
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        **point,
+        "tasks": len(tasks),
+        "texts": texts,
+        "seconds": elapsed,
+        "texts_per_sec": texts / elapsed,
+        "tasks_per_sec": len(tasks) / elapsed,
+        "routed_fraction": routed_fraction,
+        "failed_tasks": failed,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+        },
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _onnxruntime_version() -> str:
+    import onnxruntime
+
+    return onnxruntime.__version__
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(x) for x in value.split(",")]
+
+
+def _float_list(value: str) -> List[float]:
+    return [float(x) for x in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    model = parser.add_mutually_exclusive_group(required=True)
+    model.add_argument("--model-dir", help="directory with model.onnx and its variants")
+    model.add_argument("--stub", action="store_true", help="benchmark a generated stub model")
+    parser.add_argument("--tokenizer", help="tokenizer name or path (default: the stub or rubert-tiny-turbo)")
+    parser.add_argument("--payloads", help="JSONL file with one task message per line")
+    parser.add_argument("--tasks", type=int, default=200, help="number of synthetic tasks")
+    parser.add_argument("--task-size", type=int, default=1, help="messages per synthetic task")
+    parser.add_argument("--lengths", choices=[*LENGTHS, "mixed"], default="chat")
+    parser.add_argument("--mode", choices=["predict", "pipeline"], default="predict")
+    parser.add_argument("--variants", default="fp32", help="comma-separated MODEL_VARIANT values")
+    parser.add_argument("--threads", type=_int_list, default=[0], help="intra-op threads, 0 = all cores")
+    parser.add_argument("--max-batch-tokens", type=_int_list, default=[8192])
+    parser.add_argument("--cascade-variant", default="", help="first-stage MODEL_VARIANT of the cascade")
+    parser.add_argument("--cascade-thresholds", type=_float_list, default=[0.9])
+    parser.add_argument("--prefetch", type=int, default=32, help="basic_qos prefetch in pipeline mode")
+    parser.add_argument("--warmup", type=int, default=10, help="tasks replayed before timing")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    model_dir = args.model_dir
+    tokenizer = args.tokenizer or "sergeyzh/rubert-tiny-turbo"
+    if args.stub:
+        model_dir = build_stub(tempfile.mkdtemp(prefix="stub_model_"))
+        tokenizer = args.tokenizer or model_dir
+
+    if args.payloads:
+        tasks = load_payloads(args.payloads)
+    else:
+        tasks = synthetic_tasks(args.tasks, args.task_size, args.lengths)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    thresholds = args.cascade_thresholds if args.cascade_variant else [0.0]
+    grid = itertools.product(args.variants.split(","), args.threads, args.max_batch_tokens, thresholds)
+    for variant, threads, max_batch_tokens, threshold in grid:
+        point = {
+            "mode": args.mode,
+            "model_dir": model_dir,
+            "tokenizer": tokenizer,
+            "variant": variant,
+            "threads": threads,
+            "max_batch_tokens": max_batch_tokens,
+            "cascade_variant": args.cascade_variant,
+            "cascade_threshold": threshold,
+            "prefetch": args.prefetch,
+            "warmup": args.warmup,
+            "tasks": tasks,
+        }
+        with ctx.Pool(1) as pool:
+            result = pool.apply(_run_config, (point,))
+        results.append(result)
+        cascade = ""
+        if args.cascade_variant:
+            cascade = (
+                f"{args.cascade_variant}@{threshold:g} "
+                f"routed={result['routed_fraction']:.1%}  "
+            )
+        print(
+            f"{variant:>9} threads={threads:<3} max_batch_tokens={max_batch_tokens:<6} {cascade}"
+            f"{result['texts_per_sec']:10.1f} texts/s  "
+            f"p50={result['latency_ms']['p50']:8.2f}ms p95={result['latency_ms']['p95']:8.2f}ms "
+            f"p99={result['latency_ms']['p99']:8.2f}ms  rss={result['peak_rss_mb']:.0f}MB"
+        )
+        if result["failed_tasks"]:
+            print(f"{result['failed_tasks']} of {result['tasks']} tasks were rejected or never stored",
+                  file=sys.stderr)
+
+    if args.output:
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "onnxruntime": _onnxruntime_version(),
+                "cpus": os.cpu_count(),
+                "payloads": args.payloads or f"synthetic:{args.lengths}:{args.tasks}x{args.task_size}",
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # Throughput of a run that lost tasks is meaningless.
+    if any(result["failed_tasks"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Build a small stand-in for the production classifier, so the benchmarks run
+without the fine-tuned model: a word-level tokenizer and an ONNX graph with
+the same inputs/outputs as model.onnx (embeddings, a stack of per-token dense
+layers, masked mean pooling and a classifier head), plus its INT8 variant.
+"""
+import json
+import os
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"]
+WORDS = (
+    "спасибо ок хорошо плохо отлично ужасно связь интернет тариф деньги "
+    "оператор поддержка роуминг сим карта баланс звонок смс скорость сеть "
+    "быстро медленно дорого дешево снова опять никогда всегда очень можно"
+).split()
+
+
+def build_stub(directory: str, hidden_size: int = 312, layers: int = 3, num_labels: int = 3) -> str:
+    """
+    Write tokenizer.json, tokenizer_config.json, model.onnx and model.int8.onnx.
+
+    Args:
+        directory (str): Output directory, created if missing.
+        hidden_size (int): Width of the token representations. Defaults to 312, as in rubert-tiny.
+        layers (int): Number of per-token dense layers. Defaults to 3.
+        num_labels (int): Number of output classes. Defaults to 3.
+
+    Returns:
+        str: The directory, usable both as MODEL_DIR and as TOKENIZER_NAME.
+    """
+    os.makedirs(directory, exist_ok=True)
+    vocab = {token: idx for idx, token in enumerate(SPECIAL_TOKENS + WORDS)}
+
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])],
+    )
+    tokenizer.save(os.path.join(directory, "tokenizer.json"))
+    with open(os.path.join(directory, "tokenizer_config.json"), "w") as f:
+        json.dump({
+            "tokenizer_class": "PreTrainedTokenizerFast",
+            "pad_token": "[PAD]",
+            "unk_token": "[UNK]",
+            "cls_token": "[CLS]",
+            "sep_token": "[SEP]",
+            "model_max_length": 2048,
+        }, f)
+
+    rng = np.random.default_rng(0)
+
+    def weight(name, *shape):
+        return numpy_helper.from_array(
+            (rng.standard_normal(shape) / np.sqrt(shape[0])).astype(np.float32), name
+        )
+
+    initializers = [
+        weight("embeddings", len(vocab), hidden_size),
+        weight("classifier", hidden_size, num_labels),
+        numpy_helper.from_array(np.array([1], dtype=np.int64), "seq_axis"),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), "feature_axis"),
+    ]
+    nodes = [helper.make_node("Gather", ["embeddings", "input_ids"], ["hidden_0"])]
+    for layer in range(layers):
+        initializers.append(weight(f"dense_{layer}", hidden_size, hidden_size))
+        nodes += [
+            helper.make_node("MatMul", [f"hidden_{layer}", f"dense_{layer}"], [f"linear_{layer}"]),
+            helper.make_node("Relu", [f"linear_{layer}"], [f"hidden_{layer + 1}"]),
+        ]
+    nodes += [
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Unsqueeze", ["mask", "feature_axis"], ["mask_3d"]),
+        helper.make_node("Mul", [f"hidden_{layers}", "mask_3d"], ["masked"]),
+        helper.make_node("ReduceSum", ["masked", "seq_axis"], ["summed"], keepdims=0),
+        helper.make_node("ReduceSum", ["mask_3d", "seq_axis"], ["count"], keepdims=0),
+        helper.make_node("Div", ["summed", "count"], ["pooled"]),
+        helper.make_node("MatMul", ["pooled", "classifier"], ["logits"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "stub_classifier",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch_size", "sequence_length"]),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch_size", "sequence_length"]),
+        ],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch_size", num_labels])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, os.path.join(directory, "model.onnx"))
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        os.path.join(directory, "model.onnx"),
+        os.path.join(directory, "model.int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+    return directory
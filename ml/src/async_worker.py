@@ -0,0 +1,286 @@
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import logging
+import os
+import signal
+import time
+from typing import Dict, List, Optional, Set, Union
+
+import aio_pika
+import redis.asyncio as aioredis
+
+import metrics
+from config import WorkerConfig
+from lanes import LANE_BULK, LANE_INTERACTIVE
+from prediction_cache import AsyncPredictionCache
+from result_codec import FORMAT_JSON
+from task_base import BaseTaskService, Job
+
+
+logger = logging.getLogger(os.getenv("WORKER_ID")+".async_worker")
+
+
+class AsyncTaskService(BaseTaskService):
+    """
+    asyncio counterpart of TaskService (WORKER_MODE=async): same queue, task
+    messages, chunk protocol and Redis results, so the two are interchangeable.
+
+    aio-pika keeps up to PREFETCH_COUNT unacked messages, each handled by its
+    own asyncio task, so heartbeats, acks and Redis round trips never wait for
+    the model. Decoding, tokenization, result encoding and chunk assembly run
+    in a single-thread executor; inference runs in another one, which merges
+    concurrent short tasks through DynamicBatcher and hands the results back
+    to the event loop. The Redis writes of a task go out as one pipeline.
+
+    With RABBITMQ_INTERACTIVE_QUEUE set, the interactive queue gets its own
+    consumer with INTERACTIVE_RESERVED prefetch slots, and its jobs go ahead
+    of bulk ones on the way to inference, as in TaskService. Model hot swaps
+    (MODEL_WATCH_INTERVAL) work the same way too.
+    """
+
+    def __init__(self, channel, task_queue: str, redis, config: WorkerConfig = WorkerConfig()):
+        super().__init__(config)
+        self._channel = channel
+        self._task_queue = task_queue
+        self._redis = redis
+        self._cache = AsyncPredictionCache(
+            redis,
+            model_version=self._predictor.version,
+            local_size=config.cache_local_size,
+            shared_ttl=config.cache_shared_ttl,
+            shared_max_entries=config.cache_shared_max_entries,
+        )
+
+        self._tokenize_pool = concurrent.futures.ThreadPoolExecutor(1, "tokenize")
+        self._inference_pool = concurrent.futures.ThreadPoolExecutor(1, "inference")
+        # Inference futures by id(job), resolved from the inference thread.
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        inference = loop.run_in_executor(self._inference_pool, self._inference_loop, loop)
+        self._start_watcher()
+
+        # Without global=True the QoS applies to each consumer started after it.
+        bulk_prefetch, interactive_prefetch = self._prefetch_limits()
+        consumers = [(self._task_queue, bulk_prefetch, LANE_BULK)]
+        if self._interactive_queue:
+            consumers.append((self._interactive_queue, interactive_prefetch, LANE_INTERACTIVE))
+        tags = []
+        for name, prefetch, lane in consumers:
+            await self._channel.set_qos(prefetch_count=prefetch)
+            task_queue = await self._channel.declare_queue(name, passive=True)
+            tag = await task_queue.consume(functools.partial(self._on_message, lane=lane))
+            tags.append((task_queue, tag))
+        try:
+            await self._stopping.wait()
+        finally:
+            # Finish and ack what was already delivered, as TaskService does.
+            self._stop_watcher()
+            for task_queue, tag in tags:
+                await task_queue.cancel(tag)
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+            self._tokenized.put(None)
+            await inference
+
+    def stop(self):
+        """Stop consuming; in-flight tasks are finished and acked by start()."""
+        self._stopping.set()
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage, lane: str = LANE_BULK):
+        task = asyncio.create_task(self._handle(message, lane))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage, lane: str):
+        logger.info(f"Получили таску {datetime.datetime.now()}")
+        job = Job(
+            message.delivery_tag,
+            message.redelivered,
+            message.body,
+            received_at=time.monotonic(),
+            trace_id=(message.headers or {}).get("x-trace-id"),
+            lane=lane,
+        )
+        metrics.IN_FLIGHT.inc()
+        stage = "tokenize"
+        try:
+            with metrics.TOKENIZE_SECONDS.time():
+                split = await self._prepare(job)
+            if split:
+                await self._split(job, message)
+                return
+
+            stage = "inference"
+            await self._predict(job)
+
+            stage = "publish"
+            with metrics.PUBLISH_SECONDS.time():
+                await self._publish(job)
+            await message.ack()
+        except Exception:
+            logger.exception(
+                f"Ошибка обработки таски {datetime.datetime.now()} trace={job.trace_id}"
+            )
+            metrics.ERRORS.labels(stage).inc()
+            # Give a task one more try on another worker, then drop it.
+            await message.nack(requeue=not message.redelivered)
+            return
+        finally:
+            metrics.IN_FLIGHT.dec()
+
+        metrics.TASKS.labels(job.data.get("type", "")).inc()
+        metrics.TEXTS.inc(len(job.results))
+        logger.info(f"Отправили таску {datetime.datetime.now()} trace={job.trace_id}")
+
+        if not self._cache_labels:
+            return
+        try:
+            await self._cache.store(job.miss_keys, job.predicted)
+        except Exception:
+            logger.exception("Не удалось обновить кэш предсказаний")
+
+    async def _prepare(self, job: Job) -> bool:
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self._tokenize_pool, self._decode, job):
+            return True
+
+        job.predictor = self._predictor
+        texts = [x["messageText"] for x in job.data["messages"]]
+        keys = await loop.run_in_executor(
+            self._tokenize_pool, self._cache.keys, texts, job.predictor.version
+        )
+        cached = await self._cache.lookup(keys) if self._uses_cache(job) else None
+        miss_texts = self._collect_misses(job, texts, keys, cached)
+        job.encoded = await loop.run_in_executor(
+            self._tokenize_pool, job.predictor.encode, miss_texts
+        )
+        job.ready_at = time.monotonic()
+        return False
+
+    async def _predict(self, job: Job):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[id(job)] = future
+        self._tokenized.put(job)
+        await future
+
+    def _inference_loop(self, loop: asyncio.AbstractEventLoop):
+        def finished(jobs: List[Job], error: Optional[Exception]):
+            for job in jobs:
+                loop.call_soon_threadsafe(_resolve, self._waiting.pop(id(job)), error)
+
+        while True:
+            jobs = self._batcher.next_batch(self._tokenized)
+            if jobs is None:
+                return
+            self._infer_batch(jobs, finished)
+
+    async def _split(self, job: Job, message: aio_pika.abc.AbstractIncomingMessage):
+        data = job.data
+        meta, bodies = self._chunk_bodies(data)
+
+        meta_key = f"{data['id']}:meta"
+        pipe = self._redis.pipeline()
+        pipe.hset(meta_key, mapping=meta)
+        pipe.expire(meta_key, self._chunk_ttl)
+        await pipe.execute()
+
+        # The original message is acked only after all of its chunks are confirmed.
+        for body in bodies:
+            await self._channel.default_exchange.publish(
+                aio_pika.Message(body, content_type="application/json"),
+                routing_key=self._task_queue,
+            )
+        await message.ack()
+        logger.info(f"Разбили таску на {len(bodies)} частей {datetime.datetime.now()}")
+
+    async def _publish(self, job: Job):
+        # Encoding a result or assembling a file reads and writes JSON of the
+        # whole task: run it on the tokenize thread to keep the loop free.
+        loop = asyncio.get_running_loop()
+        data = job.data
+        encoded = await loop.run_in_executor(self._tokenize_pool, self._encode_result, job)
+        if "chunk" not in data:
+            await self._store_result(data["id"], encoded)
+            return
+
+        chunk = data["chunk"]
+        chunks_key = f"{data['id']}:chunks"
+        done_key = f"{data['id']}:done"
+        pipe = self._redis.pipeline()
+        pipe.rpush(chunks_key, encoded)
+        pipe.sadd(done_key, chunk["index"])
+        pipe.scard(done_key)
+        pipe.expire(chunks_key, self._chunk_ttl)
+        pipe.expire(done_key, self._chunk_ttl)
+        _, _, finished, _, _ = await pipe.execute()
+        if finished != chunk["count"]:
+            return
+
+        pipe = self._redis.pipeline()
+        self._queue_assembly_claim(pipe, data["id"])
+        if self._assembly_claimed(job, *await pipe.execute()):
+            raw_parts = await self._redis.lrange(chunks_key, 0, -1)
+            payload = await loop.run_in_executor(
+                self._tokenize_pool, self._encode_assembled, job, raw_parts
+            )
+            await self._store_result(data["id"], payload)
+
+    def _encode_result(self, job: Job) -> Union[str, bytes]:
+        """The result of a whole task, or the `<id>:chunks` entry of a chunk."""
+        if job.result_format == FORMAT_JSON:
+            self._attach_results(job.data["messages"], job.results, job.probs)
+        if "chunk" in job.data:
+            return self._chunk_entry(job)
+        return self._result_payload(job.data, job.results, job.probs, job.result_format)
+
+    def _encode_assembled(self, job: Job, raw_parts: List[bytes]) -> Union[str, bytes]:
+        result, results, probs = self._assembled(job, raw_parts)
+        return self._result_payload(result, results, probs, job.result_format)
+
+    async def _store_result(self, task_id: str, payload):
+        pipe = self._redis.pipeline()
+        self._queue_result(pipe, task_id, payload)
+        await pipe.execute()
+
+
+def _resolve(future: asyncio.Future, error: Optional[Exception]):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+async def run_async_worker(config: WorkerConfig, metrics_port: int = 0):
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    metrics.serve(metrics_port)
+    connection = await aio_pika.connect_robust(config.rabbitmq_url)
+    channel = await connection.channel()
+    r = aioredis.Redis.from_url(config.redis_url)
+    connected = time.perf_counter()
+
+    # Model loading is blocking: keep it off the loop so heartbeats go on.
+    task_svc = await loop.run_in_executor(
+        None, AsyncTaskService, channel, config.task_queue, r, config
+    )
+    ready = time.perf_counter()
+    logger.info(
+        f"Воркер готов за {ready - started:.2f}s: "
+        f"connect={connected - started:.2f}s service={ready - connected:.2f}s"
+    )
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, task_svc.stop)
+    try:
+        await task_svc.start()
+    finally:
+        await connection.close()
+        await r.aclose()
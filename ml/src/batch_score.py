@@ -0,0 +1,285 @@
+"""
+Offline scoring of large message exports, without RabbitMQ and Redis.
+
+Streams rows (userID, submitDate, messageText) from an xlsx sheet (openpyxl
+read-only mode), a csv file with the same columns or a jsonl file of message
+objects, strips HTML with the backend's rules and classifies blocks of rows
+in worker processes, one model per process. Labels are appended to a CSV file
+or a Parquet dataset (one part file per block) as blocks finish, and a
+checkpoint next to the output records the progress, so an interrupted run
+continues from the last finished block with --resume. At most 2 x --workers
+blocks are in memory at a time, whatever the input size.
+
+    python batch_score.py export.xlsx scored.csv --model-dir /models
+    python batch_score.py export.jsonl scored.parquet --workers 4 --resume
+"""
+import argparse
+import collections
+import csv
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cascade import create_predictor
+from config import WorkerConfig
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+
+
+logger = logging.getLogger("batch_score")
+
+# Same pattern as DropHTML in the backend's excelconverter.go.
+HTML_PATTERN = re.compile(r"<[^>]*>|&nbsp;")
+COLUMNS = ("userID", "submitDate", "messageText")
+
+Row = Tuple[str, str, str]
+
+
+def read_rows(path: str) -> Iterator[Row]:
+    """Yield (userID, submitDate, messageText) rows without loading the whole file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xlsx":
+        yield from _xlsx_rows(path)
+    elif ext == ".csv":
+        yield from _csv_rows(path)
+    elif ext == ".jsonl":
+        yield from _jsonl_rows(path)
+    else:
+        raise ValueError(f"Unsupported input {path!r}, expected .xlsx, .csv or .jsonl")
+
+
+def _xlsx_rows(path: str) -> Iterator[Row]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for values in sheet.iter_rows(min_row=2, max_col=3, values_only=True):
+            row = tuple("" if value is None else str(value) for value in values)
+            row += ("",) * (3 - len(row))
+            # Like ConvertFromXLSX, the first row without a userID ends the data.
+            if not row[0]:
+                break
+            yield row
+    finally:
+        workbook.close()
+
+
+def _csv_rows(path: str) -> Iterator[Row]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for values in reader:
+            if values:
+                yield tuple((values + ["", "", ""])[:3])
+
+
+def _jsonl_rows(path: str) -> Iterator[Row]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                message = json.loads(line)
+                yield tuple(str(message.get(column, "")) for column in COLUMNS)
+
+
+def blocks(rows: Iterator[Row], block_size: int, skip: int = 0) -> Iterator[Tuple[int, List[Row]]]:
+    """Number the rows in blocks of `block_size`, passing over the first `skip` blocks."""
+    index = 0
+    block: List[Row] = []
+    for row in rows:
+        block.append(row)
+        if len(block) == block_size:
+            if index >= skip:
+                yield index, block
+            index += 1
+            block = []
+    if block and index >= skip:
+        yield index, block
+
+
+_predictor = None
+
+
+def _init_worker(config: WorkerConfig):
+    global _predictor
+    _predictor = create_predictor(config)
+
+
+def _score(block: Tuple[int, List[Row]]) -> Tuple[int, List[Row], List[int]]:
+    index, rows = block
+    rows = [(user_id, date, HTML_PATTERN.sub("", text)) for user_id, date, text in rows]
+    return index, rows, _predictor.predict([row[2] for row in rows])
+
+
+class CsvSink:
+    """Appends scored rows to one CSV file; resuming cuts it back to the checkpoint."""
+
+    def __init__(self, path: str, resume_bytes: Optional[int]):
+        self.path = path
+        if resume_bytes is not None:
+            with open(path, "r+b") as f:
+                f.truncate(resume_bytes)
+        self._file = open(path, "w" if resume_bytes is None else "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if resume_bytes is None:
+            self._writer.writerow([*COLUMNS, "result"])
+
+    def write(self, index: int, rows: List[Row], results: List[int]) -> Dict[str, Any]:
+        self._writer.writerows([*row, result] for row, result in zip(rows, results))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"csv_bytes": os.fstat(self._file.fileno()).st_size}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """Writes one Parquet file per block into a dataset directory."""
+
+    def __init__(self, path: str, resume_blocks: Optional[int]):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Parts past the checkpoint come from an interrupted block.
+        for name in os.listdir(path):
+            if name.startswith("part-") and (
+                resume_blocks is None or int(name[5:11]) >= resume_blocks
+            ):
+                os.remove(os.path.join(path, name))
+
+    def write(self, index: int, rows: List[Row], results: List[int]) -> Dict[str, Any]:
+        columns = {name: [row[pos] for row in rows] for pos, name in enumerate(COLUMNS)}
+        table = self._pa.table({**columns, "result": self._pa.array(results, self._pa.int8())})
+        self._pq.write_table(table, os.path.join(self.path, f"part-{index:06d}.parquet"))
+        return {}
+
+    def close(self):
+        pass
+
+
+class Checkpoint:
+    """Progress of one run, stored as JSON next to the output and replaced atomically."""
+
+    def __init__(self, output: str, input_path: str, block_size: int, resume: bool):
+        self.path = f"{output.rstrip(os.sep)}.checkpoint.json"
+        self.state: Dict[str, Any] = {
+            "input": os.path.abspath(input_path),
+            "block_size": block_size,
+            "blocks": 0,
+            "rows": 0,
+        }
+        if resume and os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            if (saved["input"], saved["block_size"]) != (self.state["input"], block_size):
+                raise ValueError(
+                    f"{self.path} belongs to {saved['input']} with block size "
+                    f"{saved['block_size']}, not to this run"
+                )
+            self.state = saved
+
+    @property
+    def resumed(self) -> bool:
+        return self.state["blocks"] > 0
+
+    def advance(self, rows: int, extra: Dict[str, Any]):
+        self.state.update(extra, blocks=self.state["blocks"] + 1, rows=self.state["rows"] + rows)
+        partial_path = f"{self.path}.tmp"
+        with open(partial_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(partial_path, self.path)
+
+
+def score_file(
+    input_path: str,
+    output: str,
+    config: WorkerConfig,
+    workers: int,
+    block_size: int,
+    resume: bool = False,
+) -> int:
+    """Score `input_path` into `output` (.csv or Parquet directory); returns the rows written."""
+    checkpoint = Checkpoint(output, input_path, block_size, resume)
+    skip = checkpoint.state["blocks"]
+    if output.endswith(".csv"):
+        sink = CsvSink(output, checkpoint.state.get("csv_bytes") if checkpoint.resumed else None)
+    else:
+        sink = ParquetSink(output, skip if checkpoint.resumed else None)
+    if checkpoint.resumed:
+        logger.info(f"Продолжаем с блока {skip} ({checkpoint.state['rows']} строк готово)")
+
+    started = time.perf_counter()
+    rows_done = 0
+    pending = collections.deque()
+
+    def finish(result):
+        nonlocal rows_done
+        index, rows, results = result
+        checkpoint.advance(len(rows), sink.write(index, rows, results))
+        rows_done += len(rows)
+        logger.info(
+            f"Блок {index}: {checkpoint.state['rows']} строк, "
+            f"{rows_done / (time.perf_counter() - started):.0f} строк/с"
+        )
+
+    # The blocks are handed out by hand rather than with imap: the pool would
+    # read the whole input ahead of the workers.
+    ctx = multiprocessing.get_context("fork")
+    try:
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for block in blocks(read_rows(input_path), block_size, skip):
+                pending.append(pool.apply_async(_score, (block,)))
+                if len(pending) >= 2 * workers:
+                    finish(pending.popleft().get())
+            while pending:
+                finish(pending.popleft().get())
+    finally:
+        sink.close()
+    return rows_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help=".xlsx, .csv or .jsonl file")
+    parser.add_argument("output", help=".csv file or Parquet dataset directory")
+    parser.add_argument("--model-dir", help="overrides MODEL_DIR")
+    parser.add_argument("--variant", help="overrides MODEL_VARIANT")
+    parser.add_argument("--tokenizer", help="overrides TOKENIZER_NAME")
+    parser.add_argument("--workers", type=int, default=len(os.sched_getaffinity(0)))
+    parser.add_argument("--block-size", type=int, default=10_000, help="rows per block")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint")
+    args = parser.parse_args()
+
+    config = WorkerConfig.from_env()
+    overrides = {
+        "model_dir": args.model_dir,
+        "model_variant": args.variant,
+        "tokenizer_name": args.tokenizer,
+    }
+    config = dataclasses.replace(config, **{k: v for k, v in overrides.items() if v})
+    if config.intra_op_threads == 0:
+        # Split the cores between worker processes, as the worker supervisor does.
+        cpus = len(os.sched_getaffinity(0))
+        config = dataclasses.replace(config, intra_op_threads=max(1, cpus // args.workers))
+
+    rows = score_file(args.input, args.output, config, args.workers, args.block_size, args.resume)
+    logger.info(f"Готово: {rows} строк записано в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
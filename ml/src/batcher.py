@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+
+_NOTHING = object()
+
+
+class DynamicBatcher:
+    """
+    Groups small jobs from the inference queue into a single model call.
+
+    A job is "small" when it carries at most `small_task_texts` texts. After the
+    first small job arrives, the batcher keeps taking small jobs for up to
+    `max_wait_ms` or until `max_texts` texts are collected. Large jobs are
+    always dispatched alone: predict already batches them internally.
+
+    Jobs must expose `encoded` (token ids per text), `ready_at`
+    (time.monotonic() when the job entered the queue) and `lane`.
+    """
+
+    def __init__(self, max_wait_ms: float, max_texts: int, small_task_texts: int):
+        self.max_wait = max_wait_ms / 1000
+        self.max_texts = max_texts
+        self.small_task_texts = small_task_texts
+        self._pending: Any = _NOTHING
+
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._jobs = 0
+        self._texts = 0
+        self._fill_sum = 0.0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+
+    def next_batch(self, source: queue.Queue) -> Optional[List[Any]]:
+        """Block for the next batch of jobs; None means the queue was closed."""
+        if self._pending is not _NOTHING:
+            first, self._pending = self._pending, _NOTHING
+        else:
+            first = source.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        texts = len(first.encoded)
+        if texts > self.small_task_texts:
+            return self._dispatch(batch, texts)
+
+        deadline = time.monotonic() + self.max_wait
+        while texts < self.max_texts:
+            timeout = deadline - time.monotonic()
+            try:
+                job = source.get(timeout=timeout) if timeout > 0 else source.get_nowait()
+            except queue.Empty:
+                break
+            # Shutdown markers and jobs that don't fit open the next batch.
+            if (
+                job is None
+                or len(job.encoded) > self.small_task_texts
+                or texts + len(job.encoded) > self.max_texts
+            ):
+                self._pending = job
+                break
+            batch.append(job)
+            texts += len(job.encoded)
+
+        return self._dispatch(batch, texts)
+
+    def take_pending(self, lane: str) -> List[Any]:
+        """Remove the job held back for the next batch if it is in `lane`, as a list."""
+        job = self._pending
+        if job is _NOTHING or job is None or job.lane != lane:
+            return []
+        self._pending = _NOTHING
+        return [job]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            batches = max(self._batches, 1)
+            jobs = max(self._jobs, 1)
+            return {
+                "batches": self._batches,
+                "jobs": self._jobs,
+                "texts": self._texts,
+                "avg_batch_fill": self._fill_sum / batches,
+                "avg_queue_wait_ms": self._wait_sum / jobs * 1000,
+                "max_queue_wait_ms": self._wait_max * 1000,
+            }
+
+    def _dispatch(self, batch: List[Any], texts: int) -> List[Any]:
+        now = time.monotonic()
+        waits = [now - job.ready_at for job in batch]
+        for wait in waits:
+            metrics.BATCH_QUEUE_WAIT.observe(wait)
+        metrics.BATCH_FILL.observe(min(texts / self.max_texts, 1.0))
+        metrics.BATCH_TEXTS.set(texts)
+        with self._lock:
+            self._batches += 1
+            self._jobs += len(batch)
+            self._texts += texts
+            self._fill_sum += min(texts / self.max_texts, 1.0)
+            self._wait_sum += sum(waits)
+            self._wait_max = max(self._wait_max, *waits)
+        return batch
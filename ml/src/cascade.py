@@ -0,0 +1,106 @@
+import threading
+from typing import Dict, List, Union
+
+import numpy as np
+
+import metrics
+from config import WorkerConfig
+from onnx_model import ONNXClassifier
+
+
+class CascadeClassifier:
+    """
+    Two-stage classifier: a cheap model (e.g. the INT8 export) labels every
+    text, and only texts whose top probability is below `threshold` are sent
+    to the full model. Both models must share the tokenizer and label set.
+
+    Exposes the ONNXClassifier interface used by TaskService. The threshold
+    is calibrated offline against a validation set, see
+    ml_research ONNXExporter.calibrate_cascade.
+    """
+
+    def __init__(self, fast: ONNXClassifier, full: ONNXClassifier, threshold: float):
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        # Cached labels depend on both models and on the threshold.
+        self.version = f"{fast.version}-{full.version}-{threshold:g}"
+
+        self._lock = threading.Lock()
+        self._texts = 0
+        self._routed = 0
+
+    def predict(self, texts: List[str]) -> List[int]:
+        return self.predict_encoded(self.encode(texts))
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        return self.predict_proba_encoded(self.encode(texts))
+
+    def encode(self, texts: List[str]) -> List[List[int]]:
+        return self.full.encode(texts)
+
+    def warmup(self):
+        self.fast.warmup()
+        self.full.warmup()
+
+    @property
+    def load_seconds(self) -> Dict[str, float]:
+        return {
+            **{f"fast_{phase}": sec for phase, sec in self.fast.load_seconds.items()},
+            **self.full.load_seconds,
+        }
+
+    def predict_encoded(self, encoded: List[List[int]]) -> List[int]:
+        if not encoded:
+            return []
+        return np.argmax(self.predict_proba_encoded(encoded), axis=1).tolist()
+
+    def predict_proba_encoded(self, encoded: List[List[int]]) -> np.ndarray:
+        """Softmax class probabilities, from the full model for routed texts."""
+        if not encoded:
+            return np.empty((0, 0), dtype=np.float32)
+        probs = self.fast.predict_proba_encoded(encoded)
+        uncertain = np.flatnonzero(probs.max(axis=1) < self.threshold)
+        if len(uncertain):
+            probs[uncertain] = self.full.predict_proba_encoded(
+                [encoded[idx] for idx in uncertain]
+            )
+
+        metrics.CASCADE_TEXTS.labels("fast").inc(len(encoded) - len(uncertain))
+        metrics.CASCADE_TEXTS.labels("full").inc(len(uncertain))
+        with self._lock:
+            self._texts += len(encoded)
+            self._routed += len(uncertain)
+        return probs
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "texts": self._texts,
+                "routed_to_full": self._routed,
+                "routed_fraction": self._routed / max(self._texts, 1),
+            }
+
+
+def create_predictor(config: WorkerConfig) -> Union[ONNXClassifier, CascadeClassifier]:
+    """The MODEL_VARIANT classifier, behind a CASCADE_VARIANT first stage if one is set."""
+
+    def load(onnx_path: str) -> ONNXClassifier:
+        return ONNXClassifier(
+            onnx_path=onnx_path,
+            tokenizer_name=config.tokenizer_name,
+            max_length=config.max_length,
+            max_batch_tokens=config.max_batch_tokens,
+            intra_op_threads=config.intra_op_threads,
+            inter_op_threads=config.inter_op_threads,
+            length_buckets=config.length_buckets,
+            bucket_max_rows=config.bucket_max_rows,
+            truncation=config.truncation,
+            adaptive_length_quantile=config.adaptive_length_quantile,
+            session_cache_dir=config.session_cache_dir,
+        )
+
+    full = load(config.onnx_path)
+    if not config.cascade_variant:
+        return full
+    return CascadeClassifier(load(config.cascade_onnx_path), full, config.cascade_threshold)
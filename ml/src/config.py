@@ -0,0 +1,154 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return value.lower() in ("1", "true", "yes") if value else default
+
+
+def _env_ints(name: str, default: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Comma-separated integers, e.g. "32,64,128"."""
+    value = os.getenv(name)
+    return tuple(int(x) for x in value.split(",")) if value else default
+
+
+def _env_int_map(name: str, default: Dict[int, int]) -> Dict[int, int]:
+    """Comma-separated key:value integer pairs, e.g. "32:256,64:128"."""
+    value = os.getenv(name)
+    if not value:
+        return default
+    return {int(k): int(v) for k, v in (pair.split(":") for pair in value.split(","))}
+
+
+# Model files produced by ml_research ONNXExporter, selected by MODEL_VARIANT.
+MODEL_VARIANTS = {
+    "fp32": "model.onnx",
+    "optimized": "model.opt.onnx",
+    "int8": "model.int8.onnx",
+}
+
+
+@dataclass
+class WorkerConfig:
+    rabbitmq_url: str = ""
+    task_queue: str = ""
+    interactive_queue: str = ""
+    redis_url: str = ""
+    model_dir: str = "."
+    model_variant: str = "fp32"
+    tokenizer_name: str = "sergeyzh/rubert-tiny-turbo"
+    max_length: int = 128
+    max_batch_tokens: int = 8192
+    length_buckets: Tuple[int, ...] = (32, 64, 128, 256)
+    bucket_max_rows: Dict[int, int] = field(default_factory=dict)
+    truncation: str = "tail"
+    adaptive_length_quantile: float = 0.0
+    session_cache_dir: str = ""
+    share_model_weights: bool = True
+    model_watch_interval: float = 0.0
+    worker_mode: str = "sync"
+    prefetch_count: int = 32
+    interactive_reserved: int = 4
+    interactive_weight: int = 4
+    bulk_slice_texts: int = 256
+    batch_max_wait_ms: float = 5.0
+    batch_max_texts: int = 32
+    batch_small_task_texts: int = 4
+    worker_processes: int = 1
+    intra_op_threads: int = 0
+    inter_op_threads: int = 1
+    cache_local_size: int = 100_000
+    cache_shared_ttl: int = 86_400
+    cache_shared_max_entries: int = 1_000_000
+    chunk_size: int = 2000
+    chunk_ttl: int = 3600
+    result_probabilities: bool = False
+    result_ttl: int = 3600
+    metrics_port: int = 9100
+    cascade_variant: str = ""
+    cascade_threshold: float = 0.9
+
+    @classmethod
+    def from_env(cls) -> "WorkerConfig":
+        """Build the worker configuration from environment variables."""
+        return cls(
+            rabbitmq_url=os.getenv("RABBITMQ_URL", cls.rabbitmq_url),
+            task_queue=os.getenv("RABBITMQ_TASK_QUEUE", cls.task_queue),
+            interactive_queue=os.getenv(
+                "RABBITMQ_INTERACTIVE_QUEUE", cls.interactive_queue
+            ),
+            redis_url=os.getenv("REDIS_URL", cls.redis_url),
+            model_dir=os.getenv("MODEL_DIR", cls.model_dir),
+            model_variant=os.getenv("MODEL_VARIANT", cls.model_variant),
+            tokenizer_name=os.getenv("TOKENIZER_NAME", cls.tokenizer_name),
+            max_length=_env_int("MAX_LENGTH", cls.max_length),
+            max_batch_tokens=_env_int("MAX_BATCH_TOKENS", cls.max_batch_tokens),
+            length_buckets=_env_ints("LENGTH_BUCKETS", cls.length_buckets),
+            bucket_max_rows=_env_int_map("BUCKET_MAX_ROWS", {}),
+            truncation=os.getenv("TRUNCATION", cls.truncation),
+            adaptive_length_quantile=_env_float(
+                "ADAPTIVE_LENGTH_QUANTILE", cls.adaptive_length_quantile
+            ),
+            session_cache_dir=os.getenv("SESSION_CACHE_DIR", cls.session_cache_dir),
+            share_model_weights=_env_bool("SHARE_MODEL_WEIGHTS", cls.share_model_weights),
+            model_watch_interval=_env_float(
+                "MODEL_WATCH_INTERVAL", cls.model_watch_interval
+            ),
+            worker_mode=os.getenv("WORKER_MODE", cls.worker_mode),
+            prefetch_count=_env_int("PREFETCH_COUNT", cls.prefetch_count),
+            interactive_reserved=_env_int(
+                "INTERACTIVE_RESERVED", cls.interactive_reserved
+            ),
+            interactive_weight=_env_int("INTERACTIVE_WEIGHT", cls.interactive_weight),
+            bulk_slice_texts=_env_int("BULK_SLICE_TEXTS", cls.bulk_slice_texts),
+            batch_max_wait_ms=_env_float("BATCH_MAX_WAIT_MS", cls.batch_max_wait_ms),
+            batch_max_texts=_env_int("BATCH_MAX_TEXTS", cls.batch_max_texts),
+            batch_small_task_texts=_env_int(
+                "BATCH_SMALL_TASK_TEXTS", cls.batch_small_task_texts
+            ),
+            worker_processes=_env_int("WORKER_PROCESSES", cls.worker_processes),
+            intra_op_threads=_env_int("INTRA_OP_THREADS", cls.intra_op_threads),
+            inter_op_threads=_env_int("INTER_OP_THREADS", cls.inter_op_threads),
+            cache_local_size=_env_int("PREDICTION_CACHE_SIZE", cls.cache_local_size),
+            cache_shared_ttl=_env_int("PREDICTION_CACHE_TTL", cls.cache_shared_ttl),
+            cache_shared_max_entries=_env_int(
+                "PREDICTION_CACHE_SHARED_SIZE", cls.cache_shared_max_entries
+            ),
+            chunk_size=_env_int("TASK_CHUNK_SIZE", cls.chunk_size),
+            chunk_ttl=_env_int("TASK_CHUNK_TTL", cls.chunk_ttl),
+            result_probabilities=_env_bool(
+                "RESULT_PROBABILITIES", cls.result_probabilities
+            ),
+            result_ttl=_env_int("RESULT_TTL", cls.result_ttl),
+            metrics_port=_env_int("METRICS_PORT", cls.metrics_port),
+            cascade_variant=os.getenv("CASCADE_VARIANT", cls.cascade_variant),
+            cascade_threshold=_env_float("CASCADE_THRESHOLD", cls.cascade_threshold),
+        )
+
+    @property
+    def onnx_path(self) -> str:
+        return self._variant_path("MODEL_VARIANT", self.model_variant)
+
+    @property
+    def cascade_onnx_path(self) -> str:
+        """First-stage model of the cascade; CASCADE_VARIANT empty disables it."""
+        return self._variant_path("CASCADE_VARIANT", self.cascade_variant)
+
+    def _variant_path(self, setting: str, variant: str) -> str:
+        if variant not in MODEL_VARIANTS:
+            raise ValueError(
+                f"Unknown {setting} {variant!r}, expected one of {sorted(MODEL_VARIANTS)}"
+            )
+        return os.path.join(self.model_dir, MODEL_VARIANTS[variant])
@@ -0,0 +1,74 @@
+import collections
+import queue
+import threading
+from typing import Any, Deque, Dict, List, Optional
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+
+class LaneQueue:
+    """
+    Drop-in for the queue.Queue between pipeline stages, with an interactive
+    and a bulk lane (`job.lane`).
+
+    get() prefers interactive jobs, but when both lanes wait it hands out one
+    bulk job after every `weight` interactive ones, so bulk work never stalls.
+    Within a lane the order is FIFO; with a single lane in use it is a plain
+    FIFO queue. put(None) closes the queue: once both lanes are empty, get()
+    returns None, like the shutdown marker of a queue.Queue.
+    """
+
+    def __init__(self, weight: int):
+        self._weight = max(1, weight)
+        self._lanes: Dict[str, Deque[Any]] = {
+            LANE_INTERACTIVE: collections.deque(),
+            LANE_BULK: collections.deque(),
+        }
+        self._streak = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, job: Optional[Any]):
+        with self._cond:
+            if job is None:
+                self._closed = True
+            else:
+                self._lanes[job.lane].append(job)
+            self._cond.notify()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Optional[Any]:
+        with self._cond:
+            if block:
+                self._cond.wait_for(self._ready, timeout)
+            if not self._ready():
+                raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self) -> Optional[Any]:
+        return self.get(block=False)
+
+    def take(self, lane: str) -> List[Any]:
+        """Remove and return every job waiting in `lane`, without blocking."""
+        with self._cond:
+            jobs = list(self._lanes[lane])
+            self._lanes[lane].clear()
+            return jobs
+
+    def qsize(self) -> int:
+        with self._cond:
+            return sum(len(jobs) for jobs in self._lanes.values())
+
+    def _ready(self) -> bool:
+        return self._closed or any(self._lanes.values())
+
+    def _pop(self) -> Optional[Any]:
+        interactive = self._lanes[LANE_INTERACTIVE]
+        bulk = self._lanes[LANE_BULK]
+        if interactive and (not bulk or self._streak < self._weight):
+            self._streak += 1
+            return interactive.popleft()
+        self._streak = 0
+        if bulk:
+            return bulk.popleft()
+        return None
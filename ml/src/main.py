@@ -1,9 +1,20 @@
+import asyncio
+import dataclasses
 import logging
+import multiprocessing
 import os
+import signal
+import time
+
+# Startup timings are reported from here, before the heavy imports.
+STARTED = time.perf_counter()
 
 import pika
 import redis
 
+import metrics
+from config import WorkerConfig
+from onnx_model import share_model
 from task_service import TaskService
 
 
@@ -16,20 +27,137 @@ logging.basicConfig(
 
 logger = logging.getLogger(os.getenv("WORKER_ID"))
 
+# A child that dies sooner than this after start is restarted with a delay,
+# so a broken model or queue does not turn into a fork loop.
+MIN_CHILD_UPTIME = 5.0
+# How long a child may take to finish its in-flight tasks after SIGTERM.
+SHUTDOWN_TIMEOUT = 30.0
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
 
-def main():
-    logger.info("Starting RabbitMQ Task Service")
 
-    rabbit = os.getenv("RABBITMQ_URL")
-    rabbit_q = os.getenv("RABBITMQ_TASK_QUEUE")
-    rdb = os.getenv("REDIS_URL")
+def run_worker(config: WorkerConfig, metrics_port: int = 0):
+    if config.worker_mode == "async":
+        from async_worker import run_async_worker
+
+        asyncio.run(run_async_worker(config, metrics_port))
+        return
 
-    connection = pika.BlockingConnection(pika.URLParameters(rabbit))
+    started = time.perf_counter()
+    metrics.serve(metrics_port)
+    connection = pika.BlockingConnection(pika.URLParameters(config.rabbitmq_url))
     channel_in = connection.channel()
-    r = redis.Redis.from_url(rdb)
+    r = redis.Redis.from_url(config.redis_url)
+    connected = time.perf_counter()
 
-    task_svc = TaskService(channel_in, rabbit_q, r)
+    task_svc = TaskService(channel_in, config.task_queue, r, config)
+    ready = time.perf_counter()
+    logger.info(
+        f"Воркер готов за {ready - started:.2f}s: "
+        f"connect={connected - started:.2f}s service={ready - connected:.2f}s"
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: task_svc.stop())
     task_svc.start()
+    connection.close()
+
+
+def run_child(config: WorkerConfig, metrics_port: int):
+    # The fork copies the supervisor's handlers; until run_worker installs its
+    # own after the model loads, a stop signal must simply end the child.
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+    run_worker(config, metrics_port)
+
+
+def supervise(config: WorkerConfig):
+    cpus = len(os.sched_getaffinity(0))
+    if config.intra_op_threads == 0:
+        # Split the cores between children instead of letting every
+        # ONNX Runtime pool claim all of them.
+        config = dataclasses.replace(
+            config, intra_op_threads=max(1, cpus // config.worker_processes)
+        )
+    logger.info(
+        f"Supervisor: {config.worker_processes} workers x "
+        f"{config.intra_op_threads} threads on {cpus} cpus"
+    )
+
+    if config.session_cache_dir and config.share_model_weights:
+        # Read once here: the children build their sessions on these bytes,
+        # inherited through the fork, so the weights are in memory once per
+        # host. Models swapped in later are loaded by each child on its own.
+        paths = [config.onnx_path]
+        if config.cascade_variant:
+            paths.append(config.cascade_onnx_path)
+        for path in paths:
+            share_model(path, config.session_cache_dir)
+    else:
+        logger.info("Без SESSION_CACHE_DIR и SHARE_MODEL_WEIGHTS каждый воркер держит свою копию модели")
+
+    # With PROMETHEUS_MULTIPROC_DIR the supervisor serves the samples of all
+    # children on METRICS_PORT; without it every child gets its own port.
+    shared_metrics = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+    if shared_metrics:
+        metrics.serve(config.metrics_port)
+
+    ctx = multiprocessing.get_context("fork")
+    children = {}
+    stopping = False
+
+    def spawn(index: int):
+        port = 0 if shared_metrics or config.metrics_port <= 0 else config.metrics_port + index + 1
+        child = ctx.Process(target=run_child, args=(config, port), name=f"worker-{index}")
+        # Blocked across the fork, so the child never runs `shutdown`: a signal
+        # arriving meanwhile stays pending until run_child has reset the handlers.
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            child.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        children[index] = (child, time.monotonic())
+        logger.info(f"Запустили воркер {index} (pid {child.pid})")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child, _ in children.values():
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(config.worker_processes):
+        spawn(index)
+
+    while not stopping:
+        time.sleep(1)
+        for index, (child, started_at) in list(children.items()):
+            if child.is_alive() or stopping:
+                continue
+            logger.warning(f"Воркер {index} завершился с кодом {child.exitcode}")
+            metrics.mark_process_dead(child.pid)
+            if time.monotonic() - started_at < MIN_CHILD_UPTIME:
+                time.sleep(MIN_CHILD_UPTIME)
+            if not stopping:
+                spawn(index)
+
+    for child, _ in children.values():
+        child.join(SHUTDOWN_TIMEOUT)
+        if child.is_alive():
+            child.kill()
+
+
+def main():
+    logger.info(f"Starting RabbitMQ Task Service, imports took {time.perf_counter() - STARTED:.2f}s")
+
+    config = WorkerConfig.from_env()
+
+    if config.worker_processes > 1:
+        supervise(config)
+    else:
+        run_worker(config, config.metrics_port)
 
 
 if __name__ == "__main__":
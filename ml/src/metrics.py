@@ -0,0 +1,81 @@
+import os
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+
+
+# Stage latencies range from sub-millisecond cache hits to minutes for big files.
+_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+QUEUE_TO_START = Histogram(
+    "ml_queue_to_start_seconds",
+    "Time from message delivery to the start of its inference batch",
+    buckets=_BUCKETS,
+)
+TOKENIZE_SECONDS = Histogram(
+    "ml_tokenize_seconds", "Decode, cache lookup and tokenization time per task", buckets=_BUCKETS
+)
+INFERENCE_SECONDS = Histogram(
+    "ml_inference_seconds", "Model time per inference batch", buckets=_BUCKETS
+)
+PUBLISH_SECONDS = Histogram(
+    "ml_publish_seconds", "Result encoding and Redis write time per task", buckets=_BUCKETS
+)
+BATCH_QUEUE_WAIT = Histogram(
+    "ml_batch_queue_wait_seconds",
+    "Time a tokenized task waits for its inference batch",
+    buckets=_BUCKETS,
+)
+BATCH_FILL = Histogram(
+    "ml_batch_fill_ratio",
+    "Texts in a dynamic batch relative to BATCH_MAX_TEXTS",
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+)
+
+TASKS = Counter("ml_tasks_total", "Tasks finished", ["type"])
+TEXTS = Counter("ml_texts_total", "Texts classified")
+INFERRED_TEXTS = Counter("ml_inferred_texts_total", "Texts sent to the model")
+ERRORS = Counter("ml_errors_total", "Tasks rejected after an error", ["stage"])
+CACHE_LOOKUPS = Counter(
+    "ml_prediction_cache_lookups_total", "Prediction cache lookups", ["result"]
+)
+CASCADE_TEXTS = Counter(
+    "ml_cascade_texts_total", "Texts labelled by each cascade stage", ["model"]
+)
+MODEL_RELOADS = Counter(
+    "ml_model_reloads_total", "New model versions found on disk", ["outcome"]
+)
+
+IN_FLIGHT = Gauge(
+    "ml_tasks_in_flight", "Delivered but not yet acked tasks", multiprocess_mode="livesum"
+)
+BATCH_TEXTS = Gauge(
+    "ml_batch_texts", "Texts in the last inference batch", multiprocess_mode="liveall"
+)
+
+
+def serve(port: int):
+    """Expose /metrics on `port`; 0 disables the endpoint."""
+    if port <= 0:
+        return
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Supervisor mode: one endpoint aggregates the samples of every child.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
+
+
+def mark_process_dead(pid: int):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
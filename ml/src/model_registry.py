@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+from typing import Callable, List, Optional, Tuple, Union
+
+import metrics
+from cascade import CascadeClassifier, create_predictor
+from config import WorkerConfig
+from onnx_model import ONNXClassifier
+
+
+logger = logging.getLogger(os.getenv("WORKER_ID")+".model_registry")
+
+Predictor = Union[ONNXClassifier, CascadeClassifier]
+
+
+class ModelWatcher:
+    """
+    Watches the model files of the worker (MODEL_VARIANT, and CASCADE_VARIANT
+    when set) and hot-swaps the classifier when a new version lands on disk.
+
+    Every `interval` seconds the files are stat-ed; a change is acted on only
+    once the files have stayed the same for a whole interval, since exports
+    are not written atomically. The new predictor is then built and warmed up
+    on the watcher thread, while the current one keeps serving, and handed to
+    `on_ready`. A file touched without new content keeps the same version and
+    is ignored.
+    """
+
+    def __init__(
+        self,
+        config: WorkerConfig,
+        version: str,
+        on_ready: Callable[[Predictor], None],
+        interval: float,
+    ):
+        self._config = config
+        self._version = version
+        self._on_ready = on_ready
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _paths(self) -> List[str]:
+        paths = [self._config.onnx_path]
+        if self._config.cascade_variant:
+            paths.append(self._config.cascade_onnx_path)
+        return paths
+
+    def _signature(self) -> Optional[Tuple[Tuple[int, int], ...]]:
+        """Modification time and size of every model file; None while one is missing."""
+        try:
+            return tuple(
+                (stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, self._paths())
+            )
+        except FileNotFoundError:
+            return None
+
+    def _run(self):
+        loaded = seen = self._signature()
+        while not self._stopped.wait(self._interval):
+            current = self._signature()
+            if current is None or current == loaded or current != seen:
+                seen = current
+                continue
+
+            loaded = current
+            try:
+                predictor = create_predictor(self._config)
+                if predictor.version == self._version:
+                    continue
+                predictor.warmup()
+            except Exception:
+                logger.exception("Не удалось загрузить новую модель, остаёмся на текущей")
+                metrics.MODEL_RELOADS.labels("failed").inc()
+                continue
+
+            logger.info(
+                f"Новая модель {predictor.version} вместо {self._version}: "
+                + " ".join(f"{phase}={sec:.2f}s" for phase, sec in predictor.load_seconds.items())
+            )
+            self._version = predictor.version
+            self._on_ready(predictor)
+            metrics.MODEL_RELOADS.labels("swapped").inc()
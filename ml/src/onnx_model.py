@@ -1,29 +1,297 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
 import onnxruntime
 import numpy as np
-from typing import List
-from transformers import AutoTokenizer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from tokenizers import Tokenizer
+
+
+TRUNCATION_MODES = ("tail", "head_tail")
+# Head+tail keeps a quarter of the budget from the start of the text and the
+# rest from its end, where complaints usually state the actual problem.
+HEAD_SHARE = 0.25
+# The adaptive limit moves only after this many texts were seen, and the
+# statistics are halved after LENGTH_WINDOW texts to follow recent traffic.
+LENGTH_MIN_SAMPLE = 1_000
+LENGTH_WINDOW = 50_000
+
+# Session cache files read by the worker supervisor before it forks, by path.
+# Sessions built from these bytes keep their weights in the buffer itself, so
+# the children of one supervisor share a single copy of them.
+SHARED_MODELS: Dict[str, bytes] = {}
+
+
+def load_tokenizer(tokenizer_name: str) -> Tuple[Tokenizer, int]:
+    """
+    The Rust tokenizer and its pad id. A path to a tokenizer.json is read
+    directly; anything else goes through transformers.AutoTokenizer, which
+    is imported only then since the import alone takes seconds.
+    """
+    if tokenizer_name.endswith(".json"):
+        encoder = Tokenizer.from_file(tokenizer_name)
+        padding = encoder.padding
+        pad_id = padding["pad_id"] if padding else encoder.token_to_id("[PAD]")
+        if pad_id is None:
+            raise ValueError(f"{tokenizer_name} has neither a padding config nor a [PAD] token")
+        return encoder, pad_id
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    # The Rust tokenizer behind the HF wrapper: encode_batch runs on its
+    # own thread pool and skips the Python-side BatchEncoding conversion.
+    return tokenizer.backend_tokenizer, tokenizer.pad_token_id
+
+
+def model_digest(onnx_path: str) -> str:
+    with open(onnx_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()[:12]
+
+
+def session_cache_path(session_cache_dir: str, onnx_path: str, digest: str) -> str:
+    """The optimized model saved in ORT format, whose initializers can be used in place."""
+    name = os.path.splitext(os.path.basename(onnx_path))[0]
+    return os.path.join(session_cache_dir, f"{name}.{digest}.ort")
+
+
+def create_session(
+    onnx_path: str, digest: str, options: onnxruntime.SessionOptions, session_cache_dir: str = ""
+) -> onnxruntime.InferenceSession:
+    """
+    An InferenceSession of `onnx_path`. With `session_cache_dir`, the graph
+    optimized on the first start is saved per model version and loaded as is
+    later, skipping the optimization passes; a copy in SHARED_MODELS is used
+    instead of the file.
+    """
+    if not session_cache_dir:
+        return onnxruntime.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+    cached_path = session_cache_path(session_cache_dir, onnx_path, digest)
+    if not os.path.exists(cached_path):
+        os.makedirs(session_cache_dir, exist_ok=True)
+        # Extended, not all: layout optimizations tie the saved graph
+        # to the CPU it was built on.
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        # Written under a per-process name first, since worker
+        # processes start together.
+        partial_path = f"{cached_path}.{os.getpid()}"
+        options.optimized_model_filepath = partial_path
+        options.add_session_config_entry("session.save_model_format", "ORT")
+        session = onnxruntime.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        os.replace(partial_path, cached_path)
+        return session
+
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+    model = SHARED_MODELS.get(cached_path)
+    if model is None:
+        model = cached_path
+    else:
+        options.add_session_config_entry("session.use_ort_model_bytes_directly", "1")
+        options.add_session_config_entry("session.use_ort_model_bytes_for_initializers", "1")
+        # Prepacking would replace the shared weights with a private packed
+        # copy per process (and crashes on weights it does not own).
+        options.add_session_config_entry("session.disable_prepacking", "1")
+    return onnxruntime.InferenceSession(
+        model, sess_options=options, providers=["CPUExecutionProvider"]
+    )
+
+
+def share_model(onnx_path: str, session_cache_dir: str):
+    """Build the session cache of `onnx_path` if needed and load it into SHARED_MODELS."""
+    digest = model_digest(onnx_path)
+    cached_path = session_cache_path(session_cache_dir, onnx_path, digest)
+    if not os.path.exists(cached_path):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        create_session(onnx_path, digest, options, session_cache_dir)
+    with open(cached_path, "rb") as f:
+        SHARED_MODELS[cached_path] = f.read()
 
 
 class ONNXClassifier:
-    def __init__(self, onnx_path: str, tokenizer_name: str, max_length: int = 128):
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    def __init__(
+        self,
+        onnx_path: str,
+        tokenizer_name: str,
+        max_length: int = 128,
+        max_batch_tokens: int = 8192,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 1,
+        length_buckets: Sequence[int] = (32, 64, 128, 256),
+        bucket_max_rows: Optional[Dict[int, int]] = None,
+        truncation: str = "tail",
+        adaptive_length_quantile: float = 0.0,
+        session_cache_dir: str = "",
+    ):
+        if truncation not in TRUNCATION_MODES:
+            raise ValueError(f"Unknown truncation {truncation!r}, expected one of {TRUNCATION_MODES}")
+        # Startup phase durations in seconds, reported by TaskService.
+        self.load_seconds: Dict[str, float] = {}
+        started = time.perf_counter()
         self.max_length = max_length
-        self.session = onnxruntime.InferenceSession(
-            onnx_path, providers=["CPUExecutionProvider"]
-        )
+        self.truncation = truncation
+        self._encoder, self._pad_id = load_tokenizer(tokenizer_name)
+        self._encoder.no_padding()
+        if truncation == "head_tail":
+            # Cut in Python, where both ends of the full encoding are known.
+            self._encoder.no_truncation()
+        else:
+            self._encoder.enable_truncation(max_length)
+        self.load_seconds["tokenizer"] = time.perf_counter() - started
+
+        # Batches never mix length buckets, and each bucket has its own row
+        # limit, so short messages are not padded to the width of long ones.
+        self.buckets = sorted({b for b in length_buckets if b < max_length} | {max_length})
+        # Upper bound on padded batch size (rows * longest row), so peak memory
+        # does not depend on how many texts a single task carries.
+        self.max_batch_tokens = max(max_batch_tokens, max_length)
+        bucket_max_rows = bucket_max_rows or {}
+        # At least one row, so every bucket can run and be warmed up.
+        self._bucket_rows = np.array([
+            max(1, min(bucket_max_rows.get(b, self.max_batch_tokens), self.max_batch_tokens // b))
+            for b in self.buckets
+        ])
+        self._bucket_widths = np.array(self.buckets)
+
+        # With a quantile set, texts are cut at the smallest bucket holding that
+        # share of recent traffic instead of at max_length.
+        self.adaptive_length_quantile = adaptive_length_quantile
+        self.length_limit = max_length
+        self._length_counts = np.zeros(max_length + 1, dtype=np.int64)
+        # int64 input buffers reused by every batch: each batch is a contiguous
+        # (rows, width) view bound to the session without further copies.
+        self._input_ids = np.empty(self.max_batch_tokens, dtype=np.int64)
+        self._attention_mask = np.empty(self.max_batch_tokens, dtype=np.int64)
+        self._positions = np.arange(max_length, dtype=np.int64)
+        self._run_lock = threading.Lock()
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime use every core; set it explicitly when several
+        # worker processes share one host.
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        started = time.perf_counter()
+        digest = model_digest(onnx_path)
+        # A label depends on how the text was cut as well as on the weights, so
+        # workers with other limits never share cached labels.
+        self.version = f"{digest}-{max_length}-{truncation}"
+        self.load_seconds["hash"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.session = create_session(onnx_path, digest, options, session_cache_dir)
+        self.load_seconds["session"] = time.perf_counter() - started
 
     def predict(self, texts: List[str]) -> List[int]:
-        inputs = self.tokenizer(
-            texts,
-            padding=True,
-            truncation=True,
-            max_length=self.max_length,
-            return_tensors="np",
+        return self.predict_encoded(self.encode(texts))
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        return self.predict_proba_encoded(self.encode(texts))
+
+    def encode(self, texts: List[str]) -> List[List[int]]:
+        if not texts:
+            return []
+        encoded = [encoding.ids for encoding in self._encoder.encode_batch(texts)]
+        if self.adaptive_length_quantile > 0:
+            self._observe_lengths(encoded)
+        limit = self.length_limit
+        if self.truncation == "head_tail" or limit < self.max_length:
+            # "tail" keeps the final [SEP], "head_tail" keeps both ends.
+            head = int(limit * HEAD_SHARE) if self.truncation == "head_tail" else limit - 1
+            tail = limit - head
+            encoded = [ids if len(ids) <= limit else ids[:head] + ids[-tail:] for ids in encoded]
+        return encoded
+
+    def warmup(self):
+        """Run one full-size batch per length bucket, so the first tasks do not pay for allocations."""
+        started = time.perf_counter()
+        for width, rows in zip(self.buckets, self._bucket_rows):
+            self._run([[self._pad_id] * width] * int(rows))
+        self.load_seconds["warmup"] = time.perf_counter() - started
+
+    def _observe_lengths(self, encoded: List[List[int]]):
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        self._length_counts += np.bincount(
+            np.minimum(lengths, self.max_length), minlength=self.max_length + 1
         )
-        input_ids = inputs["input_ids"].astype(np.int64)
-        attention_mask = inputs["attention_mask"].astype(np.int64)
-        logits = self.session.run(
-            None, {"input_ids": input_ids, "attention_mask": attention_mask}
-        )[0]
-        class_ids = np.argmax(logits, axis=1).tolist()
-        return class_ids
+        total = int(self._length_counts.sum())
+        if total < LENGTH_MIN_SAMPLE:
+            return
+        quantile_length = int(np.searchsorted(
+            np.cumsum(self._length_counts), self.adaptive_length_quantile * total
+        ))
+        self.length_limit = self.buckets[np.searchsorted(self.buckets, quantile_length)]
+        if total > LENGTH_WINDOW:
+            self._length_counts //= 2
+
+    def predict_encoded(self, encoded: List[List[int]]) -> List[int]:
+        if not encoded:
+            return []
+        return np.argmax(self._logits(encoded), axis=1).tolist()
+
+    def predict_proba_encoded(self, encoded: List[List[int]]) -> np.ndarray:
+        """Softmax class probabilities, one row per text."""
+        if not encoded:
+            return np.empty((0, 0), dtype=np.float32)
+        logits = self._logits(encoded)
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def _logits(self, encoded: List[List[int]]) -> np.ndarray:
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+
+        logits = None
+        for batch in self._batches(lengths):
+            batch_logits = self._run([encoded[idx] for idx in batch])
+            if logits is None:
+                logits = np.empty((len(encoded), batch_logits.shape[1]), dtype=np.float32)
+            logits[batch] = batch_logits
+        return logits
+
+    def _batches(self, lengths: np.ndarray) -> Iterator[np.ndarray]:
+        """Yield index groups from one length bucket within its row limit and the token budget."""
+        order = np.argsort(lengths, kind="stable")
+        buckets = np.searchsorted(self._bucket_widths, lengths[order])
+        start = 0
+        while start < len(order):
+            end = start + 1
+            bucket = buckets[start]
+            # Lengths grow along `order`, so the newest row is the widest one.
+            while (
+                end < len(order)
+                and buckets[end] == bucket
+                and end - start < self._bucket_rows[bucket]
+                and (end - start + 1) * lengths[order[end]] <= self.max_batch_tokens
+            ):
+                end += 1
+            yield order[start:end]
+            start = end
+
+    def _run(self, batch: List[List[int]]) -> np.ndarray:
+        lengths = np.fromiter(map(len, batch), dtype=np.int64, count=len(batch))
+        width = int(lengths.max())
+        size = len(batch) * width
+
+        with self._run_lock:
+            input_ids = self._input_ids[:size].reshape(len(batch), width)
+            attention_mask = self._attention_mask[:size].reshape(len(batch), width)
+            valid = self._positions[:width] < lengths[:, None]
+            attention_mask[...] = valid
+            input_ids.fill(self._pad_id)
+            input_ids[valid] = np.fromiter(
+                itertools.chain.from_iterable(batch), dtype=np.int64, count=int(lengths.sum())
+            )
+
+            binding = self.session.io_binding()
+            binding.bind_cpu_input("input_ids", input_ids)
+            binding.bind_cpu_input("attention_mask", attention_mask)
+            binding.bind_output("logits")
+            self.session.run_with_iobinding(binding)
+            return binding.copy_outputs_to_cpu()[0]
@@ -0,0 +1,223 @@
+import collections
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+import metrics
+
+
+logger = logging.getLogger(os.getenv("WORKER_ID")+".prediction_cache")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    # The tokenizer splits on whitespace, so collapsing it never changes the
+    # model input and the cached label stays exact.
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of class ids: an in-process LRU in front of a Redis
+    hash shared by all workers. Keys hash the model version together with the
+    normalized text, so a new model never reads labels of an old one.
+
+    The shared hash expires `shared_ttl` seconds after its last write. Past
+    `shared_max_entries` the least recently used entries are evicted, tracked
+    in a sorted set of last-use times next to the hash, so the shared hit rate
+    does not collapse when the cache fills up.
+
+    The version covers the model file and its length limit and truncation
+    mode; workers with ADAPTIVE_LENGTH_QUANTILE set do not use the cache.
+
+    keys() takes the version of the model that will label the texts, which
+    differs from `model_version` for tasks tokenized before a hot swap.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        model_version: str,
+        local_size: int,
+        shared_ttl: int,
+        shared_max_entries: int,
+    ):
+        self._redis = redis_client
+        self.model_version = model_version
+        self._local_size = local_size
+        self._shared_ttl = shared_ttl
+        self._shared_max_entries = shared_max_entries
+        self._shared_key = f"prediction_cache:{model_version}"
+        self._lru_key = f"{self._shared_key}:lru"
+
+        self._lock = threading.Lock()
+        self._local: "collections.OrderedDict[bytes, int]" = collections.OrderedDict()
+        self._local_hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+
+    def keys(self, texts: List[str], model_version: Optional[str] = None) -> List[bytes]:
+        prefix = (model_version or self.model_version).encode() + b"\0"
+        return [
+            hashlib.blake2b(prefix + normalize(text).encode(), digest_size=16).digest()
+            for text in texts
+        ]
+
+    def switch_model(self, model_version: str):
+        """
+        Key new lookups by `model_version`. Labels of the old model can no
+        longer match and are dropped; the old shared hash simply expires.
+        """
+        with self._lock:
+            self.model_version = model_version
+            self._shared_key = f"prediction_cache:{model_version}"
+            self._lru_key = f"{self._shared_key}:lru"
+            self._local.clear()
+
+    def lookup(self, keys: List[bytes]) -> List[Optional[int]]:
+        results, missing = self._lookup_local(keys)
+        values = None
+        if missing and self._shared_ttl > 0:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                self._queue_lookup(pipe, [keys[idx] for idx in missing])
+                values = pipe.execute()[0]
+            except redis.RedisError:
+                # The shared cache is an optimisation: fall back to inference.
+                logger.exception("Кэш предсказаний в Redis недоступен")
+        return self._merge_shared(keys, results, missing, values)
+
+    def store(self, keys: List[bytes], results: List[int]):
+        if not keys:
+            return
+        entries = dict(zip(keys, results))
+        self._remember(entries)
+
+        if self._shared_ttl > 0:
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_store(pipe, entries)
+            excess = pipe.execute()[-1] - self._shared_max_entries
+            if excess > 0:
+                oldest = self._redis.zrange(self._lru_key, 0, excess - 1)
+                pipe = self._redis.pipeline(transaction=False)
+                self._queue_evict(pipe, oldest)
+                pipe.execute()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "local_hits": self._local_hits,
+                "shared_hits": self._shared_hits,
+                "misses": self._misses,
+                "local_entries": len(self._local),
+            }
+
+    def _lookup_local(self, keys: List[bytes]) -> Tuple[List[Optional[int]], List[int]]:
+        """Labels found in the LRU, and the indices of keys to ask Redis for."""
+        results: List[Optional[int]] = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for idx, key in enumerate(keys):
+                value = self._local.get(key)
+                if value is None:
+                    missing.append(idx)
+                else:
+                    self._local.move_to_end(key)
+                    results[idx] = value
+        return results, missing
+
+    def _merge_shared(
+        self,
+        keys: List[bytes],
+        results: List[Optional[int]],
+        missing: List[int],
+        values: Optional[List[Optional[bytes]]],
+    ) -> List[Optional[int]]:
+        local_hits = len(keys) - len(missing)
+        shared_hits = 0
+        if values is not None:
+            found = {}
+            for idx, value in zip(missing, values):
+                if value is not None:
+                    results[idx] = found[keys[idx]] = int(value)
+                    shared_hits += 1
+            self._remember(found)
+
+        with self._lock:
+            self._local_hits += local_hits
+            self._shared_hits += shared_hits
+            self._misses += len(missing) - shared_hits
+        metrics.CACHE_LOOKUPS.labels("local_hit").inc(local_hits)
+        metrics.CACHE_LOOKUPS.labels("shared_hit").inc(shared_hits)
+        metrics.CACHE_LOOKUPS.labels("miss").inc(len(missing) - shared_hits)
+        return results
+
+    def _queue_lookup(self, pipe, keys: List[bytes]):
+        """Add the shared lookup to `pipe`; its first reply holds the values."""
+        pipe.hmget(self._shared_key, keys)
+        # XX: only entries already cached are marked as used.
+        pipe.zadd(self._lru_key, dict.fromkeys(keys, time.time()), xx=True)
+
+    def _queue_store(self, pipe, entries: Dict[bytes, int]):
+        """Add the shared hash update to `pipe`; its last reply is the number of entries."""
+        pipe.hset(self._shared_key, mapping=entries)
+        pipe.zadd(self._lru_key, dict.fromkeys(entries, time.time()))
+        pipe.expire(self._shared_key, self._shared_ttl)
+        pipe.expire(self._lru_key, self._shared_ttl)
+        pipe.zcard(self._lru_key)
+
+    def _queue_evict(self, pipe, keys: List[bytes]):
+        # By member rather than by rank: other workers may have used or added
+        # entries since the oldest ones were read.
+        if keys:
+            pipe.hdel(self._shared_key, *keys)
+            pipe.zrem(self._lru_key, *keys)
+
+    def _remember(self, entries: Dict[bytes, int]):
+        if self._local_size <= 0:
+            return
+        with self._lock:
+            for key, value in entries.items():
+                self._local[key] = value
+                self._local.move_to_end(key)
+            while len(self._local) > self._local_size:
+                self._local.popitem(last=False)
+
+
+class AsyncPredictionCache(PredictionCache):
+    """PredictionCache over a redis.asyncio client, for AsyncTaskService."""
+
+    async def lookup(self, keys: List[bytes]) -> List[Optional[int]]:
+        results, missing = self._lookup_local(keys)
+        values = None
+        if missing and self._shared_ttl > 0:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                self._queue_lookup(pipe, [keys[idx] for idx in missing])
+                values = (await pipe.execute())[0]
+            except redis.RedisError:
+                logger.exception("Кэш предсказаний в Redis недоступен")
+        return self._merge_shared(keys, results, missing, values)
+
+    async def store(self, keys: List[bytes], results: List[int]):
+        if not keys:
+            return
+        entries = dict(zip(keys, results))
+        self._remember(entries)
+
+        if self._shared_ttl > 0:
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_store(pipe, entries)
+            excess = (await pipe.execute())[-1] - self._shared_max_entries
+            if excess > 0:
+                oldest = await self._redis.zrange(self._lru_key, 0, excess - 1)
+                pipe = self._redis.pipeline(transaction=False)
+                self._queue_evict(pipe, oldest)
+                await pipe.execute()
@@ -0,0 +1,54 @@
+import struct
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact-v1"
+FORMATS = (FORMAT_JSON, FORMAT_COMPACT)
+
+# compact-v1 layout, little-endian:
+#   magic b"NXR" | version u8 | flags u8 | num_classes u16 | count u32 | model_version_len u16
+#   model version: utf-8[model_version_len], the "modelVersion" of a json result
+#   class ids: uint8[count]
+#   probabilities (flags & FLAG_PROBABILITIES): float16[count * num_classes]
+MAGIC = b"NXR"
+VERSION = 1
+FLAG_PROBABILITIES = 1
+
+_HEADER = struct.Struct("<3sBBHIH")
+
+
+def encode_compact(
+    class_ids: Sequence[int], probs: Optional[np.ndarray] = None, model_version: str = ""
+) -> bytes:
+    flags = 0
+    num_classes = 0
+    if probs is not None:
+        flags |= FLAG_PROBABILITIES
+        num_classes = probs.shape[1]
+
+    version = model_version.encode("utf-8")
+    header = _HEADER.pack(MAGIC, VERSION, flags, num_classes, len(class_ids), len(version))
+    payload = [header, version, np.asarray(class_ids, dtype=np.uint8).tobytes()]
+    if probs is not None:
+        payload.append(np.asarray(probs, dtype="<f2").tobytes())
+    return b"".join(payload)
+
+
+def decode_compact(payload: bytes) -> Tuple[np.ndarray, Optional[np.ndarray], str]:
+    """Class ids, probabilities (None unless encoded) and model version of a result."""
+    magic, version, flags, num_classes, count, version_len = _HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported result encoding {magic!r} v{version}")
+
+    offset = _HEADER.size + version_len
+    model_version = payload[_HEADER.size : offset].decode("utf-8")
+    class_ids = np.frombuffer(payload, dtype=np.uint8, count=count, offset=offset)
+    probs = None
+    if flags & FLAG_PROBABILITIES:
+        probs = np.frombuffer(
+            payload, dtype="<f2", count=count * num_classes, offset=offset + count
+        ).reshape(count, num_classes)
+    return class_ids, probs, model_version
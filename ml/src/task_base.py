@@ -0,0 +1,355 @@
+import datetime
+import functools
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+import metrics
+from batcher import DynamicBatcher
+from cascade import CascadeClassifier, create_predictor
+from config import WorkerConfig
+from lanes import LANE_BULK, LANE_INTERACTIVE, LaneQueue
+from model_registry import ModelWatcher
+from result_codec import FORMAT_COMPACT, FORMAT_JSON, FORMATS, encode_compact
+
+
+logger = logging.getLogger(os.getenv("WORKER_ID")+".task_service")
+
+
+@dataclass
+class Job:
+    delivery_tag: int
+    redelivered: bool
+    body: bytes
+    received_at: float
+    # From the "x-trace-id" message header, otherwise the task id.
+    trace_id: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+    # Only unique cache misses are tokenized; targets[i] lists the messages
+    # that take the label predicted for encoded[i].
+    encoded: List[List[int]] = field(default_factory=list)
+    targets: List[List[int]] = field(default_factory=list)
+    miss_keys: List[bytes] = field(default_factory=list)
+    predicted: List[int] = field(default_factory=list)
+    results: List[Optional[int]] = field(default_factory=list)
+    result_format: str = FORMAT_JSON
+    want_probs: bool = False
+    predicted_probs: Optional[np.ndarray] = None
+    probs: Optional[np.ndarray] = None
+    ready_at: float = 0.0
+    lane: str = LANE_BULK
+    # The classifier the job was tokenized and cache-keyed with; it also runs
+    # its inference, so a hot swap never splits a job between two models.
+    predictor: Any = None
+    # Set when a stage fully handled the job and it must not go further.
+    done: bool = False
+
+
+class BaseTaskService:
+    """
+    Task message and result handling shared by the threaded TaskService and
+    the asyncio AsyncTaskService: decoding, chunk splitting and assembly,
+    cache miss deduplication, batched inference and result encoding. The
+    subclasses own the broker and Redis I/O.
+    """
+
+    def __init__(self, config: WorkerConfig):
+        self._prefetch_count = config.prefetch_count
+        self._interactive_queue = config.interactive_queue
+        self._interactive_reserved = config.interactive_reserved
+        # Slicing only pays off when there is an interactive lane to serve in between.
+        self._bulk_slice_texts = config.bulk_slice_texts if config.interactive_queue else 0
+        self._chunk_size = config.chunk_size
+        self._chunk_ttl = config.chunk_ttl
+        self._result_probabilities = config.result_probabilities
+        self._result_ttl = config.result_ttl or None
+        # Under an adaptive length limit a label also depends on the traffic
+        # seen before it, so it cannot be reused for the same text later.
+        self._cache_labels = config.adaptive_length_quantile <= 0
+        self._predictor = create_predictor(config)
+        self._batcher = DynamicBatcher(
+            max_wait_ms=config.batch_max_wait_ms,
+            max_texts=config.batch_max_texts,
+            small_task_texts=config.batch_small_task_texts,
+        )
+        # Tokenized jobs waiting for inference, interactive ones first.
+        self._tokenized = LaneQueue(config.interactive_weight)
+
+        # Consume only once the model has run: the first tasks must not pay
+        # for lazy allocations.
+        self._predictor.warmup()
+        logger.info(
+            "Модель загружена: "
+            + " ".join(f"{phase}={sec:.2f}s" for phase, sec in self._predictor.load_seconds.items())
+        )
+
+        self._watcher = None
+        if config.model_watch_interval > 0:
+            self._watcher = ModelWatcher(
+                config, self._predictor.version, self._swap_predictor, config.model_watch_interval
+            )
+
+    def _swap_predictor(self, predictor):
+        """
+        Serve new tasks with `predictor`. Jobs already tokenized keep the old
+        one in job.predictor, which is released once the last of them is done.
+        """
+        self._cache.switch_model(predictor.version)
+        self._predictor = predictor
+
+    def _start_watcher(self):
+        if self._watcher is not None:
+            self._watcher.start()
+
+    def _stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+
+    def _decode(self, job: Job) -> bool:
+        """Parse the message and resolve its options; True if it must be split into chunks."""
+        job.data = json.loads(job.body.decode("utf-8"))
+        job.trace_id = job.trace_id or job.data.get("id")
+        if (
+            self._chunk_size > 0
+            and "chunk" not in job.data
+            and len(job.data["messages"]) > self._chunk_size
+        ):
+            return True
+
+        # json is the only format the backend reads; compact-v1 is opt-in per task.
+        job.result_format = job.data.get("resultFormat", FORMAT_JSON)
+        if job.result_format not in FORMATS:
+            logger.warning(f"Неизвестный формат результата {job.result_format!r}, отдаём json")
+            job.result_format = FORMAT_JSON
+        job.want_probs = bool(job.data.get("withProbabilities", self._result_probabilities))
+        return False
+
+    def _uses_cache(self, job: Job) -> bool:
+        # The cache keeps class ids only, so probability requests always run the model.
+        return self._cache_labels and not job.want_probs
+
+    @staticmethod
+    def _collect_misses(
+        job: Job, texts: List[str], keys: List[bytes], cached: Optional[List[Optional[int]]]
+    ) -> List[str]:
+        """Fill job.results from `cached`, if given, and return the unique texts left to predict."""
+        job.results = [None] * len(keys) if cached is None else cached
+
+        positions: Dict[bytes, int] = {}
+        miss_texts = []
+        for idx, (key, res) in enumerate(zip(keys, job.results)):
+            if res is not None:
+                continue
+            if key in positions:
+                job.targets[positions[key]].append(idx)
+            else:
+                positions[key] = len(job.targets)
+                job.targets.append([idx])
+                job.miss_keys.append(key)
+                miss_texts.append(texts[idx])
+        return miss_texts
+
+    def _prefetch_limits(self) -> Tuple[int, int]:
+        """Prefetch of the bulk and the interactive consumer; the latter is reserved."""
+        if not self._interactive_queue:
+            return self._prefetch_count, 0
+        reserved = max(1, self._interactive_reserved)
+        return max(1, self._prefetch_count - reserved), reserved
+
+    def _infer_batch(self, jobs: List[Job], finished: Callable[[List[Job], Optional[Exception]], None]):
+        """
+        Run a batch from the batcher and report it with `finished(jobs, error)`.
+        A bulk job over `bulk_slice_texts` texts runs slice by slice, and the
+        interactive jobs tokenized meanwhile are run and reported between slices.
+        Around a model swap a batch may mix jobs of both models; each group
+        runs on its own model.
+        """
+        groups: Dict[int, List[Job]] = {}
+        for job in jobs:
+            groups.setdefault(id(job.predictor), []).append(job)
+        if len(groups) > 1:
+            for group in groups.values():
+                self._infer_batch(group, finished)
+            return
+
+        between = None
+        if (
+            self._bulk_slice_texts
+            and len(jobs) == 1
+            and jobs[0].lane == LANE_BULK
+            and len(jobs[0].encoded) > self._bulk_slice_texts
+        ):
+            between = functools.partial(self._serve_interactive, finished)
+        try:
+            self._infer(jobs, between)
+        except Exception as exc:
+            finished(jobs, exc)
+            return
+        finished(jobs, None)
+
+    def _serve_interactive(self, finished: Callable[[List[Job], Optional[Exception]], None]):
+        # A job the batcher already pulled from the queue came before the rest.
+        jobs = self._batcher.take_pending(LANE_INTERACTIVE) + self._tokenized.take(LANE_INTERACTIVE)
+        if jobs:
+            self._infer_batch(jobs, finished)
+
+    def _infer(self, jobs: List[Job], between: Optional[Callable[[], None]] = None):
+        predictor = jobs[0].predictor
+        traces = ",".join(str(job.trace_id) for job in jobs)
+        started = time.monotonic()
+        for job in jobs:
+            metrics.QUEUE_TO_START.observe(started - job.received_at)
+
+        logger.info(f"Старт МЛ {datetime.datetime.now()} trace={traces}")
+        encoded = [ids for job in jobs for ids in job.encoded]
+        want_probs = any(job.want_probs for job in jobs)
+        step = self._bulk_slice_texts if between is not None else len(encoded)
+        parts = []
+        # An empty batch still makes one call, as before slicing, so `parts`
+        # always holds the model's own empty result.
+        for start in range(0, len(encoded) or 1, max(step, 1)):
+            if start:
+                between()
+            if want_probs:
+                parts.append(predictor.predict_proba_encoded(encoded[start : start + step]))
+            else:
+                parts.append(predictor.predict_encoded(encoded[start : start + step]))
+
+        probs = None
+        if want_probs:
+            probs = np.concatenate(parts)
+            # Without texts the model returns a (0, 0) array, which has no axis 1 to reduce.
+            results = np.argmax(probs, axis=1).tolist() if len(probs) else []
+        else:
+            results = [res for part in parts for res in part]
+        logger.info(f"Финиш МЛ {datetime.datetime.now()} trace={traces}")
+        metrics.INFERENCE_SECONDS.observe(time.monotonic() - started)
+        metrics.INFERRED_TEXTS.inc(len(encoded))
+
+        offset = 0
+        for job in jobs:
+            job.data["modelVersion"] = predictor.version
+            end = offset + len(job.encoded)
+            job.predicted = results[offset:end]
+            for targets, res in zip(job.targets, job.predicted):
+                for idx in targets:
+                    job.results[idx] = res
+
+            if job.want_probs:
+                job.predicted_probs = probs[offset:end]
+                job.probs = np.empty((len(job.results), probs.shape[1]), dtype=np.float32)
+                for targets, row in zip(job.targets, job.predicted_probs):
+                    job.probs[targets] = row
+            offset = end
+
+        if len(jobs) > 1:
+            logger.debug(f"Батч из {len(jobs)} тасок: {self._batcher.stats()}")
+        if isinstance(predictor, CascadeClassifier):
+            logger.debug(f"Каскад: {predictor.stats()}")
+
+    def _chunk_bodies(self, data: Dict[str, Any]) -> Tuple[Dict[str, int], List[bytes]]:
+        """The `<id>:meta` fields and the chunk task messages of a large task."""
+        messages = data["messages"]
+        count = math.ceil(len(messages) / self._chunk_size)
+
+        bodies = []
+        for index in range(count):
+            offset = index * self._chunk_size
+            chunk = {
+                **{key: value for key, value in data.items() if key != "messages"},
+                "chunk": {"index": index, "count": count, "offset": offset},
+                "messages": messages[offset : offset + self._chunk_size],
+            }
+            bodies.append(json.dumps(chunk).encode("utf-8"))
+        return {"chunks": count, "messages": len(messages)}, bodies
+
+    @staticmethod
+    def _attach_results(
+        messages: List[Dict[str, Any]], results: List[int], probs: Optional[np.ndarray]
+    ):
+        for idx, res in enumerate(results):
+            messages[idx]["result"] = res
+            if probs is not None:
+                messages[idx]["probabilities"] = probs[idx].round(4).tolist()
+
+    @staticmethod
+    def _chunk_entry(job: Job) -> str:
+        """The `<id>:chunks` list item of a finished chunk."""
+        entry = {**job.data["chunk"], "results": job.results, "modelVersion": job.data["modelVersion"]}
+        if job.probs is not None:
+            entry["probabilities"] = job.probs.round(4).tolist()
+        if job.result_format == FORMAT_JSON:
+            entry["messages"] = job.data["messages"]
+        return json.dumps(entry)
+
+    @staticmethod
+    def _assembled(
+        job: Job, raw_parts: List[bytes]
+    ) -> Tuple[Dict[str, Any], List[int], Optional[np.ndarray]]:
+        """The full task, its labels and probabilities, rebuilt from the `<id>:chunks` list."""
+        data = job.data
+        parts = {}
+        for raw in raw_parts:
+            part = json.loads(raw)
+            parts[part["index"]] = part
+        ordered = [parts[index] for index in sorted(parts)]
+
+        results = [res for part in ordered for res in part["results"]]
+        probs = None
+        if job.probs is not None:
+            probs = np.array([row for part in ordered for row in part["probabilities"]])
+
+        result = {key: value for key, value in data.items() if key not in ("chunk", "messages")}
+        # Chunks finished around a model swap carry different versions.
+        versions = dict.fromkeys(part.get("modelVersion") for part in ordered)
+        result["modelVersion"] = ",".join(version for version in versions if version)
+        if job.result_format == FORMAT_JSON:
+            result["messages"] = [m for part in ordered for m in part["messages"]]
+        logger.info(f"Собрали таску из {len(parts)} частей {datetime.datetime.now()}")
+        return result, results, probs
+
+    def _queue_assembly_claim(self, pipe, task_id: str):
+        """Add the checks of _assembly_claimed to `pipe`."""
+        pipe.exists(task_id)
+        pipe.set(f"{task_id}:assembling", 1, nx=True, ex=self._chunk_ttl)
+
+    @staticmethod
+    def _assembly_claimed(job: Job, result_exists: int, claimed: Optional[bool]) -> bool:
+        """
+        Whether the worker of `job`, whose chunks are all done, assembles the task.
+        Any chunk may do it while the result is missing, not only the first SADD
+        of the last one: its worker may have died before storing the result.
+        `<id>:assembling` keeps two workers from assembling at once, but a
+        redelivered chunk ignores it, since the claim may be the dead worker's.
+        A second assembly only rewrites the same result.
+        """
+        return not result_exists and (bool(claimed) or job.redelivered)
+
+    def _queue_result(self, pipe, task_id: str, payload: Union[str, bytes]):
+        """
+        Add the result and its completion notice to `pipe`. Consumers block on
+        BLPOP `<id>:notify` instead of polling the result key; the notice lives
+        as long as the result, so a consumer arriving late still gets it.
+        """
+        notify_key = f"{task_id}:notify"
+        pipe.set(task_id, payload, ex=self._result_ttl)
+        pipe.rpush(notify_key, 1)
+        if self._result_ttl:
+            pipe.expire(notify_key, self._result_ttl)
+
+    @staticmethod
+    def _result_payload(
+        data: Dict[str, Any],
+        results: List[int],
+        probs: Optional[np.ndarray],
+        result_format: str,
+    ) -> Union[str, bytes]:
+        if result_format == FORMAT_COMPACT:
+            return encode_compact(results, probs, data["modelVersion"])
+        return json.dumps(data)
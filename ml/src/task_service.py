@@ -1,46 +1,307 @@
 import datetime
-import json
+import functools
 import logging
 import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
 
-from onnx_model import ONNXClassifier
+import numpy as np
+import pika
+
+import metrics
+from config import WorkerConfig
+from lanes import LANE_BULK, LANE_INTERACTIVE, LaneQueue
+from prediction_cache import PredictionCache
+from result_codec import FORMAT_JSON
+from task_base import BaseTaskService, Job
 
 
 logger = logging.getLogger(os.getenv("WORKER_ID")+".task_service")
 
 
-class TaskService:
-    def __init__(self, chanel_in, task_in, redis):
+class TaskService(BaseTaskService):
+    """
+    Consumes tasks with manual acks and runs them through a three-stage pipeline
+    (decode + tokenize -> inference -> publish), one thread per stage, so the
+    tokenization of the next task overlaps the inference of the current one.
+    A message is acked only after its result is stored in Redis. The inference
+    stage merges concurrent short tasks into one model call via DynamicBatcher.
+    Texts already labelled by this model version are served from PredictionCache.
+    With CASCADE_VARIANT set, a cheap model answers confident texts and only the
+    rest reach the MODEL_VARIANT model (see cascade.CascadeClassifier).
+
+    Tasks with more than `chunk_size` messages are split into chunk tasks
+    {"id", "type", "chunk": {"index", "count", "offset"}, "messages"} and put
+    back on the queue, so every worker can take a part. Each chunk result is
+    appended to the `<id>:chunks` list as soon as it is ready, the set
+    `<id>:done` counts finished chunks, and the worker that completes the
+    last chunk assembles the usual full result under `<id>`.
+
+    With RABBITMQ_INTERACTIVE_QUEUE set, the worker also consumes the
+    interactive queue the backend sends short requests to. Its consumer has
+    INTERACTIVE_RESERVED prefetch slots of its own, so a backlog of file chunks
+    cannot take them, and interactive jobs overtake bulk ones in the stage
+    queues (lanes.LaneQueue). A bulk job longer than BULK_SLICE_TEXTS runs
+    slice by slice, with waiting interactive jobs served between slices.
+
+    A task may ask for the binary "compact-v1" result encoding (see
+    result_codec) with "resultFormat"; without it results are json, which is
+    what the backend reads. Class probabilities are added with
+    "withProbabilities", RESULT_PROBABILITIES being the default.
+    Results expire after RESULT_TTL seconds.
+
+    With MODEL_WATCH_INTERVAL set, a new model on disk is loaded and warmed up
+    in the background and swapped in without a restart (model_registry). Every
+    result carries the "modelVersion" that labelled it.
+
+    Stage timings, counters and gauges are exported through the metrics module.
+    """
+
+    def __init__(self, chanel_in, task_in, redis, config: WorkerConfig = WorkerConfig()):
+        super().__init__(config)
         self._channel_in = chanel_in
         self._task_queue = task_in
         self._redis = redis
-        self._predictor = ONNXClassifier(
-            onnx_path="model.onnx", tokenizer_name="sergeyzh/rubert-tiny-turbo"
+        self._cache = PredictionCache(
+            redis,
+            model_version=self._predictor.version,
+            local_size=config.cache_local_size,
+            shared_ttl=config.cache_shared_ttl,
+            shared_max_entries=config.cache_shared_max_entries,
         )
 
+        # Prefetch bounds the number of jobs in flight, so the stage queues
+        # never grow past it and the pika callback never blocks on put().
+        self._incoming = LaneQueue(config.interactive_weight)
+        self._predicted: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._stages = [
+            threading.Thread(
+                target=self._run_stage,
+                args=("tokenize", self._incoming, self._tokenize, self._tokenized),
+                name="tokenize",
+                daemon=True,
+            ),
+            threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+            threading.Thread(
+                target=self._run_stage,
+                args=("publish", self._predicted, self._publish, None),
+                name="publish",
+                daemon=True,
+            ),
+        ]
+
         self._channel_in.queue_declare(queue=self._task_queue, passive=True)
+        if self._interactive_queue:
+            self._channel_in.queue_declare(queue=self._interactive_queue, passive=True)
 
     def start(self):
+        for stage in self._stages:
+            stage.start()
+        self._start_watcher()
+
+        # Without global_qos the limit applies to each consumer started after it.
+        bulk_prefetch, interactive_prefetch = self._prefetch_limits()
+        self._channel_in.basic_qos(prefetch_count=bulk_prefetch)
         self._channel_in.basic_consume(
-            queue=self._task_queue, on_message_callback=self._callback, auto_ack=True
+            queue=self._task_queue, on_message_callback=self._callback, auto_ack=False
         )
-        self._channel_in.start_consuming()
+        if self._interactive_queue:
+            self._channel_in.basic_qos(prefetch_count=interactive_prefetch)
+            self._channel_in.basic_consume(
+                queue=self._interactive_queue,
+                on_message_callback=functools.partial(self._callback, lane=LANE_INTERACTIVE),
+                auto_ack=False,
+            )
+        try:
+            self._channel_in.start_consuming()
+        finally:
+            self._drain()
 
-    def _callback(self, ch, method, properties, body):
+    def stop(self):
+        """Stop consuming; in-flight tasks are finished and acked by start()."""
+        self._channel_in.connection.add_callback_threadsafe(
+            self._channel_in.stop_consuming
+        )
+
+    def _drain(self):
+        self._stop_watcher()
+        self._incoming.put(None)
+        for stage in self._stages:
+            stage.join()
+        # Deliver the acks the publish stage scheduled while shutting down.
+        self._channel_in.connection.process_data_events(time_limit=0)
+
+    def _callback(self, ch, method, properties, body, lane: str = LANE_BULK):
         logger.info(f"Получили таску {datetime.datetime.now()}")
-        string = body.decode("utf-8")
-        data = json.loads(string)
-        texts = [x["messageText"] for x in data["messages"]]
+        headers = getattr(properties, "headers", None) or {}
+        job = Job(
+            method.delivery_tag,
+            method.redelivered,
+            body,
+            received_at=time.monotonic(),
+            trace_id=headers.get("x-trace-id"),
+            lane=lane,
+        )
+        metrics.IN_FLIGHT.inc()
+        self._incoming.put(job)
+
+    def _run_stage(self, name, source, handler, sink):
+        while True:
+            job = source.get()
+            if job is None:
+                if sink is not None:
+                    sink.put(None)
+                return
+
+            try:
+                handler(job)
+            except Exception:
+                logger.exception(
+                    f"Ошибка обработки таски {datetime.datetime.now()} trace={job.trace_id}"
+                )
+                metrics.ERRORS.labels(name).inc()
+                self._reject(job)
+                continue
+
+            if sink is not None and not job.done:
+                sink.put(job)
+
+    def _inference_loop(self):
+        while True:
+            jobs = self._batcher.next_batch(self._tokenized)
+            if jobs is None:
+                self._predicted.put(None)
+                return
+
+            self._infer_batch(jobs, self._inferred)
 
-        logger.info(f"Старт МЛ {datetime.datetime.now()}")
-        results = self._predictor.predict(texts)
-        logger.info(f"Финиш МЛ {datetime.datetime.now()}")
+    def _inferred(self, jobs: List[Job], error: Optional[Exception]):
+        if error is not None:
+            logger.error(f"Ошибка обработки таски {datetime.datetime.now()}", exc_info=error)
+            metrics.ERRORS.labels("inference").inc(len(jobs))
+            for job in jobs:
+                self._reject(job)
+            return
 
-        for idx, res in enumerate(results):
-            data["messages"][idx]["result"] = res
+        for job in jobs:
+            self._predicted.put(job)
 
-        self._publish(data)
+    def _tokenize(self, job: Job):
+        with metrics.TOKENIZE_SECONDS.time():
+            self._prepare(job)
+
+    def _prepare(self, job: Job):
+        if self._decode(job):
+            self._split(job)
+            return
+
+        job.predictor = self._predictor
+        texts = [x["messageText"] for x in job.data["messages"]]
+        keys = self._cache.keys(texts, job.predictor.version)
+        cached = self._cache.lookup(keys) if self._uses_cache(job) else None
+        miss_texts = self._collect_misses(job, texts, keys, cached)
+        job.encoded = job.predictor.encode(miss_texts)
+        job.ready_at = time.monotonic()
+
+    def _split(self, job: Job):
+        data = job.data
+        meta, bodies = self._chunk_bodies(data)
+
+        meta_key = f"{data['id']}:meta"
+        pipe = self._redis.pipeline()
+        pipe.hset(meta_key, mapping=meta)
+        pipe.expire(meta_key, self._chunk_ttl)
+        pipe.execute()
+
+        # The original message is acked only after all of its chunks are queued.
+        self._threadsafe(self._publish_chunks, bodies=bodies, delivery_tag=job.delivery_tag)
+        metrics.IN_FLIGHT.dec()
+        job.done = True
+        logger.info(f"Разбили таску на {len(bodies)} частей {datetime.datetime.now()}")
+
+    def _publish_chunks(self, bodies: List[bytes], delivery_tag: int):
+        properties = pika.BasicProperties(content_type="application/json")
+        for body in bodies:
+            self._channel_in.basic_publish(
+                exchange="", routing_key=self._task_queue, body=body, properties=properties
+            )
+        self._channel_in.basic_ack(delivery_tag=delivery_tag)
+
+    def _publish(self, job: Job):
+        with metrics.PUBLISH_SECONDS.time():
+            if job.result_format == FORMAT_JSON:
+                self._attach_results(job.data["messages"], job.results, job.probs)
+
+            if "chunk" in job.data:
+                self._publish_chunk(job)
+            else:
+                self._store_result(job.data, job.results, job.probs, job.result_format)
+        self._ack(job)
+        metrics.TASKS.labels(job.data.get("type", "")).inc()
+        metrics.TEXTS.inc(len(job.results))
+        logger.info(f"Отправили таску {datetime.datetime.now()} trace={job.trace_id}")
+
+        if not self._cache_labels:
+            return
+        try:
+            self._cache.store(job.miss_keys, job.predicted)
+        except Exception:
+            logger.exception("Не удалось обновить кэш предсказаний")
+
+    def _store_result(
+        self,
+        data: Dict[str, Any],
+        results: List[int],
+        probs: Optional[np.ndarray],
+        result_format: str,
+    ):
+        payload = self._result_payload(data, results, probs, result_format)
+        pipe = self._redis.pipeline()
+        self._queue_result(pipe, data["id"], payload)
+        pipe.execute()
+
+    def _publish_chunk(self, job: Job):
+        data = job.data
+        chunk = data["chunk"]
+        chunks_key = f"{data['id']}:chunks"
+        done_key = f"{data['id']}:done"
+
+        pipe = self._redis.pipeline()
+        pipe.rpush(chunks_key, self._chunk_entry(job))
+        pipe.sadd(done_key, chunk["index"])
+        pipe.scard(done_key)
+        pipe.expire(chunks_key, self._chunk_ttl)
+        pipe.expire(done_key, self._chunk_ttl)
+        _, _, finished, _, _ = pipe.execute()
+
+        if finished == chunk["count"] and self._claim_assembly(job):
+            self._assemble(job)
+
+    def _claim_assembly(self, job: Job) -> bool:
+        pipe = self._redis.pipeline()
+        self._queue_assembly_claim(pipe, job.data["id"])
+        return self._assembly_claimed(job, *pipe.execute())
+
+    def _assemble(self, job: Job):
+        raw_parts = self._redis.lrange(f"{job.data['id']}:chunks", 0, -1)
+        result, results, probs = self._assembled(job, raw_parts)
+        self._store_result(result, results, probs, job.result_format)
+
+    def _ack(self, job: Job):
+        self._threadsafe(self._channel_in.basic_ack, delivery_tag=job.delivery_tag)
+        metrics.IN_FLIGHT.dec()
+
+    def _reject(self, job: Job):
+        metrics.IN_FLIGHT.dec()
+        # Give a task one more try on another worker, then drop it.
+        self._threadsafe(
+            self._channel_in.basic_nack,
+            delivery_tag=job.delivery_tag,
+            requeue=not job.redelivered,
+        )
 
-    def _publish(self, message):
-        self._redis.set(message["id"], json.dumps(message))
-        logger.info(f"Отправили таску {datetime.datetime.now()}")
+    def _threadsafe(self, fn, **kwargs):
+        # pika channels are not thread-safe: run the call on the connection thread.
+        self._channel_in.connection.add_callback_threadsafe(functools.partial(fn, **kwargs))
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The worker modules name their loggers after WORKER_ID and import each other
+# from ml/src, as in the container.
+os.environ.setdefault("WORKER_ID", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import task_base  # noqa: E402
+from config import WorkerConfig  # noqa: E402
+
+
+class FakePredictor:
+    """
+    ONNXClassifier stand-in: a text is encoded as [len(text)] and labelled by
+    the parity of its length. Empty inputs give the same shapes as the real one.
+    """
+
+    load_seconds = {}
+
+    def __init__(self, version: str = "fake"):
+        self.version = version
+
+    def warmup(self):
+        pass
+
+    def encode(self, texts):
+        return [[len(text)] for text in texts]
+
+    def predict_encoded(self, encoded):
+        return [ids[0] % 2 for ids in encoded]
+
+    def predict_proba_encoded(self, encoded):
+        if not encoded:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.eye(2, dtype=np.float32)[self.predict_encoded(encoded)]
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    """Build a worker service class around FakePredictor instead of an ONNX model."""
+    monkeypatch.setattr(task_base, "create_predictor", lambda config: FakePredictor())
+
+    def make(cls=task_base.BaseTaskService, *args, **overrides):
+        return cls(*args, config=WorkerConfig(**overrides))
+
+    return make
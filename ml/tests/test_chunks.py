@@ -0,0 +1,153 @@
+import asyncio
+import json
+import random
+from unittest import mock
+
+import pytest
+
+from async_worker import AsyncTaskService
+from task_base import Job
+from task_service import TaskService
+
+fakeredis = pytest.importorskip("fakeredis")
+
+TASK_ID = "task"
+MESSAGES = [{"messageText": "x" * length} for length in range(1, 8)]
+
+
+def _chunk_jobs(service, redelivered=False):
+    """Decoded and predicted jobs of the chunk tasks `service` splits the test task into."""
+    meta, bodies = service._chunk_bodies({"id": TASK_ID, "type": "FullTask", "messages": MESSAGES})
+    jobs = []
+    for tag, body in enumerate(bodies):
+        job = Job(tag, redelivered, body, received_at=0.0)
+        assert not service._decode(job)
+        job.predictor = service._predictor
+        texts = [message["messageText"] for message in job.data["messages"]]
+        keys = [text.encode() for text in texts]
+        job.encoded = job.predictor.encode(service._collect_misses(job, texts, keys, None))
+        service._infer([job])
+        service._attach_results(job.data["messages"], job.results, job.probs)
+        jobs.append(job)
+    return meta, jobs
+
+
+def _expected():
+    return [len(message["messageText"]) % 2 for message in MESSAGES]
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def service(make_service, redis):
+    return make_service(TaskService, mock.MagicMock(), "q", redis, chunk_size=3)
+
+
+def test_chunk_bodies(service):
+    meta, bodies = service._chunk_bodies({"id": TASK_ID, "type": "FullTask", "messages": MESSAGES})
+
+    chunks = [json.loads(body) for body in bodies]
+    assert meta == {"chunks": 3, "messages": 7}
+    assert [chunk["chunk"] for chunk in chunks] == [
+        {"index": 0, "count": 3, "offset": 0},
+        {"index": 1, "count": 3, "offset": 3},
+        {"index": 2, "count": 3, "offset": 6},
+    ]
+    assert [m for chunk in chunks for m in chunk["messages"]] == MESSAGES
+    assert all(chunk["type"] == "FullTask" for chunk in chunks)
+
+
+def test_assembled_restores_order_and_drops_duplicates(service):
+    _, jobs = _chunk_jobs(service)
+    entries = [service._chunk_entry(job) for job in jobs]
+    raw_parts = [entries[2], entries[0], entries[2], entries[1]]
+
+    result, results, probs = service._assembled(jobs[0], raw_parts)
+
+    assert results == _expected()
+    assert [m["messageText"] for m in result["messages"]] == [m["messageText"] for m in MESSAGES]
+    assert "chunk" not in result and probs is None
+    assert result["modelVersion"] == "fake"
+
+
+def test_assembled_lists_model_versions_of_chunks(service):
+    _, jobs = _chunk_jobs(service)
+    jobs[1].data["modelVersion"] = "new"
+    jobs[2].data["modelVersion"] = "new"
+
+    result, _, _ = service._assembled(jobs[0], [service._chunk_entry(job) for job in jobs])
+
+    assert result["modelVersion"] == "fake,new"
+
+
+def test_out_of_order_chunks_assemble_once(service, redis):
+    _, jobs = _chunk_jobs(service)
+    random.Random(0).shuffle(jobs)
+
+    for job in jobs:
+        service._publish_chunk(job)
+
+    result = json.loads(redis.get(TASK_ID))
+    assert [m["result"] for m in result["messages"]] == _expected()
+    assert redis.llen(f"{TASK_ID}:notify") == 1
+
+
+def test_redelivered_chunk_after_stored_result_changes_nothing(service, redis):
+    _, jobs = _chunk_jobs(service)
+    for job in jobs:
+        service._publish_chunk(job)
+
+    jobs[0].redelivered = True
+    service._publish_chunk(jobs[0])
+
+    assert redis.llen(f"{TASK_ID}:notify") == 1
+    assert redis.scard(f"{TASK_ID}:done") == 3
+
+
+def test_redelivered_last_chunk_assembles_after_crash(service, redis):
+    _, jobs = _chunk_jobs(service)
+    # The worker of the last chunk dies after its SADD, before storing the result.
+    with mock.patch.object(service, "_assemble", side_effect=RuntimeError("worker died")):
+        with pytest.raises(RuntimeError):
+            for job in jobs:
+                service._publish_chunk(job)
+    assert redis.get(TASK_ID) is None
+
+    jobs[-1].redelivered = True
+    service._publish_chunk(jobs[-1])
+
+    result = json.loads(redis.get(TASK_ID))
+    assert [m["result"] for m in result["messages"]] == _expected()
+
+
+def test_duplicate_chunk_does_not_assemble_while_claimed(service, redis):
+    _, jobs = _chunk_jobs(service)
+    redis.set(f"{TASK_ID}:assembling", 1)
+
+    for job in jobs:
+        service._publish_chunk(job)
+
+    assert redis.get(TASK_ID) is None
+
+
+def test_async_redelivered_last_chunk_assembles_after_crash(make_service):
+    redis = fakeredis.FakeAsyncRedis()
+    service = make_service(AsyncTaskService, mock.MagicMock(), "q", redis, chunk_size=3)
+    _, jobs = _chunk_jobs(service)
+
+    async def run():
+        with mock.patch.object(service, "_assembled", side_effect=RuntimeError("worker died")):
+            with pytest.raises(RuntimeError):
+                for job in jobs:
+                    await service._publish(job)
+        assert await redis.get(TASK_ID) is None
+
+        jobs[-1].redelivered = True
+        await service._publish(jobs[-1])
+        return json.loads(await redis.get(TASK_ID))
+
+    result = asyncio.run(run())
+    assert [m["result"] for m in result["messages"]] == _expected()
@@ -0,0 +1,111 @@
+import queue
+import threading
+from dataclasses import dataclass
+
+import pytest
+
+from lanes import LANE_BULK, LANE_INTERACTIVE, LaneQueue
+from task_base import Job
+
+
+@dataclass
+class Item:
+    name: str
+    lane: str
+
+
+def _drain(lanes):
+    names = []
+    while lanes.qsize():
+        names.append(lanes.get_nowait().name)
+    return names
+
+
+def test_single_lane_is_fifo():
+    lanes = LaneQueue(weight=4)
+    for idx in range(5):
+        lanes.put(Item(f"b{idx}", LANE_BULK))
+
+    assert _drain(lanes) == ["b0", "b1", "b2", "b3", "b4"]
+
+
+def test_interactive_first_with_one_bulk_per_weight():
+    lanes = LaneQueue(weight=2)
+    for idx in range(3):
+        lanes.put(Item(f"b{idx}", LANE_BULK))
+    for idx in range(5):
+        lanes.put(Item(f"i{idx}", LANE_INTERACTIVE))
+
+    assert _drain(lanes) == ["i0", "i1", "b0", "i2", "i3", "b1", "i4", "b2"]
+
+
+def test_take_drains_one_lane():
+    lanes = LaneQueue(weight=4)
+    lanes.put(Item("b0", LANE_BULK))
+    lanes.put(Item("i0", LANE_INTERACTIVE))
+    lanes.put(Item("i1", LANE_INTERACTIVE))
+
+    assert [item.name for item in lanes.take(LANE_INTERACTIVE)] == ["i0", "i1"]
+    assert lanes.take(LANE_INTERACTIVE) == []
+    assert _drain(lanes) == ["b0"]
+
+
+def test_get_times_out_when_empty():
+    lanes = LaneQueue(weight=4)
+
+    with pytest.raises(queue.Empty):
+        lanes.get(timeout=0.01)
+    with pytest.raises(queue.Empty):
+        lanes.get_nowait()
+
+
+def test_close_after_pending_jobs():
+    lanes = LaneQueue(weight=4)
+    lanes.put(Item("b0", LANE_BULK))
+    lanes.put(None)
+
+    assert lanes.get().name == "b0"
+    assert lanes.get() is None
+
+
+def test_get_wakes_up_on_put():
+    lanes = LaneQueue(weight=4)
+    timer = threading.Timer(0.05, lanes.put, [Item("i0", LANE_INTERACTIVE)])
+    timer.start()
+
+    assert lanes.get(timeout=5).name == "i0"
+    timer.join()
+
+
+def _tokenized_job(service, name, texts, lane):
+    job = Job(0, False, b"", received_at=0.0, trace_id=name, lane=lane)
+    job.data = {"id": name, "messages": [{"messageText": text} for text in texts]}
+    job.predictor = service._predictor
+    keys = [text.encode() for text in texts]
+    job.encoded = job.predictor.encode(service._collect_misses(job, texts, keys, None))
+    return job
+
+
+def test_interactive_job_held_by_batcher_runs_between_bulk_slices(make_service):
+    service = make_service(
+        interactive_queue="interactive",
+        bulk_slice_texts=2,
+        batch_max_texts=4,
+        batch_small_task_texts=8,
+        batch_max_wait_ms=5000,
+    )
+    bulk = _tokenized_job(service, "bulk", ["a", "bb", "ccc"], LANE_BULK)
+    interactive = _tokenized_job(service, "interactive", ["dd", "e"], LANE_INTERACTIVE)
+    service._tokenized.put(bulk)
+    # Arrives while the batcher waits for more small jobs; it does not fit
+    # next to the bulk one and is held back for the next batch.
+    timer = threading.Timer(0.05, service._tokenized.put, [interactive])
+    timer.start()
+    assert service._batcher.next_batch(service._tokenized) == [bulk]
+    timer.join()
+    finished = []
+    service._infer_batch([bulk], lambda jobs, error: finished.extend(job.trace_id for job in jobs))
+
+    assert finished == ["interactive", "bulk"]
+    assert interactive.results == [0, 1]
+    assert bulk.results == [1, 0, 1]
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from prediction_cache import AsyncPredictionCache, PredictionCache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _cache(cls, redis, max_entries):
+    return cls(redis, model_version="v1", local_size=0, shared_ttl=60, shared_max_entries=max_entries)
+
+
+def test_shared_round_trip():
+    cache = _cache(PredictionCache, fakeredis.FakeRedis(), 10)
+    keys = cache.keys(["a", "b  c", "d"])
+    cache.store(keys[:2], [1, 2])
+
+    assert cache.lookup(cache.keys(["a", "b c", "d"])) == [1, 2, None]
+    assert cache.stats()["shared_hits"] == 2
+
+
+def test_full_shared_cache_evicts_least_recently_used(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    cache = _cache(PredictionCache, redis, 3)
+    clock = iter(range(100))
+    monkeypatch.setattr("prediction_cache.time.time", lambda: next(clock))
+    keys = cache.keys(["a", "b", "c", "d", "e"])
+
+    cache.store(keys[:3], [0, 1, 2])
+    # "a" is used again, so "b" is now the oldest entry.
+    assert cache.lookup(keys[:1]) == [0]
+    cache.store(keys[3:], [3, 4])
+
+    assert redis.hlen("prediction_cache:v1") == 3
+    assert cache.lookup(keys) == [0, None, None, 3, 4]
+
+
+def test_async_full_shared_cache_keeps_newest_entries(monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr("prediction_cache.time.time", lambda: next(clock))
+    redis = fakeredis.FakeAsyncRedis()
+    cache = _cache(AsyncPredictionCache, redis, 2)
+    keys = cache.keys(["a", "b", "c"])
+
+    async def run():
+        for key, value in zip(keys, [0, 1, 2]):
+            await cache.store([key], [value])
+        return await redis.hlen("prediction_cache:v1"), await cache.lookup(keys)
+
+    assert asyncio.run(run()) == (2, [None, 1, 2])
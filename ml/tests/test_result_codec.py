@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from result_codec import _HEADER, encode_compact, decode_compact
+
+
+def test_round_trip_class_ids():
+    class_ids, probs, model_version = decode_compact(encode_compact([0, 2, 1, 1]))
+
+    assert class_ids.tolist() == [0, 2, 1, 1]
+    assert probs is None
+    assert model_version == ""
+
+
+def test_round_trip_probabilities():
+    expected = np.array([[0.1, 0.7, 0.2], [0.6, 0.3, 0.1]], dtype=np.float32)
+
+    class_ids, probs, model_version = decode_compact(encode_compact([1, 0], expected, "abc-512-tail"))
+
+    assert class_ids.tolist() == [1, 0]
+    assert model_version == "abc-512-tail"
+    assert probs.shape == (2, 3)
+    np.testing.assert_allclose(probs, expected, atol=1e-3)
+
+
+def test_round_trip_empty():
+    class_ids, probs, _ = decode_compact(encode_compact([], np.empty((0, 3), dtype=np.float32)))
+
+    assert len(class_ids) == 0
+    assert probs.shape == (0, 3)
+
+
+def test_payload_size():
+    payload = encode_compact([0] * 10, np.zeros((10, 3), dtype=np.float32), "v1")
+
+    assert len(payload) == _HEADER.size + 2 + 10 + 10 * 3 * 2
+
+
+def test_rejects_other_encodings():
+    payload = bytearray(encode_compact([1]))
+    payload[3] += 1
+
+    with pytest.raises(ValueError):
+        decode_compact(bytes(payload))
+    with pytest.raises(ValueError):
+        decode_compact(b"{}" + bytes(_HEADER.size))
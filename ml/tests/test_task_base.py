@@ -0,0 +1,66 @@
+import json
+
+from result_codec import FORMAT_COMPACT, FORMAT_JSON, decode_compact
+from task_base import Job
+
+
+def _job(service, task):
+    job = Job(1, False, json.dumps(task).encode(), received_at=0.0)
+    assert not service._decode(job)
+    job.predictor = service._predictor
+    texts = [message["messageText"] for message in job.data["messages"]]
+    keys = [text.encode() for text in texts]
+    job.encoded = job.predictor.encode(service._collect_misses(job, texts, keys, None))
+    return job
+
+
+def test_infer_empty_task_with_probabilities(make_service):
+    service = make_service()
+    job = _job(service, {"id": "t", "messages": [], "withProbabilities": True})
+
+    service._infer([job])
+
+    assert job.results == []
+    payload = service._result_payload(job.data, job.results, job.probs, job.result_format)
+    assert json.loads(payload)["messages"] == []
+
+
+def test_infer_empty_compact_task_with_probabilities(make_service):
+    service = make_service(result_probabilities=True)
+    job = _job(service, {"id": "t", "messages": [], "resultFormat": FORMAT_COMPACT})
+
+    service._infer([job])
+
+    payload = service._result_payload(job.data, job.results, job.probs, job.result_format)
+    class_ids, probs, model_version = decode_compact(payload)
+    assert len(class_ids) == 0 and len(probs) == 0
+    assert model_version == service._predictor.version
+
+
+def test_results_default_to_json(make_service):
+    service = make_service()
+    job = _job(service, {"id": "t", "messages": []})
+
+    service._infer([job])
+
+    assert job.result_format == FORMAT_JSON
+    payload = service._result_payload(job.data, job.results, job.probs, job.result_format)
+    assert json.loads(payload)["modelVersion"] == service._predictor.version
+
+
+def test_infer_with_probabilities(make_service):
+    service = make_service()
+    messages = [{"messageText": "ab"}, {"messageText": "abc"}]
+    job = _job(service, {"id": "t", "messages": messages, "withProbabilities": True})
+
+    service._infer([job])
+
+    assert job.results == [0, 1]
+    assert job.probs.tolist() == [[1.0, 0.0], [0.0, 1.0]]
+
+
+def test_adaptive_length_limit_bypasses_cache(make_service):
+    task = {"id": "t", "messages": [{"messageText": "ab"}]}
+    assert make_service()._uses_cache(_job(make_service(), task))
+    service = make_service(adaptive_length_quantile=0.95)
+    assert not service._uses_cache(_job(service, task))
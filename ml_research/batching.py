@@ -0,0 +1,197 @@
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from training_config import TrainingConfig
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def dataset_lengths(dataset: Dataset) -> np.ndarray:
+    """
+    Number of real (non-padding) tokens of every item.
+
+    Args:
+        dataset (Dataset): TokenizedDataset, SentimentDataset or any dataset whose items have input_ids.
+
+    Returns:
+        np.ndarray: Token count per item.
+    """
+    lengths = getattr(dataset, "lengths", None)
+    if lengths is not None:
+        return np.asarray(lengths)
+    encodings = getattr(dataset, "encodings", None)
+    if encodings is not None and "attention_mask" in encodings:
+        return torch.as_tensor(encodings["attention_mask"]).sum(dim=1).numpy()
+    return np.array([len(dataset[idx]["input_ids"]) for idx in range(len(dataset))])
+
+
+class LengthGroupedBatchSampler(Sampler[List[int]]):
+    """
+    Yields batches of indices of similar length, so that little of each batch is padding.
+
+    Indices are shuffled, split into groups of `group_size` batches worth of items,
+    sorted by length inside each group and cut into batches; the batch order is
+    shuffled again. Batches hold either `batch_size` items or, with `max_tokens`,
+    as many items as fit into max_tokens once padded to the longest of them.
+    The order depends only on the seed and the epoch set with set_epoch.
+
+    Args:
+        lengths (np.ndarray): Token count per item, see dataset_lengths.
+        batch_size (int): Items per batch; also the group size unit with max_tokens.
+        max_tokens (int): Token budget per batch, 0 for fixed-size batches. Defaults to 0.
+        shuffle (bool): Shuffle items and batches. Without it batches are sorted by length. Defaults to True.
+        group_size (int): Batches per sorted group. Defaults to 50.
+        seed (int): Seed of the shuffles. Defaults to 0.
+    """
+
+    def __init__(self, lengths: np.ndarray, batch_size: int, max_tokens: int = 0, shuffle: bool = True,
+                 group_size: int = 50, seed: int = 0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.group_size = group_size
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self._batches: Optional[List[List[int]]] = None
+
+    def set_epoch(self, epoch: int, start_batch: int = 0) -> None:
+        """
+        Select the shuffle of `epoch`; call before iterating over every epoch.
+        The next iteration begins at batch `start_batch`, to resume a checkpoint.
+        """
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._batches = None
+        self.start_batch = start_batch
+
+    def state_dict(self) -> Dict[str, int]:
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state: Dict[str, int]) -> None:
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+        self._batches = None
+
+    def _build(self) -> List[List[int]]:
+        if self._batches is not None:
+            return self._batches
+        rng = np.random.default_rng((self.seed, self.epoch))
+        if self.shuffle:
+            order = rng.permutation(len(self.lengths))
+            step = self.batch_size * self.group_size
+            groups = [order[start:start + step] for start in range(0, len(order), step)]
+        else:
+            groups = [np.arange(len(self.lengths))]
+
+        batches = []
+        for group in groups:
+            group = group[np.argsort(-self.lengths[group], kind="stable")]
+            batches.extend(self._cut(group))
+        if self.shuffle:
+            batches = [batches[idx] for idx in rng.permutation(len(batches))]
+        self._batches = batches
+        return batches
+
+    def _cut(self, indices: np.ndarray) -> List[List[int]]:
+        """Split indices sorted by decreasing length into batches."""
+        if not self.max_tokens:
+            return [indices[start:start + self.batch_size].tolist()
+                    for start in range(0, len(indices), self.batch_size)]
+        batches = []
+        batch: List[int] = []
+        longest = 0
+        for idx in indices.tolist():
+            length = int(self.lengths[idx])
+            if batch and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(idx)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._build()[self.start_batch:]
+        self.start_batch = 0
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self._build())
+
+
+class DynamicPaddingCollator:
+    """
+    Collates items into a batch padded only to its longest item.
+
+    Items may be unpadded (TokenizedDataset with pad_to_max_length=False) or already
+    padded to a fixed length (SentimentDataset); the latter are cut to their
+    attention mask. Padding is on the right, as with the tokenizer, so the model
+    outputs are the same as for fixed-length batches.
+
+    Args:
+        pad_token_id (int): Token id used for padding. Defaults to 0.
+        pad_to_multiple_of (int): Round the batch length up to a multiple of this. Defaults to 1.
+    """
+
+    def __init__(self, pad_token_id: int = 0, pad_to_multiple_of: int = 1):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, items: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        lengths = [
+            int(item["attention_mask"].sum()) if "attention_mask" in item else len(item["input_ids"])
+            for item in items
+        ]
+        width = -(-max(lengths) // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(items), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(items), width), dtype=torch.long)
+        for row, (item, length) in enumerate(zip(items, lengths)):
+            input_ids[row, :length] = item["input_ids"][:length]
+            attention_mask[row, :length] = 1
+        batch = {"input_ids": input_ids, "attention_mask": attention_mask}
+        # labels and per-item extras such as teacher_logits are stacked as they are.
+        for key in items[0].keys() - batch.keys():
+            batch[key] = torch.stack([torch.as_tensor(item[key]) for item in items])
+        return batch
+
+
+def create_dataloader(dataset: Dataset, config: TrainingConfig, train: bool = True) -> DataLoader:
+    """
+    DataLoader for ModelTrainer following the batching settings of the config.
+
+    With group_by_length off and max_batch_tokens at 0 this is the plain
+    fixed-size DataLoader (shuffled for training).
+
+    Args:
+        dataset (Dataset): Training or validation dataset.
+        config (TrainingConfig): batch_size, group_by_length, max_batch_tokens and seed are used.
+        train (bool): Shuffle the batches. Defaults to True.
+
+    Returns:
+        DataLoader: The loader.
+    """
+    collator = DynamicPaddingCollator(pad_token_id=getattr(dataset, "pad_token_id", 0) or 0)
+    if not config.group_by_length and not config.max_batch_tokens:
+        # Unpadded items (pad_to_max_length=False) cannot go through the default collate.
+        padded = getattr(dataset, "pad_to_max_length", True)
+        return DataLoader(dataset, batch_size=config.batch_size, shuffle=train,
+                          collate_fn=None if padded else collator)
+
+    sampler = LengthGroupedBatchSampler(
+        dataset_lengths(dataset),
+        batch_size=config.batch_size,
+        max_tokens=config.max_batch_tokens,
+        shuffle=train,
+        seed=config.seed,
+    )
+    logger.info(f"Length-grouped batches: {len(sampler)} per epoch")
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collator)
@@ -0,0 +1,285 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from transformers import AutoModelForSequenceClassification, PreTrainedModel, PreTrainedTokenizerFast
+from tqdm import tqdm
+
+from batching import DynamicPaddingCollator, LengthGroupedBatchSampler, create_dataloader
+from onnx_converter import ONNXExporter
+from retraining_classes import ModelTrainer
+from token_cache import TokenizedDataset, build_token_cache
+from training_config import TrainingConfig
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Label of corpus texts without a human label; ignored by the hard-label loss.
+UNLABELED = -100
+
+_LAYER_INDEX = re.compile(r"\.layer\.(\d+)\.")
+
+
+def model_fingerprint(model: torch.nn.Module) -> str:
+    """
+    Hash of the model weights, naming the cached logits of a teacher.
+
+    Args:
+        model (torch.nn.Module): The model.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_teacher_logits(teacher: PreTrainedModel, dataset: TokenizedDataset, path: str,
+                         config: TrainingConfig = TrainingConfig(), batch_size: int = 64) -> np.ndarray:
+    """
+    Run the teacher over the dataset once and keep its logits in a .npy file.
+
+    Texts are batched by length with dynamic padding. The file is written under a
+    temporary name and renamed when complete; an existing file is reused.
+
+    Args:
+        teacher (PreTrainedModel): Fine-tuned teacher model.
+        dataset (TokenizedDataset): Corpus to label.
+        path (str): Output .npy file; name it after the teacher, e.g. with model_fingerprint.
+        config (TrainingConfig): Device and bf16 setting. Defaults to TrainingConfig().
+        batch_size (int): Inference batch size. Defaults to 64.
+
+    Returns:
+        np.ndarray: Memory-mapped float32 logits, one row per text.
+    """
+    if os.path.exists(path):
+        logger.info(f"Using teacher logits {path}")
+        return np.load(path, mmap_mode="r")
+
+    sampler = LengthGroupedBatchSampler(dataset.lengths, batch_size=batch_size, shuffle=False)
+    loader = DataLoader(dataset, batch_sampler=sampler,
+                        collate_fn=DynamicPaddingCollator(pad_token_id=dataset.pad_token_id or 0))
+    partial_path = f"{path}.tmp.npy"
+    logits = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.float32,
+                                       shape=(len(dataset), teacher.config.num_labels))
+
+    teacher = teacher.to(config.device).eval()
+    with torch.no_grad(), torch.autocast(device_type=config.device.type, dtype=torch.bfloat16,
+                                         enabled=config.bf16):
+        for indices, batch in zip(list(sampler), tqdm(loader, desc="Teacher logits")):
+            outputs = teacher(input_ids=batch["input_ids"].to(config.device),
+                              attention_mask=batch["attention_mask"].to(config.device))
+            logits[indices] = outputs.logits.float().cpu().numpy()
+
+    logits.flush()
+    del logits
+    os.replace(partial_path, path)
+    logger.info(f"Teacher logits saved to {path}")
+    return np.load(path, mmap_mode="r")
+
+
+class DistillationDataset(Dataset):
+    """
+    A TokenizedDataset whose items also carry the cached teacher logits.
+
+    Args:
+        dataset (TokenizedDataset): Tokenized corpus.
+        teacher_logits (np.ndarray): Logits from cache_teacher_logits, one row per item.
+    """
+
+    def __init__(self, dataset: TokenizedDataset, teacher_logits: np.ndarray):
+        self.dataset = dataset
+        self.teacher_logits = teacher_logits
+        # Read by batching and ModelTrainer.
+        self.lengths = dataset.lengths
+        self.pad_token_id = dataset.pad_token_id
+        self.pad_to_max_length = dataset.pad_to_max_length
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        item = self.dataset[idx]
+        item["teacher_logits"] = torch.from_numpy(np.array(self.teacher_logits[idx], dtype=np.float32))
+        return item
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+
+class DistillationTrainer(ModelTrainer):
+    """
+    ModelTrainer that fits a student to the teacher's soft targets.
+
+    The loss is the KL divergence between the temperature-softened teacher and student
+    distributions, scaled by temperature², mixed with cross-entropy on the texts that
+    have a label (not UNLABELED) with weight `alpha`. Validation uses the labels as usual.
+
+    Args:
+        model (PreTrainedModel): Student model.
+        train_loader (DataLoader): Loader over a DistillationDataset.
+        val_loader (DataLoader): Loader over the labelled validation set.
+        config (TrainingConfig): Configuration object containing hyperparameters and settings.
+        temperature (float): Softmax temperature of the soft targets. Defaults to 2.0.
+        alpha (float): Weight of the hard-label loss. Defaults to 0.0.
+    """
+
+    def __init__(self, model: PreTrainedModel, train_loader: DataLoader, val_loader: DataLoader,
+                 config: TrainingConfig = TrainingConfig(), temperature: float = 2.0, alpha: float = 0.0):
+        self.temperature = temperature
+        self.alpha = alpha
+        super().__init__(model, train_loader, val_loader, config)
+
+    def _calculate_class_weights(self) -> Optional[torch.Tensor]:
+        # The soft targets already carry the teacher's view of the classes.
+        return None
+
+    def _compute_loss(self, outputs: Any, inputs: Dict[str, torch.Tensor],
+                      batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        student = outputs.logits.float()
+        teacher = batch["teacher_logits"].to(self.config.device)
+        t = self.temperature
+        loss = F.kl_div(F.log_softmax(student / t, dim=-1), F.log_softmax(teacher / t, dim=-1),
+                        reduction="batchmean", log_target=True) * t * t
+        if not self.alpha:
+            return loss
+
+        labels = inputs["labels"]
+        # Summed and divided by hand: a batch without labels gives 0 rather than NaN.
+        hard = F.cross_entropy(student, labels, ignore_index=UNLABELED, reduction="sum")
+        hard = hard / (labels != UNLABELED).sum().clamp(min=1)
+        return (1 - self.alpha) * loss + self.alpha * hard
+
+
+def create_student(teacher: PreTrainedModel, num_hidden_layers: int, **overrides: int) -> PreTrainedModel:
+    """
+    Build a smaller model of the teacher's architecture.
+
+    With only fewer layers, the student starts from evenly spaced teacher layers and
+    the teacher's embeddings and classifier. Any other size change (hidden_size,
+    intermediate_size, num_attention_heads) starts the student from scratch.
+
+    Args:
+        teacher (PreTrainedModel): Fine-tuned teacher model.
+        num_hidden_layers (int): Transformer layers of the student.
+        **overrides (int): Other config fields to change.
+
+    Returns:
+        PreTrainedModel: The student.
+    """
+    config = teacher.config.__class__.from_dict({
+        **teacher.config.to_dict(), **overrides, "num_hidden_layers": num_hidden_layers
+    })
+    student = AutoModelForSequenceClassification.from_config(config)
+    if overrides:
+        return student
+
+    keep = np.linspace(0, teacher.config.num_hidden_layers - 1, num_hidden_layers).round().astype(int)
+    teacher_state = teacher.state_dict()
+    state = {}
+    for key in student.state_dict():
+        source = _LAYER_INDEX.sub(lambda match: f".layer.{keep[int(match.group(1))]}.", key, count=1)
+        state[key] = teacher_state[source]
+    student.load_state_dict(state)
+    logger.info(f"Student initialised from teacher layers {keep.tolist()}")
+    return student
+
+
+def compare_with_teacher(teacher_exporter: ONNXExporter, student_exporter: ONNXExporter, texts: List[str],
+                         labels: List[int], batch_size: int = 32, max_length: int = 128) -> Dict[str, Any]:
+    """
+    Latency-vs-F1 of the exported student against the exported teacher, variant by variant.
+
+    Args:
+        teacher_exporter (ONNXExporter): Exporter whose output_dir holds the teacher variants.
+        student_exporter (ONNXExporter): Exporter whose output_dir holds the student variants.
+        texts (List[str]): Validation texts.
+        labels (List[int]): Validation labels.
+        batch_size (int): Inference batch size. Defaults to 32.
+        max_length (int): Tokenizer truncation length, as in the ML worker. Defaults to 128.
+
+    Returns:
+        Dict[str, Any]: Both latency reports, and speedup and F1 delta per variant.
+    """
+    teacher = teacher_exporter.latency_report(texts, labels, batch_size, max_length)
+    student = student_exporter.latency_report(texts, labels, batch_size, max_length)
+    report = {"teacher": teacher, "student": student, "comparison": {}}
+    for variant in student.keys() & teacher.keys():
+        report["comparison"][variant] = {
+            "speedup": student[variant]["texts_per_sec"] / teacher[variant]["texts_per_sec"],
+            "f1_delta": student[variant]["f1"] - teacher[variant]["f1"],
+        }
+        logger.info(
+            f"{variant}: student {student[variant]['texts_per_sec']:.0f} texts/s per core "
+            f"(x{report['comparison'][variant]['speedup']:.1f}), "
+            f"F1 {student[variant]['f1']:.4f} vs {teacher[variant]['f1']:.4f}"
+        )
+
+    report_path = os.path.join(student_exporter.config.output_dir, "distillation_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Distillation report saved to {report_path}")
+    return report
+
+
+def distill(teacher: PreTrainedModel, tokenizer: PreTrainedTokenizerFast, corpus: Sequence[str],
+            val_texts: List[str], val_labels: List[int], teacher_dir: str,
+            config: TrainingConfig = TrainingConfig(output_dir="./student"), num_hidden_layers: int = 1,
+            max_length: int = 128, temperature: float = 2.0, cache_dir: str = "./token_cache",
+            **overrides: int) -> Dict[str, Any]:
+    """
+    The whole workflow: teacher logits on the corpus, student training, ONNX export
+    of the student and the latency-vs-F1 comparison with the teacher.
+
+    Args:
+        teacher (PreTrainedModel): Fine-tuned teacher model.
+        tokenizer (PreTrainedTokenizerFast): Tokenizer shared by teacher and student.
+        corpus (Sequence[str]): Unlabelled texts to distill on.
+        val_texts (List[str]): Validation texts.
+        val_labels (List[int]): Validation labels.
+        teacher_dir (str): Directory with the exported teacher variants.
+        config (TrainingConfig): Student training settings; output_dir receives the student.
+        num_hidden_layers (int): Transformer layers of the student. Defaults to 1.
+        max_length (int): Tokenizer truncation length. Defaults to 128.
+        temperature (float): Softmax temperature of the soft targets. Defaults to 2.0.
+        cache_dir (str): Directory of the token and logit caches. Defaults to "./token_cache".
+        **overrides (int): Other student config fields, see create_student.
+
+    Returns:
+        Dict[str, Any]: The report of compare_with_teacher.
+    """
+    corpus_path = build_token_cache(corpus, [UNLABELED] * len(corpus), tokenizer, max_length, cache_dir)
+    corpus_dataset = TokenizedDataset(corpus_path, pad_to_max_length=False)
+    teacher_logits = cache_teacher_logits(
+        teacher, corpus_dataset, os.path.join(corpus_path, f"teacher_logits.{model_fingerprint(teacher)}.npy"),
+        config,
+    )
+
+    val_path = build_token_cache(val_texts, val_labels, tokenizer, max_length, cache_dir)
+    train_loader = create_dataloader(DistillationDataset(corpus_dataset, teacher_logits), config)
+    val_loader = create_dataloader(TokenizedDataset(val_path, pad_to_max_length=False), config, train=False)
+
+    student = create_student(teacher, num_hidden_layers, **overrides)
+    trainer = DistillationTrainer(student, train_loader, val_loader, config, temperature=temperature)
+    trainer.train()
+
+    student.load_state_dict(torch.load(os.path.join(config.output_dir, "best_model.pt"),
+                                       map_location="cpu"))
+    student = student.to("cpu").eval()
+    student_exporter = ONNXExporter(student, tokenizer, config)
+    student_exporter.export()
+    student_exporter.optimize()
+    student_exporter.quantize()
+
+    teacher_exporter = ONNXExporter(teacher.to("cpu").eval(), tokenizer,
+                                    dataclasses.replace(config, output_dir=teacher_dir))
+    return compare_with_teacher(teacher_exporter, student_exporter, val_texts, val_labels,
+                                max_length=max_length)
@@ -1,12 +1,25 @@
+import json
+import os
+import time
 import torch
 import logging
-from typing import Dict, Any
+import numpy as np
+import onnxruntime
+from typing import Dict, Any, List
+from sklearn.metrics import f1_score
 from transformers import PreTrainedTokenizer
 from training_config import TrainingConfig
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# File names of the exported variants; the ML worker selects one of them by MODEL_VARIANT.
+MODEL_VARIANTS = {
+    "fp32": "model.onnx",
+    "optimized": "model.opt.onnx",
+    "int8": "model.int8.onnx",
+}
+
 
 class ONNXExporter:
     """
@@ -74,7 +87,240 @@ class ONNXExporter:
             )
 
             logger.info(f"Model successfully exported to {self.config.output_dir}/model.onnx")
+            self.save_tokenizer()
 
         except Exception as e:
             logger.error(f"Failed to export model to ONNX: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def save_tokenizer(self) -> str:
+        """
+        Save the Rust tokenizer as tokenizer.json next to the model, with its padding
+        config, so the ML worker can load it without importing transformers
+        (TOKENIZER_NAME=<path>/tokenizer.json).
+
+        Returns:
+            str: Path to the tokenizer file.
+        """
+        output_path = os.path.join(self.config.output_dir, "tokenizer.json")
+        backend = self.tokenizer.backend_tokenizer
+        backend.enable_padding(pad_id=self.tokenizer.pad_token_id, pad_token=self.tokenizer.pad_token)
+        backend.save(output_path)
+        logger.info(f"Tokenizer saved to {output_path}")
+        return output_path
+
+    def optimize(self) -> str:
+        """
+        Build an ONNX Runtime optimized graph with fused attention, LayerNorm and GELU.
+
+        Returns:
+            str: Path to the optimized model.
+        """
+        from onnxruntime.transformers.optimizer import optimize_model
+
+        output_path = self._variant_path("optimized")
+        optimized = optimize_model(
+            self._variant_path("fp32"),
+            model_type="bert",
+            num_heads=self.model.config.num_attention_heads,
+            hidden_size=self.model.config.hidden_size,
+        )
+        optimized.save_model_to_file(output_path)
+        logger.info(f"Fused operators: {optimized.get_fused_operator_statistics()}")
+        logger.info(f"Optimized model saved to {output_path}")
+        return output_path
+
+    def quantize(self) -> str:
+        """
+        Build a dynamically quantized INT8 model, from the optimized graph when it exists.
+
+        Returns:
+            str: Path to the quantized model.
+        """
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        source = self._variant_path("optimized")
+        if not os.path.exists(source):
+            source = self._variant_path("fp32")
+        output_path = self._variant_path("int8")
+        quantize_dynamic(source, output_path, weight_type=QuantType.QInt8)
+        logger.info(f"INT8 model saved to {output_path}")
+        return output_path
+
+    def parity_report(self, texts: List[str], labels: List[int], batch_size: int = 64,
+                      max_length: int = 128) -> Dict[str, Any]:
+        """
+        Compare every exported variant against the fp32 model on a validation set.
+
+        Args:
+            texts (List[str]): Validation texts.
+            labels (List[int]): Validation labels.
+            batch_size (int): Inference batch size. Defaults to 64.
+            max_length (int): Tokenizer truncation length, as in the ML worker. Defaults to 128.
+
+        Returns:
+            Dict[str, Any]: Argmax agreement with fp32, weighted F1 and F1 delta per variant.
+        """
+        predictions = {}
+        for variant in MODEL_VARIANTS:
+            path = self._variant_path(variant)
+            if os.path.exists(path):
+                predictions[variant] = self._predict_onnx(path, texts, batch_size, max_length)
+
+        reference = predictions["fp32"]
+        reference_f1 = f1_score(labels, reference, average="weighted")
+        report = {}
+        for variant, preds in predictions.items():
+            f1 = f1_score(labels, preds, average="weighted")
+            report[variant] = {
+                "file": MODEL_VARIANTS[variant],
+                "size_mb": os.path.getsize(self._variant_path(variant)) / 2 ** 20,
+                "argmax_agreement": float(np.mean(preds == reference)),
+                "f1": f1,
+                "f1_delta": f1 - reference_f1,
+            }
+
+        report_path = os.path.join(self.config.output_dir, "parity_report.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Parity report saved to {report_path}")
+        return report
+
+    def calibrate_cascade(self, texts: List[str], labels: List[int], fast_variant: str = "int8",
+                          full_variant: str = "fp32", f1_tolerance: float = 0.005,
+                          batch_size: int = 64, max_length: int = 128) -> Dict[str, Any]:
+        """
+        Pick the confidence threshold for the ML worker cascade (CASCADE_THRESHOLD).
+
+        Texts whose top fast-model probability is below the threshold are relabelled
+        by the full model. The chosen threshold is the lowest one, i.e. the one
+        sending the fewest texts to the full model, whose weighted F1 stays within
+        `f1_tolerance` of the full model alone.
+
+        Args:
+            texts (List[str]): Validation texts.
+            labels (List[int]): Validation labels.
+            fast_variant (str): First-stage model, as CASCADE_VARIANT. Defaults to "int8".
+            full_variant (str): Second-stage model, as MODEL_VARIANT. Defaults to "fp32".
+            f1_tolerance (float): Allowed weighted F1 loss against the full model. Defaults to 0.005.
+            batch_size (int): Inference batch size. Defaults to 64.
+            max_length (int): Tokenizer truncation length, as in the ML worker. Defaults to 128.
+
+        Returns:
+            Dict[str, Any]: The chosen threshold, its F1 and routed fraction, and the whole sweep.
+        """
+        fast_probs = self._predict_proba_onnx(self._variant_path(fast_variant), texts, batch_size, max_length)
+        full_preds = self._predict_onnx(self._variant_path(full_variant), texts, batch_size, max_length)
+        fast_preds = np.argmax(fast_probs, axis=1)
+        confidence = fast_probs.max(axis=1)
+        full_f1 = f1_score(labels, full_preds, average="weighted")
+
+        sweep = []
+        # Every distinct confidence is a point where the routing changes; the
+        # last threshold routes everything, so the tolerance is always met.
+        for threshold in np.unique(np.append(confidence, np.nextafter(confidence.max(), np.inf))):
+            routed = confidence < threshold
+            preds = np.where(routed, full_preds, fast_preds)
+            sweep.append({
+                "threshold": float(threshold),
+                "routed_fraction": float(routed.mean()),
+                "f1": f1_score(labels, preds, average="weighted"),
+            })
+
+        chosen = next(point for point in sweep if point["f1"] >= full_f1 - f1_tolerance)
+        report = {
+            "fast_variant": fast_variant,
+            "full_variant": full_variant,
+            "full_f1": full_f1,
+            "f1_tolerance": f1_tolerance,
+            **chosen,
+            "sweep": sweep,
+        }
+
+        report_path = os.path.join(self.config.output_dir, "cascade_report.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(
+            f"Cascade threshold {chosen['threshold']:.4f}: {chosen['routed_fraction']:.1%} of texts "
+            f"go to {full_variant}, F1 {chosen['f1']:.4f} vs {full_f1:.4f}"
+        )
+        return report
+
+    def latency_report(self, texts: List[str], labels: List[int], batch_size: int = 32,
+                       max_length: int = 128, threads: int = 1) -> Dict[str, Any]:
+        """
+        Measure the throughput and weighted F1 of every exported variant.
+
+        Sessions run with `threads` intra-op threads (one core by default), so the
+        numbers compare across models and hosts. Tokenization is not timed.
+
+        Args:
+            texts (List[str]): Validation texts.
+            labels (List[int]): Validation labels.
+            batch_size (int): Inference batch size. Defaults to 32.
+            max_length (int): Tokenizer truncation length, as in the ML worker. Defaults to 128.
+            threads (int): Intra-op threads of the session. Defaults to 1.
+
+        Returns:
+            Dict[str, Any]: Texts per second, milliseconds per text and F1 per variant.
+        """
+        batches = [
+            self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                           max_length=max_length, return_tensors="np")
+            for start in range(0, len(texts), batch_size)
+        ]
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+
+        report = {}
+        for variant in MODEL_VARIANTS:
+            path = self._variant_path(variant)
+            if not os.path.exists(path):
+                continue
+            session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            preds = []
+            started = time.perf_counter()
+            for inputs in batches:
+                logits = session.run(None, {
+                    "input_ids": inputs["input_ids"].astype(np.int64),
+                    "attention_mask": inputs["attention_mask"].astype(np.int64),
+                })[0]
+                preds.append(np.argmax(logits, axis=1))
+            elapsed = time.perf_counter() - started
+            report[variant] = {
+                "texts_per_sec": len(texts) / elapsed,
+                "ms_per_text": 1000 * elapsed / len(texts),
+                "f1": f1_score(labels, np.concatenate(preds), average="weighted"),
+            }
+
+        report_path = os.path.join(self.config.output_dir, "latency_report.json")
+        with open(report_path, "w") as f:
+            json.dump({"threads": threads, "batch_size": batch_size, "variants": report}, f, indent=2)
+        logger.info(f"Latency report saved to {report_path}")
+        return report
+
+    def _predict_onnx(self, path: str, texts: List[str], batch_size: int, max_length: int) -> np.ndarray:
+        return np.argmax(self._predict_proba_onnx(path, texts, batch_size, max_length), axis=1)
+
+    def _predict_proba_onnx(self, path: str, texts: List[str], batch_size: int, max_length: int) -> np.ndarray:
+        session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        probs = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=max_length,
+                return_tensors="np",
+            )
+            logits = session.run(None, {
+                "input_ids": inputs["input_ids"].astype(np.int64),
+                "attention_mask": inputs["attention_mask"].astype(np.int64),
+            })[0]
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probs.append(exp / exp.sum(axis=1, keepdims=True))
+        return np.concatenate(probs)
+
+    def _variant_path(self, variant: str) -> str:
+        return os.path.join(self.config.output_dir, MODEL_VARIANTS[variant])
\ No newline at end of file
@@ -1,6 +1,8 @@
 from training_config import TrainingConfig
 
+import math
 import os
+import numpy as np
 import torch
 import pandas as pd
 from transformers import AdamW, get_linear_schedule_with_warmup, AutoModelForSequenceClassification
@@ -15,6 +17,9 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Batches between loss readouts in the progress bar; each readout is a sync point.
+LOG_EVERY = 50
+
 
 class SentimentDataset(Dataset):
     """
@@ -53,6 +58,7 @@ class ModelTrainer:
 
     def __init__(self, model: AutoModelForSequenceClassification, train_loader: torch.utils.data.DataLoader,
                  val_loader: torch.utils.data.DataLoader, config: TrainingConfig = TrainingConfig()):
+        self._set_threads(config)
         self.model = model.to(config.device)
         self.train_loader = train_loader
         self.val_loader = val_loader
@@ -62,6 +68,8 @@ class ModelTrainer:
         self.scheduler = self._create_scheduler()
         self.best_val_loss = float('inf')
         self.metrics: List[Dict[str, Any]] = []
+        self.global_step = 0
+        self._epoch_rng_state = torch.get_rng_state()
         self.class_weights = self._calculate_class_weights()
         if self.class_weights is not None:
             self.criterion = torch.nn.CrossEntropyLoss(weight=self.class_weights.to(config.device))
@@ -72,19 +80,39 @@ class ModelTrainer:
         """
         Calculate class weights for imbalanced datasets.
 
+        Uses the label array of the dataset when it has one (SentimentDataset,
+        TokenizedDataset); only other datasets are read through the loader.
+
         Returns:
             Optional[torch.Tensor]: Tensor of class weights if labels are provided, otherwise None.
         """
-        labels = []
-        for batch in self.train_loader:
-            labels.extend(batch["labels"].tolist())
-        if labels:
-            class_weights = compute_class_weight("balanced", classes=torch.unique(torch.tensor(labels)).tolist(), y=labels)
+        labels = getattr(self.train_loader.dataset, "labels", None)
+        if labels is not None:
+            labels = np.asarray(labels)
+        else:
+            labels = np.array([label for batch in self.train_loader for label in batch["labels"].tolist()])
+        if len(labels):
+            class_weights = compute_class_weight("balanced", classes=np.unique(labels), y=labels)
             return torch.tensor(class_weights, dtype=torch.float32)
         return None
 
+    @staticmethod
+    def _set_threads(config: TrainingConfig) -> None:
+        if config.intra_op_threads:
+            torch.set_num_threads(config.intra_op_threads)
+        if config.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(config.inter_op_threads)
+            except RuntimeError:
+                # Only possible before the first inter-op parallel work in the process.
+                logger.warning("Inter-op threads are already started, inter_op_threads is ignored")
+
+    def _autocast(self):
+        return torch.autocast(device_type=self.config.device.type, dtype=torch.bfloat16, enabled=self.config.bf16)
+
     def _create_scheduler(self):
-        total_steps = len(self.train_loader) * self.config.epochs
+        accumulation = self.config.grad_accumulation_steps
+        total_steps = sum(math.ceil(batches / accumulation) for batches in self._batches_per_epoch())
         warmup_steps = int(total_steps * self.config.warmup_ratio)
         return get_linear_schedule_with_warmup(
             self.optimizer,
@@ -92,39 +120,92 @@ class ModelTrainer:
             num_training_steps=total_steps
         )
 
-    def train_epoch(self, epoch: int) -> float:
+    def _batches_per_epoch(self) -> List[int]:
+        """Batch count of every epoch; with a token budget each shuffle is cut differently."""
+        sampler = self.train_loader.batch_sampler
+        if not hasattr(sampler, "set_epoch"):
+            return [len(self.train_loader)] * self.config.epochs
+        current = sampler.epoch
+        counts = []
+        for epoch in range(self.config.epochs):
+            sampler.set_epoch(epoch)
+            counts.append(len(sampler))
+        sampler.set_epoch(current)
+        return counts
+
+    def train_epoch(self, epoch: int, resume_state: Optional[Dict[str, Any]] = None) -> float:
         """
         Train the model for one epoch.
 
+        Gradients of grad_accumulation_steps batches are summed before each optimizer
+        step. The loss is summed on the device and read out every LOG_EVERY batches only.
+
         Args:
             epoch (int): Current epoch number.
+            resume_state (Optional[Dict[str, Any]]): Checkpoint to continue the epoch from.
 
         Returns:
             float: Average training loss for the epoch.
         """
         self.model.train()
-        epoch_loss = 0.0
-        progress_bar = tqdm(self.train_loader, desc=f"Epoch {epoch + 1}/{self.config.epochs} [Train]")
-
-        for batch in progress_bar:
-            self.optimizer.zero_grad()
+        accumulation = self.config.grad_accumulation_steps
+        batches = self._epoch_batches(epoch, resume_state)
+        # Read once the sampler is on this epoch: token-budget batching varies per shuffle.
+        total = len(self.train_loader)
+        start_batch = resume_state["batch"] if resume_state else 0
+        epoch_loss = torch.tensor(resume_state["epoch_loss"] if resume_state else 0.0, device=self.config.device)
+        progress_bar = tqdm(batches, initial=start_batch, total=total,
+                            desc=f"Epoch {epoch + 1}/{self.config.epochs} [Train]")
+
+        self.optimizer.zero_grad()
+        seen = start_batch
+        for step, batch in enumerate(progress_bar, start=start_batch):
+            seen = step + 1
             inputs = self._prepare_inputs(batch)
-            outputs = self.model(**inputs)
-            logits = outputs.logits
-            labels = inputs["labels"]
-            if self.criterion is not None:
-                loss = self.criterion(logits, labels)
-            else:
-                loss = outputs.loss
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.config.grad_clip)
-            self.optimizer.step()
-            self.scheduler.step()
-
-            epoch_loss += loss.item()
-            progress_bar.set_postfix({"loss": loss.item()})
-
-        return epoch_loss / len(self.train_loader)
+            with self._autocast():
+                outputs = self.model(**inputs)
+                loss = self._compute_loss(outputs, inputs, batch)
+            (loss / accumulation).backward()
+            epoch_loss += loss.detach().float()
+
+            if (step + 1) % accumulation == 0 or step + 1 == total:
+                torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.config.grad_clip)
+                self.optimizer.step()
+                self.scheduler.step()
+                self.optimizer.zero_grad()
+                self.global_step += 1
+                checkpoint_every = self.config.checkpoint_every
+                if checkpoint_every and self.global_step % checkpoint_every == 0 and step + 1 < total:
+                    self.save_checkpoint(epoch, step + 1, epoch_loss.item())
+
+            if (step + 1) % LOG_EVERY == 0:
+                progress_bar.set_postfix({"loss": epoch_loss.item() / (step + 1)})
+
+        return epoch_loss.item() / max(seen, 1)
+
+    def _epoch_batches(self, epoch: int, resume_state: Optional[Dict[str, Any]] = None):
+        """
+        Iterator over the batches of an epoch. On resume the shuffle of the epoch is
+        replayed, the finished batches are passed over and the RNG is put back to
+        where the checkpoint left it.
+        """
+        if resume_state:
+            torch.set_rng_state(resume_state["epoch_rng_state"])
+        self._epoch_rng_state = torch.get_rng_state()
+        start_batch = resume_state["batch"] if resume_state else 0
+
+        sampler = self.train_loader.batch_sampler
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch, start_batch)
+            batches = iter(self.train_loader)
+        else:
+            batches = iter(self.train_loader)
+            for _ in range(start_batch):
+                next(batches)
+
+        if resume_state:
+            torch.set_rng_state(resume_state["rng_state"])
+        return batches
 
     def validate(self) -> Tuple[float, float, float]:
         """
@@ -134,32 +215,48 @@ class ModelTrainer:
             Tuple[float, float, float]: Average validation loss, accuracy, and F1 score.
         """
         self.model.eval()
-        epoch_loss = 0.0
+        epoch_loss = torch.tensor(0.0, device=self.config.device)
         all_preds = []
         all_labels = []
 
-        with torch.no_grad():
+        with torch.no_grad(), self._autocast():
             for batch in tqdm(self.val_loader, desc="Validating"):
                 inputs = self._prepare_inputs(batch)
                 outputs = self.model(**inputs)
-                logits = outputs.logits
+                logits = outputs.logits.float()
                 labels = inputs["labels"]
-                if self.criterion is not None:
-                    loss = self.criterion(logits, labels)
-                else:
-                    loss = outputs.loss
-                epoch_loss += loss.item()
+                epoch_loss += self._label_loss(outputs, labels).float()
 
                 preds = torch.argmax(logits, dim=1).cpu().numpy()
                 all_preds.extend(preds)
                 all_labels.extend(labels.cpu().numpy())
 
-        avg_loss = epoch_loss / len(self.val_loader)
+        avg_loss = epoch_loss.item() / len(self.val_loader)
         accuracy = accuracy_score(all_labels, all_preds)
         f1 = f1_score(all_labels, all_preds, average="weighted")
 
         return avg_loss, accuracy, f1
 
+    def _compute_loss(self, outputs: Any, inputs: Dict[str, torch.Tensor],
+                      batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """
+        Training loss of a batch; subclasses override it to train on other targets.
+
+        Args:
+            outputs (Any): Model outputs for the batch.
+            inputs (Dict[str, torch.Tensor]): Model inputs from _prepare_inputs.
+            batch (Dict[str, torch.Tensor]): The batch as produced by the DataLoader.
+
+        Returns:
+            torch.Tensor: Scalar loss.
+        """
+        return self._label_loss(outputs, inputs["labels"])
+
+    def _label_loss(self, outputs: Any, labels: torch.Tensor) -> torch.Tensor:
+        if self.criterion is not None:
+            return self.criterion(outputs.logits, labels)
+        return outputs.loss
+
     def _prepare_inputs(self, batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         return {
             "input_ids": batch["input_ids"].to(self.config.device),
@@ -167,23 +264,31 @@ class ModelTrainer:
             "labels": batch["labels"].to(self.config.device)
         }
 
-    def train(self) -> List[Dict[str, Any]]:
+    def train(self, resume_from: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Train the model for the specified number of epochs.
 
+        Args:
+            resume_from (Optional[str]): Checkpoint written by save_checkpoint to continue from.
+
         Returns:
             List[Dict[str, Any]]: List of metrics for each epoch.
         """
-        for epoch in range(self.config.epochs):
-            train_loss = self.train_epoch(epoch)
+        start_epoch, resume_state = 0, None
+        if resume_from:
+            resume_state = self.load_checkpoint(resume_from)
+            start_epoch = resume_state["epoch"]
+
+        for epoch in range(start_epoch, self.config.epochs):
+            train_loss = self.train_epoch(epoch, resume_state if epoch == start_epoch else None)
             val_loss, val_acc, val_f1 = self.validate()
 
             self.metrics.append({
                 "epoch": epoch + 1,
                 "train_loss": train_loss,
-                "val_loss": val_loss,
-                "val_accuracy": val_acc,
-                "val_f1": val_f1
+                "val_loss": float(val_loss),
+                "val_accuracy": float(val_acc),
+                "val_f1": float(val_f1)
             })
 
             logger.info(f"\nEpoch {epoch + 1}/{self.config.epochs}")
@@ -193,6 +298,8 @@ class ModelTrainer:
             if val_loss < self.best_val_loss:
                 self.best_val_loss = val_loss
                 self.save_model()
+            if self.config.checkpoint_every:
+                self.save_checkpoint(epoch + 1, 0, 0.0)
 
         self.plot_metrics()
         self.save_metrics_to_excel()
@@ -202,6 +309,60 @@ class ModelTrainer:
         torch.save(self.model.state_dict(), f"{self.config.output_dir}/best_model.pt")
         logger.info(f"Model saved to {self.config.output_dir}/best_model.pt")
 
+    def save_checkpoint(self, epoch: int, batch: int, epoch_loss: float):
+        """
+        Save everything needed to continue training to output_dir/checkpoint.pt.
+
+        Args:
+            epoch (int): Epoch to continue from.
+            batch (int): Batches of that epoch already trained on.
+            epoch_loss (float): Summed loss of those batches.
+        """
+        sampler = self.train_loader.batch_sampler
+        rng_state = torch.get_rng_state()
+        state = {
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scheduler": self.scheduler.state_dict(),
+            "sampler": sampler.state_dict() if hasattr(sampler, "state_dict") else None,
+            "epoch": epoch,
+            "batch": batch,
+            "epoch_loss": epoch_loss,
+            "global_step": self.global_step,
+            "best_val_loss": self.best_val_loss,
+            "metrics": self.metrics,
+            # The shuffle of an epoch is drawn when its iterator is created.
+            "epoch_rng_state": self._epoch_rng_state if batch else rng_state,
+            "rng_state": rng_state,
+        }
+        path = os.path.join(self.config.output_dir, "checkpoint.pt")
+        torch.save(state, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Checkpoint saved to {path} (epoch {epoch + 1}, batch {batch})")
+
+    def load_checkpoint(self, path: str) -> Dict[str, Any]:
+        """
+        Restore the trainer from a checkpoint written by save_checkpoint.
+
+        Args:
+            path (str): Path to checkpoint.pt.
+
+        Returns:
+            Dict[str, Any]: The checkpoint, passed on to train_epoch to continue the epoch.
+        """
+        state = torch.load(path, map_location=self.config.device, weights_only=False)
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.scheduler.load_state_dict(state["scheduler"])
+        sampler = self.train_loader.batch_sampler
+        if state["sampler"] is not None and hasattr(sampler, "load_state_dict"):
+            sampler.load_state_dict(state["sampler"])
+        self.global_step = state["global_step"]
+        self.best_val_loss = state["best_val_loss"]
+        self.metrics = state["metrics"]
+        logger.info(f"Resuming from {path} (epoch {state['epoch'] + 1}, batch {state['batch']})")
+        return state
+
     def plot_metrics(self):
         """
         Plot training and validation metrics.
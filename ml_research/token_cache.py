@@ -0,0 +1,151 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from transformers import PreTrainedTokenizerFast
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Texts tokenized per call while building a cache; bounds the memory of the build.
+CHUNK_SIZE = 10_000
+
+
+def cache_key(texts: Sequence[str], labels: Sequence[int], tokenizer: PreTrainedTokenizerFast,
+              max_length: int) -> str:
+    """
+    Hash of everything the cached arrays depend on.
+
+    Args:
+        texts (Sequence[str]): Input texts.
+        labels (Sequence[int]): Labels for the texts.
+        tokenizer (PreTrainedTokenizerFast): Tokenizer; its serialized vocabulary and pipeline are hashed.
+        max_length (int): Truncation length.
+
+    Returns:
+        str: Hex digest naming the cache directory.
+    """
+    # Calling the tokenizer rewrites its truncation and padding settings, which
+    # max_length already covers.
+    state = json.loads(tokenizer.backend_tokenizer.to_str())
+    state["truncation"] = state["padding"] = None
+    digest = hashlib.sha256()
+    digest.update(json.dumps(state, sort_keys=True).encode())
+    digest.update(str(max_length).encode())
+    for text in texts:
+        digest.update(str(text).encode())
+        digest.update(b"\0")
+    digest.update(np.asarray(labels, dtype=np.int64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def build_token_cache(texts: Sequence[str], labels: Sequence[int], tokenizer: PreTrainedTokenizerFast,
+                      max_length: int, cache_dir: str = "./token_cache") -> str:
+    """
+    Tokenize the texts once into flat arrays on disk, or reuse an existing cache.
+
+    The cache directory holds input_ids.bin (all token ids as int32, without padding),
+    offsets.npy, lengths.npy, labels.npy and meta.json. It is built under a temporary
+    name and renamed when complete, so an interrupted build is never picked up.
+
+    Args:
+        texts (Sequence[str]): Input texts, e.g. a DataFrame column.
+        labels (Sequence[int]): Labels for the texts.
+        tokenizer (PreTrainedTokenizerFast): Tokenizer of the model being trained.
+        max_length (int): Truncation length.
+        cache_dir (str): Directory holding the caches. Defaults to "./token_cache".
+
+    Returns:
+        str: Path to the cache, to be opened with TokenizedDataset.
+    """
+    texts = [str(text) for text in texts]
+    labels = np.asarray(labels, dtype=np.int64)
+    path = os.path.join(cache_dir, cache_key(texts, labels, tokenizer, max_length))
+    if os.path.exists(os.path.join(path, "meta.json")):
+        logger.info(f"Using token cache {path}")
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=".building-", dir=cache_dir)
+    lengths = np.empty(len(texts), dtype=np.int32)
+    with open(os.path.join(build_dir, "input_ids.bin"), "wb") as f:
+        for start in range(0, len(texts), CHUNK_SIZE):
+            encoded = tokenizer(texts[start:start + CHUNK_SIZE], truncation=True, max_length=max_length)["input_ids"]
+            lengths[start:start + len(encoded)] = [len(ids) for ids in encoded]
+            f.write(np.fromiter(itertools.chain.from_iterable(encoded), dtype=np.int32).tobytes())
+
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(os.path.join(build_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(build_dir, "lengths.npy"), lengths)
+    np.save(os.path.join(build_dir, "labels.npy"), labels)
+    with open(os.path.join(build_dir, "meta.json"), "w") as f:
+        json.dump({
+            "count": len(texts),
+            "tokens": int(offsets[-1]),
+            "max_length": max_length,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f)
+
+    try:
+        os.rename(build_dir, path)
+    except OSError:
+        # Another process finished the same cache first.
+        shutil.rmtree(build_dir)
+    logger.info(f"Token cache saved to {path} ({len(texts)} texts, {int(offsets[-1])} tokens)")
+    return path
+
+
+class TokenizedDataset(Dataset):
+    """
+    A PyTorch Dataset over a cache from build_token_cache. The arrays are memory-mapped,
+    so opening the dataset reads nothing and DataLoader workers share the pages.
+    Items have the same fixed-length layout as SentimentDataset unless pad_to_max_length
+    is off; unpadded items are collated by batching.DynamicPaddingCollator.
+
+    Args:
+        path (str): Cache directory returned by build_token_cache.
+        pad_to_max_length (bool): Pad every item to max_length. Defaults to True.
+    """
+
+    def __init__(self, path: str, pad_to_max_length: bool = True):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.max_length = meta["max_length"]
+        self.pad_token_id = meta["pad_token_id"]
+        self.pad_to_max_length = pad_to_max_length
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        if meta["tokens"]:
+            self.input_ids = np.memmap(os.path.join(path, "input_ids.bin"), dtype=np.int32, mode="r")
+        else:
+            self.input_ids = np.empty(0, dtype=np.int32)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        ids = self.input_ids[self.offsets[idx]:self.offsets[idx + 1]]
+        if not self.pad_to_max_length:
+            return {
+                "input_ids": torch.from_numpy(ids.astype(np.int64)),
+                "labels": torch.tensor(self.labels[idx], dtype=torch.long)
+            }
+        input_ids = torch.full((self.max_length,), self.pad_token_id, dtype=torch.long)
+        input_ids[:len(ids)] = torch.from_numpy(ids.astype(np.int64))
+        attention_mask = torch.zeros(self.max_length, dtype=torch.long)
+        attention_mask[:len(ids)] = 1
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "labels": torch.tensor(self.labels[idx], dtype=torch.long)
+        }
+
+    def __len__(self) -> int:
+        return len(self.labels)
@@ -18,6 +18,16 @@ class TrainingConfig:
     device: torch.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     output_dir: str = "./output"
     grad_clip: float = 1.0
+    # Batching (see batching.create_dataloader); the defaults keep fixed, fully padded batches.
+    group_by_length: bool = False
+    max_batch_tokens: int = 0
+    seed: int = 42
+    # CPU training: 0 threads keeps the torch default; checkpoint_every counts optimizer steps, 0 disables.
+    grad_accumulation_steps: int = 1
+    bf16: bool = False
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    checkpoint_every: int = 0
 
     def create_output_dir(self) -> None:
         """Create the output directory if it does not exist."""